@@ -0,0 +1,69 @@
+from typing import List, Tuple
+
+import numpy as np
+
+
+def solve_assignment(scores: np.ndarray) -> List[Tuple[int, int]]:
+    # Pairs rows with columns, each used at most once, so that the sum of scores of the pairs is the largest possible.
+    # Pairs scoring zero or less are left out, so those mark pairs that are not allowed.
+    # The Hungarian algorithm, as the problems here are tiny, a few slots by a few heroes.
+    rows, columns = scores.shape
+    if not rows or not columns:
+        return []
+
+    transposed = rows > columns
+    if transposed:
+        scores = scores.T
+        rows, columns = columns, rows
+
+    # Minimize cost instead, with at least as many columns as rows.
+    cost = scores.max() - scores
+    infinity = float("inf")
+    row_potentials = [0.0] * (rows + 1)
+    column_potentials = [0.0] * (columns + 1)
+    # 1 based row assigned to each 1 based column, column 0 being a sentinel.
+    column_rows = [0] * (columns + 1)
+    previous_columns = [0] * (columns + 1)
+
+    for row in range(1, rows + 1):
+        column_rows[0] = row
+        current_column = 0
+        min_slack = [infinity] * (columns + 1)
+        used = [False] * (columns + 1)
+        while True:
+            used[current_column] = True
+            current_row = column_rows[current_column]
+            delta = infinity
+            next_column = 0
+            for column in range(1, columns + 1):
+                if used[column]:
+                    continue
+                slack = cost[current_row - 1, column - 1] - row_potentials[current_row] - column_potentials[column]
+                if slack < min_slack[column]:
+                    min_slack[column] = slack
+                    previous_columns[column] = current_column
+                if min_slack[column] < delta:
+                    delta = min_slack[column]
+                    next_column = column
+            for column in range(columns + 1):
+                if used[column]:
+                    row_potentials[column_rows[column]] += delta
+                    column_potentials[column] -= delta
+                else:
+                    min_slack[column] -= delta
+            current_column = next_column
+            if column_rows[current_column] == 0:
+                break
+
+        # Flip the augmenting path
+        while current_column:
+            previous_column = previous_columns[current_column]
+            column_rows[current_column] = column_rows[previous_column]
+            current_column = previous_column
+
+    pairs = []
+    for column in range(1, columns + 1):
+        row = column_rows[column]
+        if row and scores[row - 1, column - 1] > 0:
+            pairs.append((column - 1, row - 1) if transposed else (row - 1, column - 1))
+    return sorted(pairs)
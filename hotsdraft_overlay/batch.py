@@ -0,0 +1,195 @@
+import argparse
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Dict, Any, Optional
+
+import cv2
+
+from hotsdraft_overlay import utils
+from hotsdraft_overlay.capture import load_image, capture_regions_from_image
+from hotsdraft_overlay.data import DataProvider
+from hotsdraft_overlay.detection import Detector
+from hotsdraft_overlay.features import get_feature_backend, get_feature_backend_names, DEFAULT_FEATURE_BACKEND
+from hotsdraft_overlay.matching import DetectionEngine
+from hotsdraft_overlay.models import DraftHero, DraftState, FeatureBudget
+from hotsdraft_overlay.scaling import ResolutionPolicy, DEFAULT_PORTRAIT_HEIGHT
+
+SCREENSHOT_SUFFIXES = (".png", ".jpg", ".jpeg", ".bmp", ".npy")
+
+# Each worker process loads the portrait data once, when the pool starts.
+_worker_detector = None
+
+
+def find_screenshots(inputs: List[str]) -> List[str]:
+    # Inputs are directories, whose screenshots are taken, or glob patterns, whose matches are taken as they are.
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            paths.extend(sorted(
+                os.path.join(item, file) for file in os.listdir(item)
+                if os.path.splitext(file)[1].lower() in SCREENSHOT_SUFFIXES and os.path.isfile(os.path.join(item, file))
+            ))
+        else:
+            matches = sorted(path for path in glob.glob(item, recursive=True) if os.path.isfile(path))
+            if not matches:
+                logging.warning("Nothing matches %s", item)
+            paths.extend(matches)
+    return paths
+
+
+def create_data_provider(feature_backend_name: str, feature_budget: Optional[FeatureBudget],
+                         resolution_policy: ResolutionPolicy, feature_workers: Optional[int] = None) -> DataProvider:
+    # Portrait features are extracted at the height regions shrink portraits to.
+    portrait_height = DEFAULT_PORTRAIT_HEIGHT if resolution_policy == ResolutionPolicy.REGION else None
+    return DataProvider(feature_workers=feature_workers, feature_backend=get_feature_backend(feature_backend_name),
+                        feature_budget=feature_budget, portrait_height=portrait_height)
+
+
+def init_worker(feature_backend_name: str, feature_budget: Optional[FeatureBudget], engine: DetectionEngine,
+                resolution_policy: ResolutionPolicy, opencv_threads: Optional[int] = None):
+    global _worker_detector
+    if opencv_threads is not None:
+        # Screenshots are already processed in parallel, one per process, threads on top only compete for cores.
+        cv2.setNumThreads(opencv_threads)
+    # Features are in the cache by now, see main. Screenshots already keep a process per worker busy, so a pool of
+    # feature workers in each of them would only oversubscribe the cores.
+    data_provider = create_data_provider(feature_backend_name, feature_budget, resolution_policy, feature_workers=1)
+    # Screenshots have nothing to do with each other, so nothing is carried over from one to the next. That includes
+    # map banners, which workers would otherwise race to learn into the references the overlay uses, while what a
+    # worker recognizes would depend on which screenshots it happened to get before.
+    _worker_detector = Detector(data_provider, incremental=False, engine=engine, resolution_policy=resolution_policy,
+                                learn_maps=False)
+
+
+def detect_in_worker(path: str) -> Dict[str, Any]:
+    result = {"path": path}
+    try:
+        started = time.perf_counter()
+        image = load_image(path)
+        if image is None:
+            result["error"] = "Could not load screenshot"
+            return result
+        loaded = time.perf_counter()
+        frame = capture_regions_from_image(image, Detector.get_capture_regions)
+        state = _worker_detector.get_frame_draft_state(frame)
+        finished = time.perf_counter()
+    except Exception as e:
+        logging.exception("Failed to process %s", path)
+        result["error"] = str(e)
+        return result
+
+    h, w = image.shape[:2]
+    result.update(get_state_fields(state))
+    result.update({
+        "width": w,
+        "height": h,
+        "load_time": loaded - started,
+        "latency": finished - loaded,
+    })
+    return result
+
+
+def get_state_fields(state: DraftState) -> Dict[str, Any]:
+    return {
+        "map": state.map,
+        "ally_picks": [get_hero_fields(hero) for hero in state.ally_picks],
+        "enemy_picks": [get_hero_fields(hero) for hero in state.enemy_picks],
+        "ally_bans": [get_hero_fields(hero) for hero in state.ally_bans],
+        "enemy_bans": [get_hero_fields(hero) for hero in state.enemy_bans],
+    }
+
+
+def get_hero_fields(hero: DraftHero) -> Dict[str, Any]:
+    return {
+        "name": hero.name,
+        "id": hero.id,
+        "locked": hero.locked,
+        "locked_confidence": round(hero.locked_confidence, 3),
+        "bounding_box": list(hero.bounding_box.tuple),
+    }
+
+
+def report(paths: List[str], latencies: List[float], failures: int, elapsed: float):
+    logging.info("Processed %d screenshots in %.1fs, %.2f frames/s, %d failed", len(paths), elapsed,
+                 len(paths) / elapsed if elapsed > 0 else 0, failures)
+    if latencies:
+        logging.info("Latency per frame p50=%.1fms p95=%.1fms p99=%.1fms max=%.1fms",
+                     utils.get_percentile(latencies, 50) * 1000, utils.get_percentile(latencies, 95) * 1000,
+                     utils.get_percentile(latencies, 99) * 1000, max(latencies) * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Detect drafts in screenshots, one JSON line per screenshot")
+    parser.add_argument("inputs", nargs="+", help="Directories of screenshots or glob patterns")
+    parser.add_argument("--output", default="-", help="File to write results to, - for standard output")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Number of worker processes, 1 to process screenshots in this process")
+    parser.add_argument("--feature-backend", default=DEFAULT_FEATURE_BACKEND, choices=get_feature_backend_names(),
+                        help="Key point detector used to recognize portraits")
+    parser.add_argument("--feature-budget", action="store_true",
+                        help="Limit key points per portrait and per slot, to match faster")
+    parser.add_argument("--engine", default=DetectionEngine.KEYPOINTS.value,
+                        choices=[engine.value for engine in DetectionEngine],
+                        help="Whether to recognize portraits by key points or by templates")
+    parser.add_argument("--resolution-policy", default=ResolutionPolicy.NATIVE.value,
+                        choices=[policy.value for policy in ResolutionPolicy],
+                        help="Whether to shrink parts of the screen before recognizing portraits, and how")
+    args = parser.parse_args()
+    # Results go to standard output, logs to standard error.
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] [%(levelname)s]: %(message)s')
+
+    paths = find_screenshots(args.inputs)
+    if not paths:
+        raise SystemExit("No screenshots found")
+
+    feature_budget = FeatureBudget() if args.feature_budget else None
+    engine = DetectionEngine(args.engine)
+    resolution_policy = ResolutionPolicy(args.resolution_policy)
+    initargs = (args.feature_backend, feature_budget, engine, resolution_policy)
+
+    # Extracts whatever portrait features are missing from the cache once, rather than in every worker.
+    create_data_provider(args.feature_backend, feature_budget, resolution_policy)
+
+    output = sys.stdout if args.output == "-" else open(args.output, "w")
+    executor = None
+    latencies = []
+    failures = 0
+    logging.info("Processing %d screenshots with %d workers", len(paths), max(args.workers, 1))
+    started = time.perf_counter()
+    try:
+        if args.workers <= 1:
+            init_worker(*initargs)
+            results = map(detect_in_worker, paths)
+        else:
+            executor = ProcessPoolExecutor(args.workers, initializer=init_worker, initargs=initargs + (1,))
+            # Results are written as they come, not in the order of the screenshots.
+            results = (future.result() for future in as_completed([
+                executor.submit(detect_in_worker, path) for path in paths
+            ]))
+
+        for result in results:
+            if "error" in result:
+                failures += 1
+            else:
+                latencies.append(result["latency"])
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if output is not sys.stdout:
+            output.close()
+
+    report(paths, latencies, failures, time.perf_counter() - started)
+
+
+if __name__ == "__main__":
+    # Workers need this when frozen by PyInstaller.
+    multiprocessing.freeze_support()
+    main()
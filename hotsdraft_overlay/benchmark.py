@@ -0,0 +1,599 @@
+import argparse
+import json
+import logging
+import os
+import pathlib
+import random
+import threading
+import time
+import tracemalloc
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import List, Tuple, Dict, Optional
+
+import cv2
+import numpy as np
+
+from hotsdraft_overlay import utils
+from hotsdraft_overlay.data import DataProvider
+from hotsdraft_overlay.detection import Detector
+from hotsdraft_overlay.features import get_feature_backend, get_feature_backend_names, DescriptorPrecision, \
+    FeatureBackend, DEFAULT_FEATURE_BACKEND
+from hotsdraft_overlay.matching import CutMatcher, DetectionEngine, VerificationStrategy, ExecutorType, \
+    create_cut_matcher
+from hotsdraft_overlay.models import Portrait, ImageCut, Region, Point, Features, FeatureBudget, DraftState
+from hotsdraft_overlay.prefilter import PrefilterFallback
+from hotsdraft_overlay.scaling import ResolutionPolicy
+from hotsdraft_overlay.suggest import SuggestionClient, CircuitBreaker
+from hotsdraft_overlay.x11 import X11ShmCapture
+
+
+def report_latencies(name: str, latencies: List[float]):
+    if not latencies:
+        print("%-30s no samples" % name)
+        return
+    print("%-30s n=%-5d p50=%7.1fms p95=%7.1fms p99=%7.1fms max=%7.1fms" % (
+        name, len(latencies),
+        utils.get_percentile(latencies, 50) * 1000,
+        utils.get_percentile(latencies, 95) * 1000,
+        utils.get_percentile(latencies, 99) * 1000,
+        max(latencies) * 1000,
+    ))
+
+
+class StandInSuggestionServer(object):
+    # Local stand-in for the suggestion backend, which injects latency: every response takes base_latency seconds,
+    # and slow_probability of them take slow_latency seconds longer. failure_probability of them fail with a 503.
+    def __init__(self, base_latency: float, slow_probability: float, slow_latency: float,
+                 failure_probability: float = 0):
+        self.base_latency = base_latency
+        self.slow_probability = slow_probability
+        self.slow_latency = slow_latency
+        self.failure_probability = failure_probability
+        self.requests = 0
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                server.requests += 1
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+                delay = server.base_latency
+                if random.random() < server.slow_probability:
+                    delay += server.slow_latency
+                time.sleep(delay)
+
+                if random.random() < server.failure_probability:
+                    self.send_response(503)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                body = json.dumps({"scores": [{"id": hero_id, "score": hero_id} for hero_id in range(1, 11)]})
+                body = body.encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.__server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.__server.daemon_threads = True
+        self.__thread = threading.Thread(target=self.__server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return "http://127.0.0.1:%d/draft/list/" % self.__server.server_address[1]
+
+    def __enter__(self):
+        self.__thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.__server.shutdown()
+        self.__server.server_close()
+
+
+def benchmark_suggestions(args):
+    configurations = [
+        ("no hedging", None),
+        ("hedging at p%d" % args.hedge_percentile, args.hedge_percentile),
+    ]
+    for name, hedge_percentile in configurations:
+        with StandInSuggestionServer(args.base_latency, args.slow_probability, args.slow_latency,
+                                     args.failure_probability) as server:
+            client = SuggestionClient(server.url, request_timeout=args.timeout, hedge_percentile=hedge_percentile,
+                                      circuit_breaker=CircuitBreaker(failure_threshold=args.requests + 1))
+            latencies = []
+            failures = 0
+            for idx in range(args.requests):
+                started = time.perf_counter()
+                try:
+                    client.fetch(str(idx), {"map": 1, "league": 0})
+                except Exception:
+                    failures += 1
+                latencies.append(time.perf_counter() - started)
+            client.close()
+
+            report_latencies(name, latencies)
+            print("%-30s failures=%d backend requests=%d" % ("", failures, server.requests))
+
+
+def benchmark_capture(args):
+    # Works against any X server, for example `Xvfb :99 -screen 0 1920x1080x24` with DISPLAY=:99
+    with X11ShmCapture(args.display) as capture:
+        window = capture.root_window
+        if args.window:
+            window = capture.find_window(args.window)
+            if window is None:
+                raise SystemExit("Window %s not found" % args.window)
+
+        configurations = [
+            ("naive XGetImage", capture.grab_naive),
+            ("MIT-SHM", capture.grab),
+        ]
+        for name, grab in configurations:
+            # Warm up, so that one off allocations of buffers are not counted.
+            grab(window)
+
+            # Each frame is dropped before the next one, so the peak is what a single frame allocates.
+            latencies = []
+            tracemalloc.start()
+            for _ in range(args.frames):
+                started = time.perf_counter()
+                image = grab(window)
+                latencies.append(time.perf_counter() - started)
+                if image is None:
+                    raise SystemExit("Failed to capture window")
+                del image
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            report_latencies(name, latencies)
+            print("%-30s fps=%.1f allocated per frame=%.1fKiB retained=%.1fKiB" % (
+                "", len(latencies) / sum(latencies), peak / 1024.0, current / 1024.0
+            ))
+
+
+def make_portrait_cuts(portraits: List[Portrait], heights: List[int], seed: int = 0) -> List[Tuple[str, ImageCut]]:
+    # Stand-ins for slots cut out of a draft screen, each with a single portrait scaled to the given height, placed
+    # off center on a noisy background somewhat taller than the portrait and put through lossy compression, labelled
+    # with the hero they show.
+    random_state = np.random.RandomState(seed)
+    cuts = []
+    for portrait in portraits:
+        for height in heights:
+            h, w = portrait.image.shape[:2]
+            width = int(round(w * height / float(h)))
+            scaled = cv2.resize(portrait.image, (width, height), interpolation=cv2.INTER_AREA)
+
+            margin = random_state.uniform(1.1, 1.45)
+            background = random_state.randint(20, 70, (int(height * margin), width * 2, 3)).astype(np.uint8)
+            background = cv2.GaussianBlur(background, (0, 0), 3)
+            y = random_state.randint(0, background.shape[0] - height + 1)
+            x = random_state.randint(0, background.shape[1] - width + 1)
+            background[y:y + height, x:x + width] = scaled
+
+            _, encoded = cv2.imencode(".jpg", background, [cv2.IMWRITE_JPEG_QUALITY, 85])
+            image = cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+            cuts.append((portrait.hero.name, ImageCut(image, Region.ENEMY_PICKS, Point(0, 0))))
+    return cuts
+
+
+def benchmark_backends(args):
+    cuts = None
+    for name in args.backends:
+        started = time.perf_counter()
+        data_provider = DataProvider(feature_backend=get_feature_backend(name))
+        load_time = time.perf_counter() - started
+
+        if cuts is None:
+            portraits = data_provider.get_portraits()
+            if args.portraits:
+                portraits = portraits[:args.portraits]
+            cuts = make_portrait_cuts(portraits, args.heights)
+
+        report_accuracy(name, CutMatcher(data_provider), cuts)
+        print("%-30s portrait load=%.1fs" % ("", load_time))
+
+
+def benchmark_engines(args):
+    data_provider = DataProvider()
+    portraits = data_provider.get_portraits()
+    if args.portraits:
+        portraits = portraits[:args.portraits]
+    cuts = make_portrait_cuts(portraits, args.heights)
+
+    for engine in DetectionEngine:
+        started = time.perf_counter()
+        cut_matcher = create_cut_matcher(engine, data_provider, args.prefilter_top_k, PrefilterFallback.FULL_SCAN)
+        setup_time = time.perf_counter() - started
+        report_accuracy(engine.value, cut_matcher, cuts)
+        print("%-30s setup=%.2fs" % ("", setup_time))
+
+
+def get_portrait_footprint(portraits: List[Portrait]) -> Dict[str, int]:
+    # Bytes held by the arrays of the portraits, including memory mapped ones, which tracemalloc does not see.
+    footprint = {"images": 0, "points": 0, "descriptors": 0, "colors": 0}
+    for portrait in portraits:
+        if portrait.cached_image is not None:
+            footprint["images"] += portrait.cached_image.nbytes
+        footprint["points"] += portrait.features.points.nbytes
+        if portrait.features.descriptors is not None:
+            footprint["descriptors"] += portrait.features.descriptors.nbytes
+        if portrait.global_descriptor is not None:
+            footprint["colors"] += portrait.global_descriptor.nbytes
+    return footprint
+
+
+def benchmark_memory(args):
+    # Load the portraits once up front, so that none of the configurations pays for extracting features.
+    portraits = DataProvider().get_portraits()
+    if args.portraits:
+        portraits = portraits[:args.portraits]
+    cuts = make_portrait_cuts(portraits, args.heights)
+
+    configurations = [("%s%s" % (precision.value, " with images" if keep_images else ""), precision, keep_images)
+                      for precision in DescriptorPrecision for keep_images in (True, False)]
+    for name, precision, keep_images in configurations:
+        tracemalloc.start()
+        started = time.perf_counter()
+        data_provider = DataProvider(descriptor_precision=precision, keep_images=keep_images)
+        load_time = time.perf_counter() - started
+        traced, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        report_accuracy(name, CutMatcher(data_provider), cuts)
+        footprint = get_portrait_footprint(data_provider.get_portraits())
+        print("%-30s allocated=%.1fMiB portraits=%.1fMiB (%s) load=%.2fs" % (
+            "", traced / 1024.0 ** 2, sum(footprint.values()) / 1024.0 ** 2,
+            " ".join("%s=%.1fMiB" % (key, value / 1024.0 ** 2) for key, value in footprint.items()), load_time
+        ))
+        del data_provider
+
+
+def find_dmatches(portrait: Portrait, cut_features: Features, backend: FeatureBackend):
+    return cv2.BFMatcher(backend.norm_type).knnMatch(
+        backend.get_matchable_descriptors(portrait.features.descriptors), cut_features.descriptors, k=2
+    )
+
+
+def filter_dmatches(all_matches, portrait: Portrait, cut_features: Features, backend: FeatureBackend):
+    # Ratio test and point gathering with a DMatch object per neighbour, for comparison.
+    good_matches = []
+    for pair in all_matches:
+        if len(pair) < 2:
+            continue
+        m, n = pair
+        if m.distance < backend.ratio * n.distance:
+            good_matches.append(m)
+    src_pts = np.float32([portrait.features.points[m.queryIdx] for m in good_matches]).reshape(-1, 2)
+    dst_pts = np.float32([cut_features.points[m.trainIdx] for m in good_matches]).reshape(-1, 2)
+    return src_pts, dst_pts
+
+
+def find_neighbours(portrait: Portrait, cut_features: Features, backend: FeatureBackend):
+    return utils.match_features(portrait.features, cut_features, backend)
+
+
+def filter_neighbours(neighbours, portrait: Portrait, cut_features: Features, backend: FeatureBackend):
+    query_indices, train_indices = utils.apply_ratio_test(neighbours[0], neighbours[1], backend.ratio)
+    return portrait.features.points[query_indices], cut_features.points[train_indices]
+
+
+def benchmark_matches(args):
+    data_provider = DataProvider(feature_backend=get_feature_backend(args.backend))
+    backend = data_provider.get_feature_backend()
+    portraits = data_provider.get_portraits()
+    if args.portraits:
+        portraits = portraits[:args.portraits]
+    cut_features = [
+        utils.extract_features(cut.image, backend) for _, cut in make_portrait_cuts(portraits[:args.cuts], args.heights)
+    ]
+
+    pipelines = [("DMatch objects", find_dmatches, filter_dmatches), ("arrays", find_neighbours, filter_neighbours)]
+    results = {}
+    for name, find, filter_matches in pipelines:
+        # Every portrait against every cut, as when none of them is shortlisted.
+        find_time = filter_time = 0
+        results[name] = []
+        for features in cut_features:
+            started = time.perf_counter()
+            all_matches = [find(portrait, features, backend) for portrait in portraits]
+            found = time.perf_counter()
+            for portrait, matches in zip(portraits, all_matches):
+                results[name].append(filter_matches(matches, portrait, features, backend))
+            find_time += found - started
+            filter_time += time.perf_counter() - found
+
+        pairs = float(len(cut_features) * len(portraits))
+        print("%-30s per portrait: matching=%.1fus filtering=%.1fus" % (
+            name, find_time / pairs * 1e6, filter_time / pairs * 1e6
+        ))
+
+    identical = all(
+        np.array_equal(dmatch_points, array_points)
+        for dmatch_result, array_result in zip(*results.values())
+        for dmatch_points, array_points in zip(dmatch_result, array_result)
+    )
+    print("%-30s identical matches=%s" % ("", identical))
+
+
+def benchmark_budget(args):
+    portraits = DataProvider().get_portraits()
+    if args.portraits:
+        portraits = portraits[:args.portraits]
+    cuts = make_portrait_cuts(portraits, args.heights)
+
+    budgets = [None] + [
+        FeatureBudget(portrait_key_points, cut_key_points)
+        for portrait_key_points, cut_key_points in [(300, 400), (200, 300), (150, 200), (100, 150)]
+    ]
+    for budget in budgets:
+        name = "%d/%d key points" % (budget.portrait_key_points, budget.cut_key_points) if budget else "unlimited"
+        data_provider = DataProvider(feature_budget=budget)
+        cut_matcher = CutMatcher(data_provider, args.prefilter_top_k)
+
+        latencies = []
+        matches = []
+        cut_key_points = []
+        correct = 0
+        for hero_name, cut in cuts:
+            started = time.perf_counter()
+            candidates = cut_matcher.match_candidates(cut)
+            latencies.append(time.perf_counter() - started)
+            if candidates and candidates[0].hero.name == hero_name:
+                correct += 1
+                matches.append(candidates[0].score)
+
+            features = utils.extract_features(cut.image, data_provider.get_feature_backend())
+            if budget:
+                h, w = cut.image.shape[:2]
+                features = utils.select_features(features, budget.cut_key_points, Point(w, h), budget.grid)
+            cut_key_points.append(len(features.points))
+
+        portrait_key_points = [len(portrait.features.points) for portrait in data_provider.get_portraits()]
+        report_latencies(name, latencies)
+        print("%-30s recall=%.1f%% (%d/%d) matches p10=%d p50=%d key points per portrait=%.0f per cut=%.0f" % (
+            "", 100.0 * correct / len(cuts), correct, len(cuts),
+            utils.get_percentile(matches, 10) if matches else 0, utils.get_percentile(matches, 50) if matches else 0,
+            np.mean(portrait_key_points), np.mean(cut_key_points)
+        ))
+
+
+def benchmark_verification(args):
+    data_provider = DataProvider()
+    portraits = data_provider.get_portraits()
+    if args.portraits:
+        portraits = portraits[:args.portraits]
+    cuts = make_portrait_cuts(portraits, args.heights)
+    # Portraits never show up turned sideways, so nothing should be found in these.
+    turned_cuts = [
+        (None, ImageCut(cv2.rotate(cut.image, cv2.ROTATE_90_CLOCKWISE), cut.region, cut.offset)) for _, cut in cuts
+    ]
+
+    for verification in VerificationStrategy:
+        for portrait_height_range in [None, (0.5, 1.05)]:
+            name = "%s/%s" % (verification.value, "scale prior" if portrait_height_range else "any scale")
+            cut_matcher = CutMatcher(data_provider, args.prefilter_top_k, PrefilterFallback.FULL_SCAN, verification,
+                                     portrait_height_range)
+            report_accuracy(name, cut_matcher, cuts)
+            report_accuracy("%s turned" % name, cut_matcher, turned_cuts)
+
+
+def load_screenshots(directory: pathlib.Path) -> List[Tuple[str, np.ndarray, Optional[Dict[str, List[str]]]]]:
+    # Screenshots of drafts, each optionally labelled by a json file of the same name, holding the names of the heroes
+    # in ally_picks, enemy_picks, ally_bans and enemy_bans.
+    screenshots = []
+    for path in sorted(directory.iterdir()):
+        if path.suffix.lower() not in (".png", ".jpg", ".jpeg", ".bmp"):
+            continue
+        image = cv2.imread(path.as_posix())
+        if image is None:
+            logging.warning("Skipping unreadable screenshot %s", path)
+            continue
+        labels_path = path.with_suffix(".json")
+        labels = None
+        if labels_path.exists():
+            with labels_path.open() as fd:
+                labels = json.load(fd)
+        screenshots.append((path.name, image, labels))
+    return screenshots
+
+
+def get_draft_heroes(state: DraftState) -> Dict[str, List[str]]:
+    return {
+        "ally_picks": [hero.name for hero in state.ally_picks],
+        "enemy_picks": [hero.name for hero in state.enemy_picks],
+        "ally_bans": [hero.name for hero in state.ally_bans],
+        "enemy_bans": [hero.name for hero in state.enemy_bans],
+    }
+
+
+def benchmark_resolution(args):
+    screenshots = load_screenshots(pathlib.Path(args.screenshots))
+    if not screenshots:
+        raise SystemExit("No screenshots found in %s" % args.screenshots)
+
+    configurations = [
+        ("native", ResolutionPolicy.NATIVE, None),
+        ("frame", ResolutionPolicy.FRAME, None),
+    ] + [
+        ("region/%dpx portraits" % portrait_height, ResolutionPolicy.REGION, portrait_height)
+        for portrait_height in args.portrait_heights
+    ]
+    # Screenshots without labels are held against what is found in them at native resolution.
+    reference = None
+    for name, policy, portrait_height in configurations:
+        data_provider = DataProvider(portrait_height=portrait_height)
+        detector = Detector(data_provider, incremental=False, engine=DetectionEngine(args.engine),
+                            resolution_policy=policy)
+
+        latencies = []
+        results = []
+        for _, image, _ in screenshots:
+            started = time.perf_counter()
+            state = detector.get_draft_state(image)
+            latencies.append(time.perf_counter() - started)
+            results.append(get_draft_heroes(state))
+        detector.close()
+        if reference is None:
+            reference = results
+
+        correct = 0
+        total = 0
+        extra = 0
+        for (_, _, labels), expected, found in zip(screenshots, reference, results):
+            expected = labels or expected
+            for key, hero_names in expected.items():
+                correct += len(set(found[key]) & set(hero_names))
+                extra += len(set(found[key]) - set(hero_names))
+                total += len(hero_names)
+
+        report_latencies(name, latencies)
+        print("%-30s accuracy=%.1f%% (%d/%d) wrong or extra=%d" % (
+            "", 100.0 * correct / max(total, 1), correct, total, extra
+        ))
+
+
+def benchmark_workers(args):
+    screenshots = load_screenshots(pathlib.Path(args.screenshots))
+    if not screenshots:
+        raise SystemExit("No screenshots found in %s" % args.screenshots)
+
+    print("%d cores available" % (os.cpu_count() or 1))
+    data_provider = DataProvider()
+    for executor_type in args.executors:
+        baseline = None
+        for workers in args.workers:
+            detector = Detector(data_provider, workers=workers, executor_type=ExecutorType(executor_type),
+                                incremental=False, engine=DetectionEngine(args.engine))
+            # The first frame also starts the pool, which is left out.
+            detector.get_draft_state(screenshots[0][1])
+            latencies = []
+            for _ in range(args.repeat):
+                for _, image, _ in screenshots:
+                    started = time.perf_counter()
+                    detector.get_draft_state(image)
+                    latencies.append(time.perf_counter() - started)
+            detector.close()
+
+            median = utils.get_percentile(latencies, 50)
+            if baseline is None:
+                baseline = median
+            report_latencies("%s, %d workers" % (executor_type, workers), latencies)
+            print("%-30s speedup over %d workers=%.2fx" % ("", args.workers[0], baseline / median))
+
+
+def report_accuracy(name: str, cut_matcher, cuts: List[Tuple[Optional[str], ImageCut]]):
+    # Cuts labelled None should not match anything.
+    latencies = []
+    correct = 0
+    for hero_name, cut in cuts:
+        started = time.perf_counter()
+        match = cut_matcher.match(cut)
+        latencies.append(time.perf_counter() - started)
+        if (match.name if match is not None else None) == hero_name:
+            correct += 1
+
+    report_latencies(name, latencies)
+    print("%-30s accuracy=%.1f%% (%d/%d)" % ("", 100.0 * correct / len(cuts), correct, len(cuts)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for parts of the overlay pipeline")
+    subparsers = parser.add_subparsers(dest="benchmark")
+    subparsers.required = True
+
+    suggestions = subparsers.add_parser("suggestions", help="Suggestion client latency against a stand-in backend")
+    suggestions.add_argument("--requests", type=int, default=200)
+    suggestions.add_argument("--base-latency", type=float, default=0.02)
+    suggestions.add_argument("--slow-probability", type=float, default=0.05)
+    suggestions.add_argument("--slow-latency", type=float, default=0.5)
+    suggestions.add_argument("--failure-probability", type=float, default=0)
+    suggestions.add_argument("--hedge-percentile", type=float, default=90)
+    suggestions.add_argument("--timeout", type=float, default=5)
+    suggestions.set_defaults(func=benchmark_suggestions)
+
+    backends = subparsers.add_parser("backends", help="Accuracy and latency of the feature backends")
+    backends.add_argument("--backends", nargs="+", default=get_feature_backend_names(),
+                          choices=get_feature_backend_names())
+    backends.add_argument("--heights", nargs="+", type=int, default=[110, 160, 270],
+                          help="Heights of the portraits in the cuts, in pixels")
+    backends.add_argument("--portraits", type=int, default=0, help="Limit the number of portraits, 0 for all")
+    backends.set_defaults(func=benchmark_backends)
+
+    engines = subparsers.add_parser("engines", help="Accuracy and latency of key point and template matching")
+    engines.add_argument("--heights", nargs="+", type=int, default=[110, 160, 270],
+                         help="Heights of the portraits in the cuts, in pixels")
+    engines.add_argument("--portraits", type=int, default=0, help="Limit the number of portraits, 0 for all")
+    engines.add_argument("--prefilter-top-k", type=int, default=5)
+    engines.set_defaults(func=benchmark_engines)
+
+    budget = subparsers.add_parser("budget", help="Recall and latency with fewer key points per portrait and cut")
+    budget.add_argument("--heights", nargs="+", type=int, default=[110, 160, 270],
+                        help="Heights of the portraits in the cuts, in pixels")
+    budget.add_argument("--portraits", type=int, default=0, help="Limit the number of portraits, 0 for all")
+    budget.add_argument("--prefilter-top-k", type=int, default=5)
+    budget.set_defaults(func=benchmark_budget)
+
+    verification = subparsers.add_parser("verification", help="Accuracy and latency of the ways of verifying matches")
+    verification.add_argument("--heights", nargs="+", type=int, default=[110, 160, 270],
+                              help="Heights of the portraits in the cuts, in pixels")
+    verification.add_argument("--portraits", type=int, default=0, help="Limit the number of portraits, 0 for all")
+    verification.add_argument("--prefilter-top-k", type=int, default=5)
+    verification.set_defaults(func=benchmark_verification)
+
+    matches = subparsers.add_parser("matches", help="Per portrait cost of matching and filtering key points")
+    matches.add_argument("--backend", default=DEFAULT_FEATURE_BACKEND, choices=get_feature_backend_names())
+    matches.add_argument("--heights", nargs="+", type=int, default=[110, 270],
+                         help="Heights of the portraits in the cuts, in pixels")
+    matches.add_argument("--portraits", type=int, default=0, help="Limit the number of portraits, 0 for all")
+    matches.add_argument("--cuts", type=int, default=10, help="Number of portraits to make cuts of")
+    matches.set_defaults(func=benchmark_matches)
+
+    memory = subparsers.add_parser("memory", help="Memory held by the portrait data and its effect on accuracy")
+    memory.add_argument("--heights", nargs="+", type=int, default=[110, 270],
+                        help="Heights of the portraits in the cuts, in pixels")
+    memory.add_argument("--portraits", type=int, default=0, help="Limit the number of portraits, 0 for all")
+    memory.set_defaults(func=benchmark_memory)
+
+    resolution = subparsers.add_parser("resolution", help="Latency and accuracy of resolution policies on screenshots")
+    resolution.add_argument("screenshots", help="Directory of screenshots, optionally labelled, see load_screenshots")
+    resolution.add_argument("--portrait-heights", nargs="+", type=int, default=[60, 80, 100, 120, 160],
+                            help="Heights regions shrink portraits to, in pixels")
+    resolution.add_argument("--engine", default=DetectionEngine.KEYPOINTS.value,
+                            choices=[engine.value for engine in DetectionEngine])
+    resolution.set_defaults(func=benchmark_resolution)
+
+    workers = subparsers.add_parser("workers", help="Latency of detection on screenshots as workers are added")
+    workers.add_argument("screenshots", help="Directory of screenshots, see load_screenshots")
+    workers.add_argument("--workers", nargs="+", type=int,
+                         default=sorted(set([1, 2, 4, os.cpu_count() or 1])),
+                         help="Numbers of workers to try, the first one is the baseline")
+    workers.add_argument("--executors", nargs="+", default=[kind.value for kind in ExecutorType],
+                         choices=[kind.value for kind in ExecutorType])
+    workers.add_argument("--engine", default=DetectionEngine.KEYPOINTS.value,
+                         choices=[engine.value for engine in DetectionEngine])
+    workers.add_argument("--repeat", type=int, default=3, help="Times to go over the screenshots")
+    workers.set_defaults(func=benchmark_workers)
+
+    capture = subparsers.add_parser("capture", help="X11 screen capture rate and allocations")
+    capture.add_argument("--display", help="X display to use, defaults to $DISPLAY")
+    capture.add_argument("--window", help="Title of the window to capture, defaults to the whole screen")
+    capture.add_argument("--frames", type=int, default=100)
+    capture.set_defaults(func=benchmark_capture)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format='[%(asctime)s] [%(levelname)s]: %(message)s')
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+import atexit
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple, Any, List
+
+import numpy as np
+
+from hotsdraft_overlay import utils
+from hotsdraft_overlay.features import FeatureBackend
+from hotsdraft_overlay.models import Features, CacheStats
+
+
+class FeatureCache(object):
+    # Bump whenever the on-disk layout changes.
+    __version = 3
+
+    def __init__(self, directory: Optional[pathlib.Path] = None):
+        if directory is None:
+            directory = utils.get_cache_root() / "features"
+        self.__directory = directory / ("v%d" % self.__version)
+
+    @staticmethod
+    def get_key(image_data: bytes, feature_backend: FeatureBackend, height: Optional[int] = None) -> str:
+        digest = hashlib.sha1(image_data)
+        digest.update(feature_backend.get_signature().encode())
+        if height is not None:
+            # Features of the image shrunk to that height.
+            digest.update(b"height=%d" % height)
+        return digest.hexdigest()
+
+    def load(self, key: str) -> Optional[Features]:
+        paths = self.__get_paths(key)
+        if not all(path.exists() for path in paths):
+            return None
+
+        try:
+            points, descriptors, responses = [self.__load_array(path) for path in paths]
+        except (OSError, ValueError):
+            logging.warning("Discarding unreadable feature cache entry %s", key)
+            return None
+
+        if points.ndim != 2 or points.shape[1] != 2 or not points.shape[0] == descriptors.shape[0] == len(responses):
+            logging.warning("Discarding inconsistent feature cache entry %s", key)
+            return None
+
+        if not len(descriptors):
+            descriptors = None
+        return Features(points, descriptors, responses)
+
+    def store(self, key: str, features: Features):
+        descriptors = features.descriptors
+        if descriptors is None:
+            # Loads as no descriptors, whatever their size would be.
+            descriptors = np.empty((0, 0), dtype=np.uint8)
+        try:
+            self.__directory.mkdir(parents=True, exist_ok=True)
+            for path, array in zip(self.__get_paths(key), (features.points, descriptors, features.responses)):
+                self.__store_array(path, array)
+        except OSError:
+            logging.exception("Failed to store feature cache entry %s", key)
+
+    def __get_paths(self, key: str) -> Tuple[pathlib.Path, pathlib.Path, pathlib.Path]:
+        return (
+            self.__directory / (key + ".points.npy"),
+            self.__directory / (key + ".descriptors.npy"),
+            self.__directory / (key + ".responses.npy"),
+        )
+
+    @staticmethod
+    def __load_array(path: pathlib.Path) -> np.ndarray:
+        try:
+            return np.load(path.as_posix(), mmap_mode='r')
+        except ValueError:
+            # Empty arrays cannot be memory mapped.
+            return np.load(path.as_posix())
+
+    def __store_array(self, path: pathlib.Path, array: np.ndarray):
+        # Write to a temporary file first, so that a crash never leaves a truncated entry behind.
+        fd, temp_path = tempfile.mkstemp(dir=self.__directory.as_posix(), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as temp_file:
+                np.save(temp_file, np.ascontiguousarray(array))
+            os.replace(temp_path, path.as_posix())
+        except Exception:
+            os.unlink(temp_path)
+            raise
+
+
+class ResponseCache(object):
+    # Least recently used cache of JSON serializable values that expire after ttl seconds, optionally persisted to a
+    # file so that entries survive restarts. Safe to use from multiple threads. Changes are written to the file at most
+    # once every flush_delay seconds, off the thread that made them, and on close or exit.
+    __version = 1
+
+    def __init__(self, max_entries: int = 256, ttl: float = 3600, path: Optional[pathlib.Path] = None,
+                 flush_delay: float = 5):
+        self.__max_entries = max_entries
+        self.__ttl = ttl
+        self.__path = path
+        self.__flush_delay = flush_delay
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+        # Only one write to the file at a time, without holding up lookups.
+        self.__save_lock = threading.Lock()
+        self.__dirty = False
+        self.__flush_timer = None
+        self.__hits = 0
+        self.__misses = 0
+        self.__load()
+        if path is not None:
+            atexit.register(self.flush)
+
+    def get(self, key: str, allow_expired: bool = False) -> Optional[Any]:
+        # Expired entries are kept around until evicted, as a fallback for when fresh ones cannot be fetched.
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if allow_expired or time.time() - stored_at <= self.__ttl:
+                    self.__entries.move_to_end(key)
+                    if not allow_expired:
+                        self.__hits += 1
+                    return value
+            if not allow_expired:
+                self.__misses += 1
+            return None
+
+    def put(self, key: str, value: Any):
+        with self.__lock:
+            self.__entries[key] = (time.time(), value)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.__max_entries:
+                self.__entries.popitem(last=False)
+            if self.__path is None:
+                return
+            self.__dirty = True
+            if self.__flush_timer is None:
+                self.__flush_timer = threading.Timer(self.__flush_delay, self.flush)
+                self.__flush_timer.daemon = True
+                self.__flush_timer.start()
+
+    def flush(self):
+        # Writes pending changes to the file, if there are any.
+        with self.__save_lock:
+            with self.__lock:
+                if self.__flush_timer is not None:
+                    self.__flush_timer.cancel()
+                    self.__flush_timer = None
+                if not self.__dirty:
+                    return
+                self.__dirty = False
+                entries = [(key, stored_at, value) for key, (stored_at, value) in self.__entries.items()]
+            self.__save(entries)
+
+    def close(self):
+        self.flush()
+        if self.__path is not None:
+            atexit.unregister(self.flush)
+
+    def get_stats(self) -> CacheStats:
+        with self.__lock:
+            return CacheStats(self.__hits, self.__misses, len(self.__entries))
+
+    def __load(self):
+        if self.__path is None or not self.__path.exists():
+            return
+
+        try:
+            with self.__path.open() as fd:
+                data = json.load(fd)
+        except (OSError, ValueError):
+            logging.warning("Discarding unreadable response cache %s", self.__path)
+            return
+
+        if data.get("version") != self.__version:
+            return
+
+        for key, stored_at, value in data["entries"]:
+            self.__entries[key] = (stored_at, value)
+        while len(self.__entries) > self.__max_entries:
+            self.__entries.popitem(last=False)
+
+    def __save(self, entries: List[Tuple[str, float, Any]]):
+        data = {
+            "version": self.__version,
+            "entries": entries,
+        }
+        try:
+            self.__path.parent.mkdir(parents=True, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=self.__path.parent.as_posix(), suffix=".tmp")
+        except OSError:
+            logging.exception("Failed to store response cache %s", self.__path)
+            return
+
+        try:
+            with os.fdopen(fd, "w") as temp_file:
+                json.dump(data, temp_file)
+            os.replace(temp_path, self.__path.as_posix())
+        except (OSError, TypeError, ValueError):
+            logging.exception("Failed to store response cache %s", self.__path)
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
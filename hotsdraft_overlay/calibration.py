@@ -0,0 +1,164 @@
+import json
+import logging
+import os
+import pathlib
+import tempfile
+import threading
+from typing import Optional, Dict, List, Tuple
+
+import numpy as np
+
+from hotsdraft_overlay import utils
+from hotsdraft_overlay.models import Point, Rect, Region
+
+
+class SlotCalibration(object):
+    # Learns where exactly the portraits of each slot are shown at a resolution, from where portraits were found in
+    # the loose cuts made from fixed fractions of the frame, and keeps them as a profile per resolution, persisted so
+    # that it survives restarts. Slots of a calibrated profile are then cut tightly around the portrait, leaving out
+    # most of the background around it. Slots are identified by their position in the list of cuts.
+    __version = 1
+
+    def __init__(self, directory: Optional[pathlib.Path] = None, margin: float = 0.1, min_observations: int = 3,
+                 tolerance: float = 0.05):
+        if directory is None:
+            directory = utils.get_cache_root() / "calibration"
+        self.__directory = directory / ("v%d" % self.__version)
+        # Share of the portrait size to add around it on each side, as bounding boxes are not pixel exact.
+        self.__margin = margin
+        # Portraits are shown at the same size in all slots of a region, so bounding boxes that are not about the size
+        # most of the region has, within tolerance as a share of the size, are left out. A slot is only trusted once
+        # this many bounding boxes of that size have been found in it.
+        self.__min_observations = min_observations
+        self.__tolerance = tolerance
+        self.__profiles = {}  # type: Dict[Tuple[int, int], Dict[int, Rect]]
+        self.__observations = {}  # type: Dict[Tuple[int, int], Dict[int, Tuple[Region, List[Rect]]]]
+        self.__lock = threading.Lock()
+
+    def get_profile(self, size: Point) -> Dict[int, Rect]:
+        # Rectangles of the calibrated slots in frame coordinates, by slot.
+        with self.__lock:
+            profile = self.__profiles.get(size.tuple)
+            if profile is None:
+                profile = self.__profiles[size.tuple] = self.__load(size)
+            return dict(profile)
+
+    def observe(self, size: Point, bounding_boxes: Dict[int, Tuple[Region, Rect]], bounds: Dict[Region, Rect]):
+        # Takes bounding boxes of portraits found in slots that are not calibrated yet, by slot, in frame coordinates,
+        # and calibrates the slots it can. Calibrated rectangles are kept within the bounds of their region.
+        if not bounding_boxes:
+            return
+
+        with self.__lock:
+            profile = self.__profiles.get(size.tuple)
+            if profile is None:
+                profile = self.__profiles[size.tuple] = self.__load(size)
+            observations = self.__observations.setdefault(size.tuple, {})
+            for slot, (region, bounding_box) in bounding_boxes.items():
+                if slot not in profile:
+                    observations.setdefault(slot, (region, []))[1].append(bounding_box)
+
+            calibrated = {}
+            for region in set(region for region, _ in observations.values()):
+                calibrated.update(self.__calibrate_region(region, observations, bounds[region]))
+            if not calibrated:
+                return
+
+            for slot in calibrated:
+                del observations[slot]
+            profile.update(calibrated)
+            logging.info("Calibrated %d more slots for %dx%d", len(calibrated), size.x, size.y)
+            self.__store(size, profile)
+
+    def discard(self, size: Point, slots: List[int]):
+        # Drops slots whose portraits were not found where they were calibrated, so that they are cut loosely again,
+        # and calibrated anew.
+        with self.__lock:
+            profile = self.__profiles.get(size.tuple)
+            if profile is None:
+                profile = self.__profiles[size.tuple] = self.__load(size)
+            discarded = [slot for slot in slots if slot in profile]
+            if not discarded:
+                return
+
+            observations = self.__observations.get(size.tuple, {})
+            for slot in discarded:
+                del profile[slot]
+                observations.pop(slot, None)
+            logging.warning("Discarded calibration of slots %s for %dx%d", ", ".join(map(str, discarded)), size.x,
+                            size.y)
+            self.__store(size, profile)
+
+    def __calibrate_region(self, region: Region, observations: Dict[int, Tuple[Region, List[Rect]]],
+                           bounds: Rect) -> Dict[int, Rect]:
+        slots = [slot for slot, (slot_region, _) in observations.items() if slot_region == region]
+        sizes = np.array([
+            (rect.width, rect.height) for slot in slots for rect in observations[slot][1]
+        ], dtype=np.float64).reshape(-1, 2)
+        if len(sizes) < self.__min_observations:
+            return {}
+
+        # Bounding boxes of the wrong size come from bad matches, and are left out.
+        width, height = np.median(sizes, axis=0)
+        if min(width, height) <= 0:
+            return {}
+
+        margin_x = width * (0.5 + self.__margin)
+        margin_y = height * (0.5 + self.__margin)
+        calibrated = {}
+        for slot in slots:
+            centers = [
+                ((rect.top_left.x + rect.bottom_right.x) / 2.0, (rect.top_left.y + rect.bottom_right.y) / 2.0)
+                for rect in observations[slot][1] if self.__agrees(rect, width, height)
+            ]
+            if len(centers) < self.__min_observations:
+                continue
+            x, y = np.median(centers, axis=0)
+            calibrated[slot] = Rect(
+                Point(max(int(round(x - margin_x)), bounds.top_left.x),
+                      max(int(round(y - margin_y)), bounds.top_left.y)),
+                Point(min(int(round(x + margin_x)), bounds.bottom_right.x),
+                      min(int(round(y + margin_y)), bounds.bottom_right.y)),
+            )
+        return calibrated
+
+    def __agrees(self, rect: Rect, width: float, height: float) -> bool:
+        return (
+                abs(rect.width - width) <= self.__tolerance * width and
+                abs(rect.height - height) <= self.__tolerance * height
+        )
+
+    def __get_path(self, size: Point) -> pathlib.Path:
+        return self.__directory / ("%dx%d.json" % size.tuple)
+
+    def __load(self, size: Point) -> Dict[int, Rect]:
+        path = self.__get_path(size)
+        if not path.exists():
+            return {}
+
+        try:
+            with path.open() as fd:
+                data = json.load(fd)
+            profile = {
+                int(slot): Rect(Point(x0, y0), Point(x1, y1)) for slot, (x0, y0, x1, y1) in data["slots"].items()
+            }
+        except (OSError, ValueError, KeyError, TypeError):
+            logging.warning("Discarding unreadable calibration profile %s", path)
+            return {}
+
+        logging.debug("Loaded calibration of %d slots for %dx%d", len(profile), size.x, size.y)
+        return profile
+
+    def __store(self, size: Point, profile: Dict[int, Rect]):
+        data = {
+            "size": list(size.tuple),
+            "slots": {str(slot): list(rect.tuple) for slot, rect in sorted(profile.items())},
+        }
+        try:
+            self.__directory.mkdir(parents=True, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=self.__directory.as_posix(), suffix=".tmp")
+            with os.fdopen(fd, "w") as temp_file:
+                json.dump(data, temp_file, indent=2)
+            os.replace(temp_path, self.__get_path(size).as_posix())
+        except OSError:
+            logging.exception("Failed to store calibration profile for %dx%d", size.x, size.y)
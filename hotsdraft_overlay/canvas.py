@@ -2,24 +2,33 @@ import ctypes
 import logging
 import os
 import os.path
-from typing import Optional, Any, List
+import threading
+from typing import Optional, Any, List, Dict
 
 import cv2
 import numpy as np
 from PyQt5.Qt import Qt
-from PyQt5.QtCore import QPoint, QTimer
+from PyQt5.QtCore import QRect, QTimer
 from PyQt5.QtGui import QImage, QPainter
 from PyQt5.QtWidgets import QMainWindow, QDesktopWidget
-from desktopmagic.screengrab_win32 import getRectAsImage
-from win32gui import GetWindowText, GetForegroundWindow, GetClientRect, ClientToScreen, FindWindow
 
-from hotsdraft_overlay.models import Rect, Point
+from hotsdraft_overlay.capture import RegionProvider, capture_regions_from_image, clip_rect, load_image
+from hotsdraft_overlay.models import Rect, Point, CapturedFrame, CapturedRegion
 from hotsdraft_overlay.painting import PaintCommand
+from hotsdraft_overlay.x11 import X11ShmCapture
+
+try:
+    from desktopmagic.screengrab_win32 import getRectAsImage
+    from win32gui import GetWindowText, GetForegroundWindow, GetClientRect, ClientToScreen, FindWindow
+except ImportError:
+    # Only available on Windows, which WindowCanvas needs, the other canvases work anywhere.
+    getRectAsImage = None
 
 
 class BaseCanvas(QMainWindow):
     def __init__(self):
-        ctypes.windll.user32.SetProcessDPIAware()
+        if hasattr(ctypes, "windll"):
+            ctypes.windll.user32.SetProcessDPIAware()
         super().__init__()
         self.__paint_commands = []
         self.init()
@@ -32,6 +41,13 @@ class BaseCanvas(QMainWindow):
     def capture(self):
         raise NotImplemented()
 
+    def capture_regions(self, get_regions: RegionProvider) -> Optional[CapturedFrame]:
+        # Canvases that can capture parts of the screen should override this to avoid capturing the whole frame.
+        image = self.capture()
+        if image is None:
+            return None
+        return capture_regions_from_image(image, get_regions)
+
     def execute_paint_commands(self, paint_commands: List[PaintCommand]):
         self.__paint_commands = paint_commands
         self.repaint()
@@ -72,6 +88,27 @@ class WindowCanvas(BaseCanvas):
                 return cv2.cvtColor(np.array(screen_shot), cv2.COLOR_RGB2BGR)
         return None
 
+    def capture_regions(self, get_regions: RegionProvider) -> Optional[CapturedFrame]:
+        hwnd = GetForegroundWindow()
+        if not hwnd or GetWindowText(hwnd) != self.__window_name:
+            return None
+
+        rect = self.__get_handle_rect(hwnd)
+        self.__maybe_align(rect)
+
+        # Grab and convert just the regions, rather than the whole window.
+        size = Point(rect.bottom_right.x - rect.top_left.x, rect.bottom_right.y - rect.top_left.y)
+        regions = []
+        for region_rect in get_regions(size):
+            region_rect = clip_rect(region_rect, size)
+            screen_rect = Rect(
+                Point(rect.top_left.x + region_rect.top_left.x, rect.top_left.y + region_rect.top_left.y),
+                Point(rect.top_left.x + region_rect.bottom_right.x, rect.top_left.y + region_rect.bottom_right.y),
+            )
+            screen_shot = getRectAsImage(screen_rect.tuple)
+            regions.append(CapturedRegion(region_rect, cv2.cvtColor(np.array(screen_shot), cv2.COLOR_RGB2BGR)))
+        return CapturedFrame(size, regions)
+
     def paintEvent(self, e):
         self.__align_to_target_window()
         super().paintEvent(e)
@@ -107,6 +144,109 @@ class WindowCanvas(BaseCanvas):
         return Rect(Point(x, y), Point(x1, y1))
 
 
+class X11Canvas(BaseCanvas):
+    # Overlay for X11, which captures the target window through shared memory. Captured images are reused buffers, so
+    # they are only valid until the next capture.
+    def __init__(self, window_name, display_name: Optional[str] = None):
+        super().__init__()
+        self.__window_name = window_name
+        self.__display_name = display_name
+        self.__local = threading.local()
+        self.__window = None
+        self.__last_rect = None
+        self.__buffers = {}  # type: Dict[Any, np.ndarray]
+
+    def init(self):
+        self.setAttribute(Qt.WA_TranslucentBackground)
+        self.setAttribute(Qt.WA_TransparentForMouseEvents)
+        self.setWindowFlag(Qt.WindowStaysOnTopHint)
+        self.setWindowFlag(Qt.FramelessWindowHint)
+        self.setWindowFlag(Qt.Tool)
+
+    def capture(self) -> Optional[Any]:
+        window, rect = self.__get_foreground_window()
+        if window is None:
+            return None
+
+        image = self.__get_capture().grab(window)
+        if image is None:
+            return None
+        return self.__to_bgr(image, "window")
+
+    def capture_regions(self, get_regions: RegionProvider) -> Optional[CapturedFrame]:
+        window, rect = self.__get_foreground_window()
+        if window is None:
+            return None
+
+        capture = self.__get_capture()
+        size = Point(rect.width, rect.height)
+        regions = []
+        for region_rect in get_regions(size):
+            region_rect = clip_rect(region_rect, size)
+            if region_rect.width <= 0 or region_rect.height <= 0:
+                regions.append(CapturedRegion(region_rect, np.empty((0, 0, 3), dtype=np.uint8)))
+                continue
+            image = capture.grab(window, region_rect)
+            if image is None:
+                return None
+            regions.append(CapturedRegion(region_rect, self.__to_bgr(image, region_rect.tuple)))
+        return CapturedFrame(size, regions)
+
+    def paintEvent(self, e):
+        self.__align_to_target_window()
+        super().paintEvent(e)
+
+    def __align_to_target_window(self):
+        if self.__window is not None:
+            rect = self.__get_capture().get_window_rect(self.__window)
+            if rect is not None:
+                self.__maybe_align(rect)
+
+    def __get_capture(self) -> X11ShmCapture:
+        # Xlib connections should not be shared between threads, and captures happen off the UI thread.
+        capture = getattr(self.__local, "capture", None)
+        if capture is None:
+            capture = X11ShmCapture(self.__display_name)
+            self.__local.capture = capture
+        return capture
+
+    def __get_foreground_window(self):
+        capture = self.__get_capture()
+        rect = capture.get_window_rect(self.__window) if self.__window is not None else None
+        if rect is None:
+            # The window is not there yet, or has been recreated.
+            self.__window = capture.find_window(self.__window_name)
+            if self.__window is None:
+                return None, None
+            rect = capture.get_window_rect(self.__window)
+        if rect is None or not capture.is_focused(self.__window):
+            return None, None
+        self.__maybe_align(rect)
+        return self.__window, rect
+
+    def __to_bgr(self, image: np.ndarray, key) -> np.ndarray:
+        # Converts into a buffer kept per region, so that capturing allocates nothing once buffers exist.
+        h, w = image.shape[:2]
+        buffer = self.__buffers.get(key)
+        if buffer is None or buffer.shape[:2] != (h, w):
+            buffer = np.empty((h, w, 3), dtype=np.uint8)
+            self.__buffers[key] = buffer
+        return cv2.cvtColor(image, cv2.COLOR_BGRA2BGR, dst=buffer)
+
+    def __maybe_align(self, rect: Rect):
+        if rect == self.__last_rect:
+            return
+
+        self.__last_rect = rect
+        # Run in UI thread
+        QTimer.singleShot(0, self.__adjust_geometry)
+
+    def __adjust_geometry(self):
+        logging.debug("Moving overlay to %s" % self.__last_rect)
+        self.setGeometry(self.__last_rect.qrect)
+        self.updateGeometry()
+
+
 class ScreenshotCanvas(BaseCanvas):
     def __init__(self, directory):
         self.__desktop_size = QDesktopWidget().screenGeometry().size()
@@ -117,42 +257,83 @@ class ScreenshotCanvas(BaseCanvas):
             if os.path.isfile(os.path.join(directory, file))
         ]
         self.__current_image = None
+        # The current image converted for painting, once per image rather than on every paint.
+        self.__current_qimage = None
 
     def init(self):
         self.setWindowTitle("Screenshot preview")
         self.setBaseSize(self.__desktop_size)
 
     def capture(self) -> Optional[Any]:
+        if not self.__load_next():
+            return None
+
+        img_h, img_w = self.__current_image.shape[:2]
+        scale = self.__get_scale(img_w, img_h)
+        if scale < 1:
+            return cv2.resize(self.__current_image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        return self.__current_image
+
+    def capture_regions(self, get_regions: RegionProvider) -> Optional[CapturedFrame]:
+        if not self.__load_next():
+            return None
+
+        # Only resize the regions, in the coordinates of the image scaled to fit the window.
+        img_h, img_w = self.__current_image.shape[:2]
+        scale = self.__get_scale(img_w, img_h)
+        if scale >= 1:
+            return capture_regions_from_image(self.__current_image, get_regions)
+
+        size = Point(int(round(img_w * scale)), int(round(img_h * scale)))
+        regions = []
+        for rect in get_regions(size):
+            rect = clip_rect(rect, size)
+            source = self.__current_image[
+                     int(rect.top_left.y / scale):int(rect.bottom_right.y / scale),
+                     int(rect.top_left.x / scale):int(rect.bottom_right.x / scale)
+                     ]
+            image = cv2.resize(source, (rect.width, rect.height), interpolation=cv2.INTER_AREA)
+            regions.append(CapturedRegion(rect, image))
+        return CapturedFrame(size, regions)
+
+    def __load_next(self) -> bool:
         if not self.__screenshots:
             self.__current_image = None
+            self.__current_qimage = None
             self.__set_title("No more images left")
-        else:
-            path = self.__screenshots.pop(0)
-            logging.debug("Providing screenshot %s", path)
-            self.__set_title("Preview %s" % path)
-            cv_image = cv2.imread(path)
-
-            img_h, img_w = cv_image.shape[:2]
-            window_h, window_w = self.size().height(), self.size().width()
+            return False
 
-            biggest_ratio = max(float(img_h) / window_h, float(img_w) / window_w)
-            if biggest_ratio > 1:
-                cv_image = cv2.resize(cv_image, None, fx=1.0 / biggest_ratio, fy=1.0 / biggest_ratio,
-                                      interpolation=cv2.INTER_AREA)
+        path = self.__screenshots.pop(0)
+        logging.debug("Providing screenshot %s", path)
+        self.__set_title("Preview %s" % path)
+        self.__current_image = load_image(path)
+        self.__current_qimage = self.__get_qimage(self.__current_image)
+        self.repaint()
+        return self.__current_image is not None
 
-            self.__current_image = cv_image
-            self.repaint()
-
-        return self.__current_image
+    def __get_scale(self, img_w: int, img_h: int) -> float:
+        window_h, window_w = self.size().height(), self.size().width()
+        biggest_ratio = max(float(img_h) / window_h, float(img_w) / window_w)
+        return 1.0 / biggest_ratio
 
     def __set_title(self, title):
         # Needs to run on UI thread
         QTimer.singleShot(0, lambda t=title: self.setWindowTitle(t))
 
+    @staticmethod
+    def __get_qimage(image) -> Optional[QImage]:
+        if image is None:
+            return None
+        image = np.ascontiguousarray(image)
+        # Swapping makes a copy, which does not depend on the array staying around.
+        return QImage(image, image.shape[1], image.shape[0], image.shape[1] * 3, QImage.Format_RGB888).rgbSwapped()
+
     def paintEvent(self, e):
-        if self.__current_image is not None:
-            img = self.__current_image
+        qimg = self.__current_qimage
+        if qimg is not None:
+            img_w, img_h = qimg.width(), qimg.height()
+            scale = min(self.__get_scale(img_w, img_h), 1.0)
             painter = QPainter(self)
-            qimg = QImage(img, img.shape[1], img.shape[0], img.shape[1] * 3, QImage.Format_RGB888).rgbSwapped()
-            painter.drawImage(QPoint(0, 0), qimg)
+            # Let Qt scale the preview to match the coordinates of the captured frame.
+            painter.drawImage(QRect(0, 0, int(round(img_w * scale)), int(round(img_h * scale))), qimg)
         super().paintEvent(e)
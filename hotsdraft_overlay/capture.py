@@ -0,0 +1,68 @@
+import logging
+import os
+from typing import Optional, Any, List, Callable
+
+import cv2
+import numpy as np
+
+from hotsdraft_overlay.models import Rect, Point, CapturedFrame, CapturedRegion
+
+# Given the size of the frame, returns the regions of it that need capturing.
+RegionProvider = Callable[[Point], List[Rect]]
+
+
+def clip_rect(rect: Rect, size: Point) -> Rect:
+    return Rect(
+        Point(min(max(rect.top_left.x, 0), size.x), min(max(rect.top_left.y, 0), size.y)),
+        Point(min(max(rect.bottom_right.x, 0), size.x), min(max(rect.bottom_right.y, 0), size.y)),
+    )
+
+
+def capture_regions_from_image(image, get_regions: RegionProvider) -> CapturedFrame:
+    # Regions are views into the image, nothing is copied.
+    h, w = image.shape[:2]
+    size = Point(w, h)
+    regions = []
+    for rect in get_regions(size):
+        rect = clip_rect(rect, size)
+        regions.append(CapturedRegion(
+            rect, image[rect.top_left.y:rect.bottom_right.y, rect.top_left.x:rect.bottom_right.x]
+        ))
+    return CapturedFrame(size, regions)
+
+
+def load_image(path: str) -> Optional[Any]:
+    # Raw BGR frames saved with numpy are memory mapped, so only the pages backing captured regions are ever read.
+    if os.path.splitext(path)[1].lower() == ".npy":
+        return np.load(path, mmap_mode='r')
+    return cv2.imread(path)
+
+
+class FileCapture(object):
+    # Headless capture source that provides frames from files, one per capture, in order.
+    def __init__(self, paths: List[str]):
+        self.__paths = list(paths)
+
+    @staticmethod
+    def from_directory(directory: str) -> 'FileCapture':
+        return FileCapture(sorted(
+            os.path.join(directory, file)
+            for file in os.listdir(directory)
+            if os.path.isfile(os.path.join(directory, file))
+        ))
+
+    def capture(self) -> Optional[Any]:
+        while self.__paths:
+            path = self.__paths.pop(0)
+            image = load_image(path)
+            if image is not None:
+                logging.debug("Providing frame %s", path)
+                return image
+            logging.warning("Could not load %s", path)
+        return None
+
+    def capture_regions(self, get_regions: RegionProvider) -> Optional[CapturedFrame]:
+        image = self.capture()
+        if image is None:
+            return None
+        return capture_regions_from_image(image, get_regions)
@@ -1,18 +1,43 @@
 import json
+import logging
+import pathlib
 import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from typing import List, Optional
 
 import cv2
+import numpy as np
 
 from hotsdraft_overlay import utils
-from hotsdraft_overlay.models import Portrait, Hero
+from hotsdraft_overlay.cache import FeatureCache
+from hotsdraft_overlay.features import FeatureBackend, DescriptorPrecision, get_feature_backend
+from hotsdraft_overlay.index import PortraitIndex
+from hotsdraft_overlay.models import Portrait, Hero, Features, Point, FeatureBudget, Rect
+from hotsdraft_overlay.prefilter import PortraitPrefilter, get_global_descriptor
+from hotsdraft_overlay.slots import get_lock_statistics
 
 
 class DataProvider(object):
     __known_missing_heroes = ['deathwing']
 
-    def __init__(self):
+    def __init__(self, feature_cache: Optional[FeatureCache] = None, feature_workers: Optional[int] = None,
+                 feature_backend: Optional[FeatureBackend] = None,
+                 descriptor_precision: DescriptorPrecision = DescriptorPrecision.UINT8, keep_images: bool = False,
+                 feature_budget: Optional[FeatureBudget] = None, portrait_height: Optional[int] = None):
+        self.__feature_cache = feature_cache or FeatureCache()
+        self.__feature_backend = feature_backend or get_feature_backend()
+        self.__feature_workers = feature_workers
+        # Limits key points of both portraits and cuts, None to keep all of them.
+        self.__feature_budget = feature_budget
+        # Height portraits are shrunk to before extracting their features, to match cuts shrunk so that portraits in
+        # them are about as tall. None to extract them from portraits as they are.
+        self.__portrait_height = portrait_height
+        self.__descriptor_precision = descriptor_precision
+        # Portrait images are otherwise decoded again whenever they are needed.
+        self.__keep_images = keep_images
         self.__portraits = []
+        self.__portrait_index = None
+        self.__portrait_prefilter = None
         self.__map_to_id = {}
         self.__hero_name_to_hero = {}
         self.__id_to_hero = {}
@@ -21,6 +46,8 @@ class DataProvider(object):
         self.__populate_portraits()
         self.__populate_word_file()
         self.__validate()
+        self.__portrait_index = PortraitIndex(self.__portraits, self.__feature_backend)
+        self.__portrait_prefilter = PortraitPrefilter(self.__portraits)
 
     def get_hero_by_id(self, hero_id) -> Optional[Hero]:
         return self.__id_to_hero.get(hero_id)
@@ -31,6 +58,30 @@ class DataProvider(object):
     def get_portraits(self) -> List[Portrait]:
         return self.__portraits
 
+    def get_feature_backend(self) -> FeatureBackend:
+        return self.__feature_backend
+
+    def get_feature_budget(self) -> Optional[FeatureBudget]:
+        return self.__feature_budget
+
+    def get_portrait_height(self) -> Optional[int]:
+        return self.__portrait_height
+
+    def get_descriptor_precision(self) -> DescriptorPrecision:
+        return self.__descriptor_precision
+
+    def get_keep_images(self) -> bool:
+        return self.__keep_images
+
+    def get_feature_cache(self) -> FeatureCache:
+        return self.__feature_cache
+
+    def get_portrait_index(self) -> PortraitIndex:
+        return self.__portrait_index
+
+    def get_portrait_prefilter(self) -> PortraitPrefilter:
+        return self.__portrait_prefilter
+
     def get_word_file(self) -> str:
         return self.__word_file
 
@@ -42,24 +93,71 @@ class DataProvider(object):
 
     def __populate_portraits(self):
         portraits_directory = utils.get_root() / "portraits"
-        for path_item in portraits_directory.iterdir():
-            path = path_item.absolute().as_posix()
-
-            # Load portrait
-            image = cv2.imread(path)
-
-            features = utils.extract_features(image)
-
+        path_items = sorted(portraits_directory.iterdir())
+
+        images = {}
+        features = {}
+        stale = {}
+        for path_item in path_items:
+            image_data = path_item.read_bytes()
+            images[path_item] = cv2.imdecode(np.frombuffer(image_data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+            key = self.__feature_cache.get_key(image_data, self.__feature_backend, self.__portrait_height)
+            cached_features = self.__feature_cache.load(key)
+            if cached_features:
+                features[path_item] = cached_features
+            else:
+                stale[path_item] = key
+
+        if stale:
+            logging.info("Extracting %s features for %d portraits", self.__feature_backend.name, len(stale))
+            extracted = self.__extract_features(list(stale))
+            for (path_item, key), extracted_features in zip(stale.items(), extracted):
+                self.__feature_cache.store(key, extracted_features)
+                features[path_item] = extracted_features
+
+        for path_item in path_items:
             hero_name = path_item.stem.replace('.png', '').lower()
 
             hero = self.get_hero_by_name(hero_name)
             if not hero:
                 hero = Hero(hero_name, None)
 
-            portrait = Portrait(hero, image, features)
+            image = images.pop(path_item)
+            h, w = image.shape[:2]
+            size = Point(w, h)
+            portrait_features = features[path_item]
+            if self.__feature_budget:
+                # The cache keeps all key points, so that changing the budget does not need extracting them again.
+                portrait_features = utils.select_features(
+                    portrait_features, self.__feature_budget.portrait_key_points, size, self.__feature_budget.grid,
+                    self.__get_portrait_interior(size)
+                )
+            portrait_features = Features(
+                portrait_features.points,
+                self.__feature_backend.compact_descriptors(portrait_features.descriptors, self.__descriptor_precision),
+                portrait_features.responses,
+            )
+            portrait = Portrait(hero, path_item, size, portrait_features, get_global_descriptor(image),
+                                get_lock_statistics(image), image if self.__keep_images else None)
 
             self.__portraits.append(portrait)
 
+    def __get_portrait_interior(self, size: Point) -> Rect:
+        margin_x = int(round(size.x * self.__feature_budget.portrait_margin))
+        margin_y = int(round(size.y * self.__feature_budget.portrait_margin))
+        return Rect(Point(margin_x, margin_y), Point(size.x - margin_x, size.y - margin_y))
+
+    def __extract_features(self, path_items: List[pathlib.Path]) -> List[Features]:
+        paths = [path_item.absolute().as_posix() for path_item in path_items]
+        backend_names = [self.__feature_backend.name] * len(paths)
+        heights = [self.__portrait_height] * len(paths)
+        if len(paths) == 1 or self.__feature_workers == 1:
+            return list(map(utils.extract_features_from_file, paths, backend_names, heights))
+
+        with ProcessPoolExecutor(self.__feature_workers) as pool:
+            return list(pool.map(utils.extract_features_from_file, paths, backend_names, heights))
+
     def __populate_word_file(self):
         words = set()
         for map_name in self.__map_to_id:
@@ -1,29 +1,126 @@
 import logging
 import os.path
-from typing import Optional, List, Any, Tuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Optional, List, Any, Tuple, Dict, AbstractSet
 
 import cv2
 import numpy as np
 import pytesseract
-from rapidfuzz import fuzz
+from rapidfuzz import fuzz, utils as fuzz_utils
 
-from hotsdraft_overlay import utils
+from hotsdraft_overlay import utils, matching
+from hotsdraft_overlay.assignment import solve_assignment
+from hotsdraft_overlay.calibration import SlotCalibration
 from hotsdraft_overlay.data import DataProvider
-from hotsdraft_overlay.models import DraftState, Point, ImageCut, Region, Rect, Features, Portrait, DraftHero
+from hotsdraft_overlay.frame import Frame
+from hotsdraft_overlay.maps import MapRecognizer
+from hotsdraft_overlay.matching import ExecutorType, DetectionEngine, VerificationStrategy
+from hotsdraft_overlay.models import DraftState, Point, ImageCut, Region, DraftHero, SlotState, SlotSnapshot, Rect, \
+    CapturedFrame, MatchCandidate, ImagePlanes
+from hotsdraft_overlay.prefilter import PrefilterFallback
+from hotsdraft_overlay.scaling import ResolutionPolicy, RegionScaler, DEFAULT_PORTRAIT_HEIGHT
+from hotsdraft_overlay.slots import SlotClassifier, LockDetector
 
 
 class Detector(object):
     __tessaract_cmd = "C:\\Program Files\\Tesseract-OCR\\tesseract.exe"
-
-    def __init__(self, data_provider: DataProvider):
+    # A map banner is only learned from OCR reads that match the map name as a whole this well, off this many
+    # different banners.
+    __min_learn_score = 90
+    __min_learn_reads = 2
+
+    # Groups of slots in the order they are matched, most certain first. Bans are final, and enemy picks only show up
+    # once locked in, whereas ally picks might still change.
+    __schedule = [
+        (Region.ALLY_BANS, Region.ENEMY_BANS),
+        (Region.ENEMY_PICKS,),
+        (Region.ALLY_PICKS,),
+    ]
+
+    # Share of each side of a slot left out of its interior, where frames, lock overlays and neighbouring art show up
+    # rather than the portrait.
+    __slot_margin = 0.04
+
+    def __init__(self, data_provider: DataProvider, workers: int = 1,
+                 executor_type: ExecutorType = ExecutorType.THREAD, skip_empty_slots: bool = True,
+                 incremental: bool = True, fingerprint_tolerance: float = 3.0, prefilter_top_k: int = 5,
+                 prefilter_fallback: PrefilterFallback = PrefilterFallback.FULL_SCAN,
+                 engine: DetectionEngine = DetectionEngine.KEYPOINTS,
+                 verification: VerificationStrategy = VerificationStrategy.SIMILARITY,
+                 calibration: Optional[SlotCalibration] = None,
+                 resolution_policy: ResolutionPolicy = ResolutionPolicy.NATIVE, learn_maps: bool = True):
         self.__data_provider = data_provider
+        self.__prefilter_top_k = prefilter_top_k
+        self.__prefilter_fallback = prefilter_fallback
+        self.__engine = engine
+        self.__verification = verification
+        self.__cut_matcher = matching.create_cut_matcher(engine, data_provider, prefilter_top_k, prefilter_fallback,
+                                                         verification)
+        self.__slot_classifier = SlotClassifier()
+        self.__lock_detector = LockDetector()
+        self.__portraits = {portrait.hero.name: portrait for portrait in data_provider.get_portraits()}
+        # Without learning, map banners learned before are still recognized, but new ones are only ever read with OCR.
+        self.__map_recognizer = MapRecognizer(data_provider.get_map_names(), read_only=not learn_maps)
+        self.__calibration = calibration
+        # Regions are shrunk so that portraits come out as tall as the portraits features were extracted from.
+        self.__region_scaler = RegionScaler(resolution_policy,
+                                            data_provider.get_portrait_height() or DEFAULT_PORTRAIT_HEIGHT)
+        self.__ocr_available = False
+        self.__skip_empty_slots = skip_empty_slots
+        self.__incremental = incremental
+        self.__fingerprint_tolerance = fingerprint_tolerance
+        self.__previous_size = None
+        self.__previous_slots = {}
+        self.__previous_map = None
+        self.__map_reads = {}  # type: Dict[str, int]
+        self.__last_map_read = None
+        self.__workers = workers
+        self.__executor_type = executor_type
+        self.__executor = None
 
         self.__init_tessaract()
+        self.__init_executor()
 
     def __init_tessaract(self):
+        # OCR is only a fallback for map banners the map recognizer has not learned yet.
         if not os.path.exists(self.__tessaract_cmd):
-            raise RuntimeError("Could not find tesseract in " + self.__tessaract_cmd)
+            logging.warning("Could not find tesseract in %s, only learned maps will be detected", self.__tessaract_cmd)
+            return
         pytesseract.pytesseract.tesseract_cmd = self.__tessaract_cmd
+        self.__ocr_available = True
+
+    def __init_executor(self):
+        if self.__workers <= 1:
+            return
+
+        if self.__executor_type == ExecutorType.PROCESS:
+            self.__executor = ProcessPoolExecutor(self.__workers, initializer=matching.init_worker, initargs=(
+                self.__engine, self.__data_provider.get_feature_backend().name,
+                self.__data_provider.get_feature_budget(), self.__data_provider.get_portrait_height(),
+                self.__data_provider.get_descriptor_precision(), self.__data_provider.get_keep_images(),
+                self.__data_provider.get_feature_cache(), self.__prefilter_top_k, self.__prefilter_fallback,
+                self.__verification
+            ))
+        else:
+            # OpenCV releases the GIL, and utils hands out a feature extractor/matcher per thread.
+            self.__executor = ThreadPoolExecutor(self.__workers)
+
+    def close(self):
+        if self.__executor is not None:
+            self.__executor.shutdown()
+            self.__executor = None
+
+    def reset(self):
+        self.__previous_size = None
+        self.__previous_slots = {}
+        self.__previous_map = None
+
+    def reset_maps(self):
+        # Forgets learned map banners, in case one was learned under the wrong map.
+        self.__map_recognizer.reset()
+        self.__map_reads = {}
+        self.__last_map_read = None
+        self.__previous_map = None
 
     def get_draft_state(self, image, show_cuts=False, allow_resize=False) -> Optional[DraftState]:
         # Resize the image if it's large
@@ -31,93 +128,85 @@ class Detector(object):
             logging.debug("Resizing image")
             image = utils.resize(image, height=1080)
 
-        cuts = self.__get_image_cuts(image)
+        return self.get_frame_draft_state(CapturedFrame.from_image(image), show_cuts=show_cuts)
+
+    def get_frame_draft_state(self, captured: CapturedFrame, show_cuts=False) -> Optional[DraftState]:
+        # The frame has to contain the regions returned by get_capture_regions.
+        frame = Frame(captured)
+        rects = self.__get_region_rects(frame.size)
+        scales = {
+            region: self.__region_scaler.get_scale(region, rect, frame.size) for region, rect in rects.items()
+        }
+        logging.debug("Region scales: %s", ", ".join("%s %.2f" % (region.name, scale)
+                                                     for region, scale in scales.items()))
+        region_planes = {
+            region: frame.get_region(rect, scales[region])
+            for region, rect in rects.items() if region != Region.MAP_BANNER
+        }
+        cuts = self.__get_image_cuts(rects, region_planes, scales)
+        calibrated = self.__calibration.get_profile(frame.size) if self.__calibration is not None else {}
+        for idx, rect in calibrated.items():
+            region = cuts[idx].region
+            cuts[idx] = self.__get_calibrated_cut(region_planes[region], rects[region], scales[region], region, rect)
+        logging.debug("Cutting %d calibrated slots", len(calibrated))
+
+        # Slots are identified by their position in the cut list, which only holds while the resolution is the same.
+        previous_slots = self.__previous_slots if self.__previous_size == frame.size else {}
+        # Gray planes of the cuts are converted here, and reused by whatever looks at the cuts later.
+        fingerprints = [utils.get_fingerprint(cut.planes.gray) for cut in cuts]
+        reused = {}
+        for idx, (cut, fingerprint) in enumerate(zip(cuts, fingerprints)):
+            previous_slot = previous_slots.get(idx)
+            if previous_slot and utils.fingerprints_match(previous_slot.fingerprint, fingerprint,
+                                                          self.__fingerprint_tolerance):
+                cut.state = previous_slot.state
+                reused[idx] = previous_slot.match
+            else:
+                cut.state = self.__slot_classifier.classify(cut.planes.gray)
+        logging.debug("Reusing %d unchanged slots", len(reused))
 
         if show_cuts:
             for i, cut in enumerate(cuts):
-                cv2.imshow(cut.region.name + " " + str(i), cut.image)
+                cv2.imshow(cut.region.name + " " + str(i) + " " + cut.state.name, cut.image)
                 cv2.waitKey(0)
 
         # Get the map we're playing, if we can't get that, we're probably not in draft.
-        game_map = self.__get_map(image) or None
-        logging.debug("Got map %s", game_map)
-
-        best_score = 0
-        best_map_name = None
-        if game_map:
-            for map_name in self.__data_provider.get_map_names():
-                score = fuzz.partial_ratio(map_name, game_map)
-                logging.debug("Got %d score for %s", score, map_name)
-                if score > best_score:
-                    best_score = score
-                    best_map_name = map_name
-
-            if best_score < 75:
-                logging.debug("Best score %d < 50, clearing map %s", best_score, best_map_name)
-                best_map_name = None
+        best_map_name = self.__get_map_name(frame.get_region(rects[Region.MAP_BANNER], scales[Region.MAP_BANNER]))
 
         state = DraftState(best_map_name)
 
-        for cut in cuts:
-            cut_features = utils.extract_features(cut.image)
-            if not cut_features.key_points:
-                logging.debug("Cut %s produced no key points" % cut)
-                continue
-
-            best_score = 0
-            best_match = None
-
-            for portrait in self.__data_provider.get_portraits():
-                try:
-                    all_matches = utils.match_features(portrait.features, cut_features)
-
-                    # Apply ratio test
-                    good_matches = []
-                    score = 0
-                    for m, n in all_matches:
-                        if m.distance < 0.7 * n.distance:
-                            good_matches.append(m)
-                            score += m.distance ** 2 + n.distance ** 2
-
-                    if len(good_matches) < 10:
-                        logging.debug("Skipping %s as got %d matches", portrait.hero.name, len(good_matches))
-                        continue
-
-                    if score < best_score:
-                        logging.debug("Skipping %s as got %.2f score vs current best %.2f", portrait.hero.name, score,
-                                      best_score)
-                        continue
-
-                    bounding_box = self.__get_bounding_box(portrait, cut_features, good_matches)
-                    if not bounding_box:
-                        logging.debug("Failed to compute bounding box for %s, skipping", portrait.hero.name)
-                        continue
-
-                    # Some false matches are sometimes produced with a bounding box that is stretched.
-                    # We expect the matches have a sensible height to width ratio.
-                    bounding_box_ratio = bounding_box.ratio
-                    if bounding_box_ratio > 1.2:
-                        logging.debug("Skipping %s as got high bounding box ratio %.2f", portrait.hero.name,
-                                      bounding_box_ratio)
-                        continue
-
-                    locked = True
-                    if cut.region == Region.ALLY_PICKS:
-                        bounding_box_image = utils.crop_to_rect(cut.image, bounding_box)
-                        locked = self.__get_locked_status(portrait.image, bounding_box_image)
-
-                    bounding_box_with_offset = Rect(
-                        utils.add_offset_to_point(bounding_box.top_left, cut.offset),
-                        utils.add_offset_to_point(bounding_box.bottom_right, cut.offset),
-                    )
-
-                    best_match = DraftHero(portrait.hero.name, portrait.hero.id, locked, bounding_box_with_offset,
-                                           cut.region)
-                    best_score = score
-                    logging.debug("%s is the current best match with score %.2f", portrait.hero.name, score)
-                except Exception as e:
-                    logging.exception("Exception while processing %s" % portrait.hero.name)
-
+        matches = self.__match_cuts(cuts, reused)
+        # A portrait missing from a calibrated slot the classifier sees a portrait in might have been cut off, if the
+        # calibration is off, so the slot is cut loosely and matched again, and left to be calibrated anew.
+        misses = [
+            idx for idx in calibrated
+            if idx not in reused and cuts[idx].state == SlotState.OCCUPIED and matches[idx] is None
+        ]
+        if misses:
+            self.__calibration.discard(frame.size, misses)
+            loose_cuts = self.__get_image_cuts(rects, region_planes, scales)
+            for idx in misses:
+                del calibrated[idx]
+                cuts[idx] = loose_cuts[idx]
+                fingerprints[idx] = utils.get_fingerprint(cuts[idx].planes.gray)
+                cuts[idx].state = self.__slot_classifier.classify(cuts[idx].planes.gray)
+            # Slots other than the missed ones keep what they were matched with.
+            matches = self.__match_cuts(cuts, {
+                idx: match for idx, match in enumerate(matches) if idx not in misses
+            })
+        if self.__calibration is not None:
+            self.__calibration.observe(frame.size, {
+                idx: (cut.region, match.bounding_box) for idx, (cut, match) in enumerate(zip(cuts, matches))
+                if match is not None and idx not in reused and idx not in calibrated
+            }, rects)
+        if self.__incremental:
+            self.__previous_size = frame.size
+            self.__previous_slots = {
+                idx: SlotSnapshot(fingerprint, cut.state, match)
+                for idx, (cut, fingerprint, match) in enumerate(zip(cuts, fingerprints, matches))
+            }
+
+        for cut, best_match in zip(cuts, matches):
             if best_match is not None:
                 if cut.region == Region.ALLY_PICKS:
                     state.ally_picks.append(best_match)
@@ -138,13 +227,133 @@ class Detector(object):
 
         return state
 
-    def __get_map(self, image) -> Optional[str]:
-        h, w = image.shape[:2]
-        ratio = 3
-        cropped = image[0:int(h / 25), int(w / ratio):int((ratio - 1) * w / ratio)]
-        lab = cv2.cvtColor(cropped, cv2.COLOR_BGR2LAB)
+    def __match_cuts(self, cuts: List[ImageCut], reused: Dict[int, Optional[DraftHero]]) -> List[Optional[DraftHero]]:
+        matches = [reused.get(idx) for idx in range(len(cuts))]
+
+        pending = [
+            idx for idx, cut in enumerate(cuts)
+            if idx not in reused and (not self.__skip_empty_slots or cut.state == SlotState.OCCUPIED)
+        ]
+        logging.debug("Matching %d out of %d slots", len(pending), len(cuts))
+
+        # A hero can only be in the draft once, so heroes found in slots that did not change, or in earlier groups
+        # of slots, are not considered for the rest.
+        assigned = set(match.name for match in matches if match is not None)
+        for regions in self.__schedule:
+            group = [idx for idx in pending if cuts[idx].region in regions]
+            if not group:
+                continue
+
+            candidates = self.__get_candidates([cuts[idx] for idx in group], frozenset(assigned))
+            for idx, match in zip(group, self.__assign(candidates)):
+                matches[idx] = match
+                if match is not None:
+                    assigned.add(match.name)
+                    if cuts[idx].region == Region.ALLY_PICKS:
+                        self.__set_locked_status(cuts[idx], match)
+        return matches
+
+    def __set_locked_status(self, cut: ImageCut, match: DraftHero):
+        bounding_box = utils.get_cut_rect(match.bounding_box, cut.offset, cut.scale)
+        match.locked, match.locked_confidence = self.__lock_detector.get_locked_status(
+            self.__portraits[match.name], cut.planes.crop(bounding_box).gray
+        )
+        logging.debug("%s locked: %s (%.2f)", match.name, match.locked, match.locked_confidence)
+
+    def __get_candidates(self, cuts: List[ImageCut], excluded: AbstractSet[str]) -> List[List[MatchCandidate]]:
+        excluded_repeated = [excluded] * len(cuts)
+        if self.__executor is None:
+            results = map(self.__cut_matcher.match_candidates, cuts, excluded_repeated)
+        elif self.__executor_type == ExecutorType.PROCESS:
+            results = self.__executor.map(matching.match_candidates_in_worker, cuts, excluded_repeated)
+        else:
+            results = self.__executor.map(self.__cut_matcher.match_candidates, cuts, excluded_repeated)
+        # Results come back in the same order as the cuts.
+        return list(results)
+
+    @staticmethod
+    def __assign(candidates: List[List[MatchCandidate]]) -> List[Optional[DraftHero]]:
+        # Rather than each slot taking its best candidate, which might also be the best candidate of another slot,
+        # pick the heroes for all slots at once, so that the total score is the highest.
+        hero_names = sorted(set(candidate.hero.name for slot_candidates in candidates for candidate in slot_candidates))
+        scores = np.zeros((len(candidates), len(hero_names)))
+        for slot, slot_candidates in enumerate(candidates):
+            for candidate in slot_candidates:
+                scores[slot, hero_names.index(candidate.hero.name)] = candidate.score
+
+        assignment = [None] * len(candidates)
+        for slot, column in solve_assignment(scores):
+            assignment[slot] = next(
+                candidate.hero for candidate in candidates[slot] if candidate.hero.name == hero_names[column]
+            )
+            if assignment[slot] is not candidates[slot][0].hero:
+                logging.debug("Slot %d assigned %s, as %s fits another slot better", slot, assignment[slot].name,
+                              candidates[slot][0].hero.name)
+        return assignment
+
+    def __get_map_name(self, banner: ImagePlanes) -> Optional[str]:
+        # The banner is a thin strip of text, so keep more horizontal detail.
+        fingerprint = utils.get_fingerprint(banner.gray, (64, 4))
+        if self.__previous_map is not None:
+            previous_fingerprint, previous_map_name = self.__previous_map
+            if utils.fingerprints_match(previous_fingerprint, fingerprint, self.__fingerprint_tolerance):
+                logging.debug("Map banner unchanged, reusing map %s", previous_map_name)
+                return previous_map_name
+
+        best_map_name, correlation = self.__map_recognizer.recognize(banner.gray)
+        if best_map_name:
+            logging.debug("Recognized map %s with correlation %.3f", best_map_name, correlation)
+        elif self.__ocr_available:
+            best_map_name, score = self.__get_map_name_from_text(banner)
+            if best_map_name and score >= self.__min_learn_score and not self.__map_recognizer.read_only:
+                self.__learn_map(banner, fingerprint, best_map_name)
+
+        if self.__incremental:
+            self.__previous_map = (fingerprint, best_map_name)
+        return best_map_name
+
+    def __learn_map(self, banner: ImagePlanes, fingerprint: np.ndarray, map_name: str):
+        # A learned banner is trusted from then on, so it is only learned once the same map has been read enough times,
+        # not counting reads of a banner that has not changed since the last read.
+        if self.__last_map_read is not None and utils.fingerprints_match(self.__last_map_read, fingerprint,
+                                                                         self.__fingerprint_tolerance):
+            return
+        self.__last_map_read = fingerprint
+        reads = self.__map_reads[map_name] = self.__map_reads.get(map_name, 0) + 1
+        if reads < self.__min_learn_reads:
+            logging.debug("Read map %s %d times, not learning it yet", map_name, reads)
+            return
+        del self.__map_reads[map_name]
+        self.__map_recognizer.learn(banner.gray, map_name)
+
+    def __get_map_name_from_text(self, banner: ImagePlanes) -> Tuple[Optional[str], float]:
+        # Returns the map name along with how well the whole text read matches it.
+        game_map = self.__get_map(banner) or None
+        logging.debug("Got map %s", game_map)
+
+        best_score = 0
+        best_map_name = None
+        if game_map:
+            for map_name in self.__data_provider.get_map_names():
+                score = fuzz.partial_ratio(map_name, game_map)
+                logging.debug("Got %d score for %s", score, map_name)
+                if score > best_score:
+                    best_score = score
+                    best_map_name = map_name
+
+            if best_score < 75:
+                logging.debug("Best score %d < 75, clearing map %s", best_score, best_map_name)
+                best_map_name = None
+
+        if best_map_name is None:
+            return None, 0
+        # A partial match is enough to show the map, but not to learn its banner. Case, punctuation and the whitespace
+        # OCR tends to add around the text do not count against the read.
+        return best_map_name, fuzz.ratio(best_map_name, game_map, processor=fuzz_utils.default_process)
+
+    def __get_map(self, banner: ImagePlanes) -> Optional[str]:
         # Remove color channels, just use luminosity
-        luminosity = cv2.split(lab)[0]
+        luminosity = cv2.extractChannel(banner.lab, 0)
         config = "--psm 7"
         word_file = self.__data_provider.get_word_file()
         if word_file:
@@ -152,73 +361,64 @@ class Detector(object):
         return pytesseract.image_to_string(luminosity, config=config)
 
     @staticmethod
-    def __get_bounding_box(portrait: Portrait, cut_features: Features, matches: List[Any]) -> Optional[Rect]:
-        src_pts = np.float32([portrait.features.key_points[m.queryIdx].pt for m in matches]).reshape(-1, 1, 2)
-        dst_pts = np.float32([cut_features.key_points[m.trainIdx].pt for m in matches]).reshape(-1, 1, 2)
-
-        matrix, _ = cv2.findHomography(src_pts, dst_pts, cv2.RANSAC, 5.0)
-        if matrix is None:
-            return None
-
-        h, w, d = portrait.image.shape
-        pts = np.float32([[0, 0], [0, h - 1], [w - 1, h - 1], [w - 1, 0]]).reshape(-1, 1, 2)
-        dst = cv2.perspectiveTransform(pts, matrix)
-
-        top_left = Point(
-            max(int(min(point[0][0] for point in dst)), 0),
-            max(int(min(point[0][1] for point in dst)), 0)
-        )
-        bottom_right = Point(
-            max(int(max(point[0][0] for point in dst)), 0),
-            max(int(max(point[0][1] for point in dst)), 0)
-        )
-
-        return Rect(top_left, bottom_right)
+    def get_capture_regions(size: Point) -> List[Rect]:
+        return list(Detector.__get_region_rects(size).values())
 
     @staticmethod
-    def __get_image_cuts(image) -> List[ImageCut]:
-        h, w = image.shape[:2]
-
-        cuts = []
+    def __get_region_rects(size: Point) -> Dict[Region, Rect]:
+        h, w = size.y, size.x
+        ratio = 3
         # These offsets adjust x axis based on the height of the image, as it seems the UI elements are either
         # left or right aligned in case of wide screen monitors.
-        ally_picks_offset = Point(0, int(h * 0.06))
-        ally_picks = image[ally_picks_offset.y:int(h * 0.85), ally_picks_offset.x:int(h / 3.6)]
+        return {
+            Region.ALLY_PICKS: Rect(Point(0, int(h * 0.06)), Point(int(h / 3.6), int(h * 0.85))),
+            Region.ENEMY_PICKS: Rect(Point(int(w - (h / 3.6)), int(h * 0.06)), Point(w, int(h * 0.85))),
+            Region.ALLY_BANS: Rect(Point(int(h / 4), int(h / 100)), Point(int(2.05 * h / 4), int(h / 10))),
+            Region.ENEMY_BANS: Rect(Point(w - int(2.05 * h / 4), int(h / 100)), Point(w - int(h / 4), int(h / 10))),
+            Region.MAP_BANNER: Rect(Point(int(w / ratio), 0), Point(int((ratio - 1) * w / ratio), int(h / 25))),
+        }
 
+    @staticmethod
+    def __get_image_cuts(rects: Dict[Region, Rect], region_planes: Dict[Region, ImagePlanes],
+                         scales: Dict[Region, float]) -> List[ImageCut]:
+        # Region planes are of the regions of the frame at the given rects, shrunk by the given scales.
+        cuts = []
         cuts.extend(
             Detector.__get_pick_portrait_slices(
-                ally_picks, ally_picks_offset, (0.47, 0.97), (0.14, 0.65), Region.ALLY_PICKS
+                region_planes[Region.ALLY_PICKS], rects[Region.ALLY_PICKS].top_left, scales[Region.ALLY_PICKS],
+                (0.47, 0.97), (0.14, 0.65), Region.ALLY_PICKS
             )
         )
 
-        enemy_picks_offset = Point(int(w - (h / 3.6)), int(h * 0.06))
-        enemy_picks = image[enemy_picks_offset.y:int(h * 0.85), enemy_picks_offset.x:w]
         cuts.extend(
             Detector.__get_pick_portrait_slices(
-                enemy_picks, enemy_picks_offset, (0.03, 0.54), (0.34, 0.87), Region.ENEMY_PICKS
+                region_planes[Region.ENEMY_PICKS], rects[Region.ENEMY_PICKS].top_left, scales[Region.ENEMY_PICKS],
+                (0.03, 0.54), (0.34, 0.87), Region.ENEMY_PICKS
             )
         )
 
-        ally_bans_offset = Point(int(h / 4), int(h / 100))
-        ally_bans = image[ally_bans_offset.y:int(h / 10), ally_bans_offset.x:int(2.05 * h / 4)]
         cuts.extend(
-            Detector.__get_ban_portrait_slices(ally_bans, ally_bans_offset, Region.ALLY_BANS)
+            Detector.__get_ban_portrait_slices(
+                region_planes[Region.ALLY_BANS], rects[Region.ALLY_BANS].top_left, scales[Region.ALLY_BANS],
+                Region.ALLY_BANS
+            )
         )
 
-        enemy_bans_offset = Point(w - int(2.05 * h / 4), int(h / 100))
-        enemy_bans = image[enemy_bans_offset.y:int(h / 10), enemy_bans_offset.x:w - int(h / 4)]
         cuts.extend(
-            Detector.__get_ban_portrait_slices(enemy_bans, enemy_bans_offset, Region.ENEMY_BANS)
+            Detector.__get_ban_portrait_slices(
+                region_planes[Region.ENEMY_BANS], rects[Region.ENEMY_BANS].top_left, scales[Region.ENEMY_BANS],
+                Region.ENEMY_BANS
+            )
         )
 
         return cuts
 
     @staticmethod
-    def __get_pick_portrait_slices(base_image: Any, base_offset: Point,
+    def __get_pick_portrait_slices(base: ImagePlanes, base_offset: Point, scale: float,
                                    odd_multiplier: Tuple[float, float], even_multiplier: Tuple[float, float],
                                    region: Region) -> List[ImageCut]:
         cuts = []
-        h, w = base_image.shape[:2]
+        h, w = base.image.shape[:2]
         for idx in range(5):
             # Portraits alternate
             if idx % 2 == 1:
@@ -227,51 +427,41 @@ class Detector(object):
             else:
                 w_start = int(w * even_multiplier[0])
                 w_end = int(w * even_multiplier[1])
-            portrait_cut_offset = Point(w_start, int(h / 5 * idx))
-            portrait_cut = base_image[portrait_cut_offset.y:int(h / 5 * (idx + 1)), portrait_cut_offset.x:w_end]
-            current_portrait_offset = utils.add_offset_to_point(base_offset, portrait_cut_offset)
-            cuts.append(ImageCut(portrait_cut, region, current_portrait_offset))
+            portrait_cut_rect = Rect(Point(w_start, int(h / 5 * idx)), Point(w_end, int(h / 5 * (idx + 1))))
+            cuts.append(Detector.__get_cut(base, base_offset, scale, region, portrait_cut_rect))
         return cuts
 
     @staticmethod
-    def __get_ban_portrait_slices(base_image: Any, base_offset: Point, region: Region):
+    def __get_ban_portrait_slices(base: ImagePlanes, base_offset: Point, scale: float, region: Region):
         cuts = []
-        h, w = base_image.shape[:2]
+        h, w = base.image.shape[:2]
         for idx in range(3):
-            portrait_cut_offset = Point(int(w / 3 * idx), 0)
-            portrait_cut = base_image[portrait_cut_offset.y:h, portrait_cut_offset.x:int(w / 3 * (idx + 1))]
-            current_portrait_offset = utils.add_offset_to_point(base_offset, portrait_cut_offset)
-            cuts.append(ImageCut(portrait_cut, region, current_portrait_offset))
+            portrait_cut_rect = Rect(Point(int(w / 3 * idx), 0), Point(int(w / 3 * (idx + 1)), h))
+            cuts.append(Detector.__get_cut(base, base_offset, scale, region, portrait_cut_rect))
         return cuts
 
     @staticmethod
-    def __get_locked_status(portrait_image, draft_image):
-        if draft_image.shape[0] > portrait_image.shape[0]:
-            draft_image = utils.resize(draft_image, height=portrait_image.shape[0])
-        else:
-            portrait_image = utils.resize(portrait_image, height=draft_image.shape[0])
-
-        # Remove the frames and what not, by cutting a smaller square out of the image, stripping 25% of each side.
-        h, w = draft_image.shape[:2]
-        ratio = 4
-        crop_bounding_box = Rect(
-            Point(int(w / ratio), int(h / ratio)),
-            Point(int((ratio - 1) * w / ratio), int((ratio - 1) * h / ratio))
-        )
+    def __get_calibrated_cut(base: ImagePlanes, base_rect: Rect, scale: float, region: Region,
+                             rect: Rect) -> ImageCut:
+        # The calibrated rect is in frame coordinates, the base is the region at base_rect, shrunk by scale.
+        return Detector.__get_cut(base, base_rect.top_left, scale, region,
+                                  utils.get_cut_rect(rect, base_rect.top_left, scale))
 
-        draft_image_cropped = utils.crop_to_rect(draft_image, crop_bounding_box)
-        portrait_image_cropped = utils.crop_to_rect(portrait_image, crop_bounding_box)
+    @staticmethod
+    def __get_cut(base: ImagePlanes, base_offset: Point, scale: float, region: Region, rect: Rect) -> ImageCut:
+        # Cut at rect within the base, which is the region at base_offset, shrunk by scale.
+        planes = base.crop(rect)
+        return ImageCut(planes.image, region, Detector.__get_frame_offset(base_offset, rect.top_left, scale),
+                        interior=Detector.__get_slot_interior(planes.image), scale=scale, planes=planes)
 
-        if min(*(draft_image_cropped.shape[:2] + portrait_image_cropped.shape[:2])) > 0:
-            draft_image_channel_variance = utils.get_channel_variance(draft_image_cropped, cv2.COLOR_BGR2YCrCb)
-            portrait_channel_variance = utils.get_channel_variance(portrait_image_cropped, cv2.COLOR_BGR2YCrCb)
+    @staticmethod
+    def __get_frame_offset(base_offset: Point, offset: Point, scale: float) -> Point:
+        # Position in the frame of an offset within an image of the region at base_offset, shrunk by scale.
+        return Point(base_offset.x + int(round(offset.x / scale)), base_offset.y + int(round(offset.y / scale)))
 
-            luminosity_ratio = (portrait_channel_variance[0] / draft_image_channel_variance[0])
-            chromatic_ratio = (
-                    ((portrait_channel_variance[1] / draft_image_channel_variance[1]) +
-                     (portrait_channel_variance[2] / draft_image_channel_variance[2])) / 2
-            )
-            # Not used for now
-            _ = chromatic_ratio
-            return luminosity_ratio < 2.5
-        return False
+    @staticmethod
+    def __get_slot_interior(portrait_cut: Any) -> Rect:
+        h, w = portrait_cut.shape[:2]
+        margin_x = int(round(w * Detector.__slot_margin))
+        margin_y = int(round(h * Detector.__slot_margin))
+        return Rect(Point(margin_x, margin_y), Point(w - margin_x, h - margin_y))
@@ -0,0 +1,118 @@
+import json
+from enum import Enum
+from typing import Callable, Any, Dict, List
+
+import cv2
+import numpy as np
+
+FLANN_INDEX_KDTREE = 1
+FLANN_INDEX_LSH = 6
+
+
+class DescriptorPrecision(Enum):
+    # How float descriptors of portraits are kept in memory. SIFT descriptors are whole numbers up to 255, so both
+    # smaller types hold them exactly. Binary descriptors are bytes already and are kept as they are.
+    FLOAT32 = "float32"
+    FLOAT16 = "float16"
+    UINT8 = "uint8"
+
+
+class FeatureBackend(object):
+    # A keypoint detector/descriptor along with how its descriptors should be matched. Float descriptors are compared
+    # by L2 distance, binary ones by Hamming distance, and thresholds differ between the two, as do the ratio test
+    # and the number of matches that make a match believable.
+    def __init__(self, name: str, create: Callable[..., Any], params: Dict[str, Any], norm_type: int, ratio: float,
+                 min_matches: int, index_params: Dict[str, Any]):
+        self.name = name
+        self.params = params
+        self.norm_type = norm_type
+        self.ratio = ratio
+        self.min_matches = min_matches
+        self.index_params = index_params
+        self.__create = create
+
+    @property
+    def binary(self) -> bool:
+        return self.norm_type == cv2.NORM_HAMMING
+
+    def create_extractor(self):
+        return self.__create(**self.params)
+
+    def compact_descriptors(self, descriptors, precision: DescriptorPrecision):
+        if descriptors is None or self.binary or precision == DescriptorPrecision.FLOAT32:
+            return descriptors
+        if precision == DescriptorPrecision.UINT8:
+            return np.clip(np.rint(descriptors), 0, 255).astype(np.uint8)
+        return np.asarray(descriptors, dtype=np.float16)
+
+    def get_matchable_descriptors(self, descriptors):
+        # Matchers only compare float descriptors as float32.
+        if descriptors is None or self.binary:
+            return descriptors
+        return np.asarray(descriptors, dtype=np.float32)
+
+    def get_signature(self) -> str:
+        # Changing any of these invalidates cached portrait features, see FeatureCache.
+        return json.dumps({
+            "opencv": cv2.__version__,
+            "extractor": self.name,
+            "params": self.params,
+        }, sort_keys=True)
+
+    def __repr__(self):
+        return "FeatureBackend(%s)" % self.name
+
+
+def _create_sift(**params):
+    # SIFT moved into the main module in OpenCV 4.4, once its patent expired, and is deprecated in xfeatures2d since.
+    # Older builds only have it in xfeatures2d.
+    if hasattr(cv2, "SIFT_create"):
+        return cv2.SIFT_create(**params)
+    return cv2.xfeatures2d.SIFT_create(**params)
+
+
+# Binary descriptors index with locality sensitive hashing, as KD-trees only work with float descriptors.
+_kdtree_params = dict(algorithm=FLANN_INDEX_KDTREE, trees=4)
+_lsh_params = dict(algorithm=FLANN_INDEX_LSH, table_number=4, key_size=24, multi_probe_level=1)
+
+# Portraits are small, so the binary detectors get smaller borders and patches than their defaults, otherwise most of
+# the portrait is too close to the edge to produce key points.
+FEATURE_BACKENDS = {
+    backend.name: backend for backend in [
+        FeatureBackend("sift", _create_sift, {
+            "nfeatures": 0,
+            "nOctaveLayers": 3,
+            "contrastThreshold": 0.04,
+            "edgeThreshold": 10,
+            "sigma": 1.6,
+        }, cv2.NORM_L2, ratio=0.7, min_matches=10, index_params=_kdtree_params),
+        FeatureBackend("orb", cv2.ORB_create, {
+            "nfeatures": 500,
+            "scaleFactor": 1.2,
+            "nlevels": 8,
+            "edgeThreshold": 15,
+            "patchSize": 15,
+            "fastThreshold": 10,
+        }, cv2.NORM_HAMMING, ratio=0.75, min_matches=12, index_params=_lsh_params),
+        FeatureBackend("akaze", cv2.AKAZE_create, {
+            "threshold": 0.0002,
+        }, cv2.NORM_HAMMING, ratio=0.75, min_matches=10, index_params=_lsh_params),
+        FeatureBackend("brisk", cv2.BRISK_create, {
+            "thresh": 20,
+            "octaves": 3,
+        }, cv2.NORM_HAMMING, ratio=0.75, min_matches=10, index_params=_lsh_params),
+    ]
+}
+
+DEFAULT_FEATURE_BACKEND = "sift"
+
+
+def get_feature_backend(name: str = DEFAULT_FEATURE_BACKEND) -> FeatureBackend:
+    try:
+        return FEATURE_BACKENDS[name]
+    except KeyError:
+        raise ValueError("Unknown feature backend %s, expected one of %s" % (name, ", ".join(FEATURE_BACKENDS)))
+
+
+def get_feature_backend_names() -> List[str]:
+    return list(FEATURE_BACKENDS)
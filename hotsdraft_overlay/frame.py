@@ -0,0 +1,27 @@
+from typing import Dict, Tuple
+
+from hotsdraft_overlay import utils
+from hotsdraft_overlay.models import CapturedFrame, ImagePlanes, Point, Rect
+
+
+class Frame(object):
+    # A captured frame along with the regions of it that are in use, each shrunk by some scale, and the planes derived
+    # from them. Each region is cropped, shrunk and converted once, however many stages look at it.
+    def __init__(self, captured: CapturedFrame):
+        self.__captured = captured
+        self.__regions = {}  # type: Dict[Tuple[Tuple[int, int, int, int], float], ImagePlanes]
+
+    @property
+    def size(self) -> Point:
+        return self.__captured.size
+
+    @property
+    def captured(self) -> CapturedFrame:
+        return self.__captured
+
+    def get_region(self, rect: Rect, scale: float = 1.0) -> ImagePlanes:
+        key = (rect.tuple, scale)
+        planes = self.__regions.get(key)
+        if planes is None:
+            planes = self.__regions[key] = ImagePlanes(utils.scale_image(self.__captured.crop(rect), scale))
+        return planes
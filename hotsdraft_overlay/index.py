@@ -0,0 +1,98 @@
+import logging
+import threading
+from typing import List, Tuple, Optional, AbstractSet
+
+import cv2
+import numpy as np
+
+from hotsdraft_overlay import utils
+from hotsdraft_overlay.features import FeatureBackend
+from hotsdraft_overlay.models import Portrait, Features
+
+
+# All portrait descriptors stacked into a single matrix, with a parallel array of portrait labels, so that a cut can be
+# matched against every portrait with a single kNN query, rather than a knnMatch per portrait.
+class PortraitIndex(object):
+    def __init__(self, portraits: List[Portrait], feature_backend: FeatureBackend, use_flann: bool = True,
+                 neighbours: int = 8, ratio: Optional[float] = None, min_votes: int = 3, candidates: int = 3,
+                 flann_checks: int = 64):
+        self.__portraits = portraits
+        self.__feature_backend = feature_backend
+        self.__neighbours = neighbours
+        self.__ratio = ratio if ratio is not None else feature_backend.ratio
+        self.__min_votes = min_votes
+        self.__candidates = candidates
+        self.__flann_checks = flann_checks
+
+        # Binary descriptors are compared bitwise, so they have to stay bytes.
+        self.__descriptor_type = np.uint8 if feature_backend.binary else np.float32
+        descriptors = []
+        labels = []
+        for label, portrait in enumerate(portraits):
+            if portrait.features.descriptors is None:
+                continue
+            descriptors.append(np.asarray(portrait.features.descriptors, dtype=self.__descriptor_type))
+            labels.append(np.full(len(portrait.features.descriptors), label, dtype=np.int32))
+
+        self.__descriptors = np.ascontiguousarray(np.vstack(descriptors))
+        self.__labels = np.concatenate(labels)
+
+        # FLANN indexes are not safe to query concurrently, so each thread builds its own on first use.
+        self.__use_flann = use_flann
+        self.__thread_local = threading.local()
+
+        logging.debug("Indexed %d descriptors from %d portraits", len(self.__labels), len(portraits))
+
+    def get_candidates(self, features: Features,
+                       excluded: AbstractSet[str] = frozenset()) -> List[Tuple[Portrait, int]]:
+        # Returns the portraits that received the most votes along with the vote count, best first, skipping the
+        # excluded hero names.
+        if features.descriptors is None or not len(features.descriptors):
+            return []
+
+        indices, distances = self.__query(np.asarray(features.descriptors, dtype=self.__descriptor_type))
+
+        # LSH indexes might find fewer neighbours than asked for, the rest are marked with -1.
+        valid = indices[:, 0] >= 0
+        indices, distances = indices[valid], distances[valid]
+        found = indices >= 0
+        labels = np.where(found, self.__labels[indices], -1)
+
+        # Ratio test against the closest neighbour that belongs to a different portrait, as neighbours from the same
+        # portrait say nothing about how distinctive the match is.
+        different = (labels != labels[:, :1]) & found
+        has_other = different.any(axis=1)
+        other_distances = distances[np.arange(len(distances)), different.argmax(axis=1)]
+        passed = ~has_other | (distances[:, 0] < self.__ratio * other_distances)
+
+        votes = np.bincount(labels[passed, 0], minlength=len(self.__portraits))
+        if excluded:
+            votes[[portrait.hero.name in excluded for portrait in self.__portraits]] = 0
+        best = np.argsort(-votes, kind="stable")[:self.__candidates]
+
+        return [
+            (self.__portraits[label], int(votes[label]))
+            for label in best
+            if votes[label] >= self.__min_votes
+        ]
+
+    def __query(self, descriptors) -> Tuple[np.ndarray, np.ndarray]:
+        neighbours = min(self.__neighbours, len(self.__labels))
+        if self.__use_flann:
+            indices, distances = self.__get_flann_index().knnSearch(
+                descriptors, neighbours, params=dict(checks=self.__flann_checks)
+            )
+            if self.__feature_backend.binary:
+                return indices, distances.astype(np.float32)
+            # FLANN returns squared L2 distances
+            return indices, np.sqrt(distances)
+
+        distances, indices = utils.find_neighbours(descriptors, self.__descriptors, self.__feature_backend, neighbours)
+        return indices, distances.astype(np.float32)
+
+    def __get_flann_index(self):
+        flann_index = getattr(self.__thread_local, "flann_index", None)
+        if flann_index is None:
+            flann_index = cv2.flann_Index(self.__descriptors, self.__feature_backend.index_params)
+            self.__thread_local.flann_index = flann_index
+        return flann_index
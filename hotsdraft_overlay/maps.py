@@ -0,0 +1,160 @@
+import logging
+import os
+import pathlib
+import tempfile
+import threading
+from typing import Optional, Tuple, List
+
+import cv2
+import numpy as np
+
+from hotsdraft_overlay import utils
+
+
+class MapRecognizer(object):
+    # Recognizes the map from the banner at the top of the draft screen, by normalized cross correlation of a small
+    # grayscale thumbnail against reference banners of each map. The repository does not ship reference banners, so
+    # they are learned: once OCR has read the name of a map confidently a few times, its banner is kept as a
+    # reference for that map and persisted, after which that map no longer needs OCR. A bad reference sticks until the
+    # references are reset. A read only recognizer uses references learned so far, but never changes them, for when
+    # several processes recognize maps at once, or when what is recognized should not depend on what came before.
+    __version = 1
+
+    def __init__(self, map_names: List[str], directory: Optional[pathlib.Path] = None,
+                 size: Tuple[int, int] = (320, 20), min_correlation: float = 0.9, min_margin: float = 0.05,
+                 references_per_map: int = 3, read_only: bool = False):
+        if directory is None:
+            directory = utils.get_cache_root() / "maps"
+        self.__directory = directory / ("v%d" % self.__version)
+        self.__map_names = list(map_names)
+        self.__size = size
+        self.__min_correlation = min_correlation
+        self.__min_margin = min_margin
+        self.__references_per_map = references_per_map
+        self.__read_only = read_only
+        self.__lock = threading.Lock()
+
+        # One row per reference, with a parallel array of map name indices.
+        self.__references = np.empty((0, size[0] * size[1]), dtype=np.float32)
+        self.__labels = np.empty(0, dtype=np.int32)
+        self.__load()
+
+    def recognize(self, banner) -> Tuple[Optional[str], float]:
+        # Returns the map name, or None if not confident, along with the correlation of the best reference.
+        with self.__lock:
+            references, labels = self.__references, self.__labels
+        if not len(labels):
+            return None, 0.0
+
+        thumbnail = self.__get_thumbnail(banner)
+        if thumbnail is None:
+            return None, 0.0
+
+        correlations = references.dot(thumbnail)
+        best = int(np.argmax(correlations))
+        best_correlation = float(correlations[best])
+
+        # The runner up is the best reference of any other map.
+        other_correlations = correlations[labels != labels[best]]
+        runner_up = float(other_correlations.max()) if len(other_correlations) else -1.0
+
+        map_name = self.__map_names[labels[best]]
+        if best_correlation < self.__min_correlation or best_correlation - runner_up < self.__min_margin:
+            logging.debug("Not confident in map %s, correlation %.3f, runner up %.3f", map_name, best_correlation,
+                          runner_up)
+            return None, best_correlation
+        return map_name, best_correlation
+
+    @property
+    def read_only(self) -> bool:
+        return self.__read_only
+
+    def learn(self, banner, map_name: str):
+        if map_name not in self.__map_names:
+            raise ValueError("Unknown map: " + map_name)
+        if self.__read_only:
+            logging.debug("Not learning map banner for %s, references are read only", map_name)
+            return
+
+        thumbnail = self.__get_thumbnail(banner)
+        if thumbnail is None:
+            return
+
+        label = self.__map_names.index(map_name)
+        with self.__lock:
+            existing = self.__references[self.__labels == label]
+            # Nothing to learn if this looks exactly like a banner we already have.
+            if len(existing) and existing.dot(thumbnail).max() > 0.99:
+                return
+            # Keep the most recent references only
+            existing = np.vstack([existing, thumbnail])[-self.__references_per_map:]
+            others = self.__labels != label
+            self.__references = np.vstack([self.__references[others], existing])
+            self.__labels = np.concatenate([self.__labels[others], np.full(len(existing), label, dtype=np.int32)])
+            logging.info("Learned map banner for %s, %d references", map_name, len(existing))
+            self.__store(map_name, existing)
+
+    def reset(self):
+        # Forgets all learned references, including the persisted ones.
+        if self.__read_only:
+            raise ValueError("Map banner references are read only")
+        with self.__lock:
+            self.__references = self.__references[:0]
+            self.__labels = self.__labels[:0]
+            if not self.__directory.exists():
+                return
+            for path in self.__directory.glob("*.npy"):
+                try:
+                    path.unlink()
+                except OSError:
+                    logging.exception("Failed to remove map banner references %s", path)
+        logging.info("Reset learned map banners")
+
+    def __get_thumbnail(self, banner) -> Optional[np.ndarray]:
+        if min(banner.shape[:2]) == 0:
+            return None
+        if banner.ndim == 3:
+            banner = cv2.cvtColor(banner, cv2.COLOR_BGR2GRAY)
+        thumbnail = cv2.resize(banner, self.__size, interpolation=cv2.INTER_AREA).astype(np.float32).ravel()
+
+        # Zero mean, unit length, so that a dot product is the normalized cross correlation.
+        thumbnail -= thumbnail.mean()
+        norm = np.linalg.norm(thumbnail)
+        if norm == 0:
+            return None
+        return thumbnail / norm
+
+    def __load(self):
+        if not self.__directory.exists():
+            return
+
+        references = []
+        labels = []
+        for label, map_name in enumerate(self.__map_names):
+            path = self.__directory / (map_name + ".npy")
+            if not path.exists():
+                continue
+            try:
+                map_references = np.load(path.as_posix())
+            except (OSError, ValueError):
+                logging.warning("Discarding unreadable map banner references %s", path)
+                continue
+            if map_references.ndim != 2 or map_references.shape[1] != self.__references.shape[1]:
+                continue
+            references.append(map_references.astype(np.float32))
+            labels.append(np.full(len(map_references), label, dtype=np.int32))
+
+        if references:
+            self.__references = np.vstack(references)
+            self.__labels = np.concatenate(labels)
+            logging.debug("Loaded %d map banner references", len(self.__labels))
+
+    def __store(self, map_name: str, references: np.ndarray):
+        try:
+            self.__directory.mkdir(parents=True, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=self.__directory.as_posix(), suffix=".tmp")
+            with os.fdopen(fd, "wb") as temp_file:
+                np.save(temp_file, references)
+            os.replace(temp_path, (self.__directory / (map_name + ".npy")).as_posix())
+        except OSError:
+            logging.exception("Failed to store map banner references for %s", map_name)
@@ -0,0 +1,254 @@
+import logging
+from enum import Enum
+import math
+from typing import Optional, List, AbstractSet, Tuple
+
+import cv2
+import numpy as np
+
+from hotsdraft_overlay import utils
+from hotsdraft_overlay.cache import FeatureCache
+from hotsdraft_overlay.data import DataProvider
+from hotsdraft_overlay.features import get_feature_backend, DescriptorPrecision
+from hotsdraft_overlay.prefilter import PrefilterFallback
+from hotsdraft_overlay.models import Point, ImageCut, Rect, Features, Portrait, DraftHero, MatchCandidate, \
+    FeatureBudget
+from hotsdraft_overlay.templates import TemplateMatcher
+
+
+class ExecutorType(Enum):
+    THREAD = "thread"
+    PROCESS = "process"
+
+
+class DetectionEngine(Enum):
+    # Key points find portraits at any scale, templates are faster but rely on portraits being roughly where
+    # and as big as expected.
+    KEYPOINTS = "keypoints"
+    TEMPLATES = "templates"
+
+
+class VerificationStrategy(Enum):
+    # How matched key points are checked to be a portrait. Portraits in the draft are only ever scaled and moved, so a
+    # similarity transform describes them, and is cheaper to estimate and harder to fit to unrelated matches than a
+    # homography.
+    HOMOGRAPHY = "homography"
+    SIMILARITY = "similarity"
+
+
+class CutMatcher(object):
+    # Maximum distance in pixels between a key point in the cut and where the transform puts its match.
+    __reprojection_threshold = 5.0
+    # Portraits are upright, anything turned more than this many degrees is not one.
+    __max_rotation = 10.0
+    # Above this many matches, checking every pair of them against the scale prior costs more than RANSAC does.
+    __max_prior_matches = 64
+
+    def __init__(self, data_provider: DataProvider, prefilter_top_k: int = 5,
+                 prefilter_fallback: PrefilterFallback = PrefilterFallback.FULL_SCAN,
+                 verification: VerificationStrategy = VerificationStrategy.SIMILARITY,
+                 portrait_height_range: Optional[Tuple[float, float]] = (0.5, 1.05)):
+        self.__data_provider = data_provider
+        self.__feature_backend = data_provider.get_feature_backend()
+        self.__prefilter_top_k = prefilter_top_k
+        self.__prefilter_fallback = prefilter_fallback
+        self.__verification = verification
+        # Slots are cut to fit a portrait, so a portrait takes roughly this share of the height of a cut, which bounds
+        # the scale it can appear at. None to accept any scale.
+        self.__portrait_height_range = portrait_height_range
+
+    def match(self, cut: ImageCut) -> Optional[DraftHero]:
+        candidates = self.match_candidates(cut)
+        return candidates[0].hero if candidates else None
+
+    def match_candidates(self, cut: ImageCut, excluded: AbstractSet[str] = frozenset()) -> List[MatchCandidate]:
+        # Returns the heroes that could be located in the cut, best first, skipping the excluded hero names.
+        cut_features = self.__extract_features(cut)
+        if not len(cut_features.points):
+            logging.debug("Cut %s produced no key points" % cut)
+            return []
+
+        verified = set()
+        if self.__prefilter_top_k > 0:
+            # Only verify the portraits with the most similar colors, which skips querying the index.
+            shortlist = self.__data_provider.get_portrait_prefilter().get_shortlist(
+                cut.planes.hsv, self.__prefilter_top_k, excluded
+            )
+            logging.debug("Cut %s shortlist: %s", cut.region.name,
+                          ", ".join(portrait.hero.name for portrait in shortlist))
+            candidates = self.__verify(cut, cut_features, shortlist)
+            if candidates or self.__prefilter_fallback == PrefilterFallback.NEVER:
+                return candidates
+            logging.debug("No shortlisted portrait matched cut %s, scanning all portraits", cut.region.name)
+            verified = set(id(portrait) for portrait in shortlist)
+
+        # Only verify the portraits that got the most votes from the shared index.
+        candidates = self.__data_provider.get_portrait_index().get_candidates(cut_features, excluded)
+        logging.debug("Cut %s candidates: %s", cut.region.name,
+                      ", ".join("%s (%d)" % (portrait.hero.name, votes) for portrait, votes in candidates))
+
+        return self.__verify(cut, cut_features, [
+            portrait for portrait, _ in candidates if id(portrait) not in verified
+        ])
+
+    def __extract_features(self, cut: ImageCut) -> Features:
+        budget = self.__data_provider.get_feature_budget()
+        if budget is None:
+            return utils.extract_features(cut.planes.gray, self.__feature_backend)
+
+        # Masking also saves computing descriptors of key points outside the slot.
+        mask = utils.get_rect_mask(cut.image, cut.interior) if cut.interior is not None else None
+        cut_features = utils.extract_features(cut.planes.gray, self.__feature_backend, mask)
+        h, w = cut.image.shape[:2]
+        return utils.select_features(cut_features, budget.cut_key_points, Point(w, h), budget.grid)
+
+    def __verify(self, cut: ImageCut, cut_features: Features, portraits: List[Portrait]) -> List[MatchCandidate]:
+        # Returns the portraits that can be located in the cut, best first. They are scored by the number of matches
+        # that passed the ratio test. This used to be the sum of the squared distances of those matches and of their
+        # second nearest neighbours, but Detector assigns heroes to slots by comparing scores between cuts, and such
+        # sums also grow as matches get worse. Verification leaves a single candidate for nearly every cut anyway, and
+        # on the bundled portraits both pick the same winner, see tests/test_matching.py.
+        backend = self.__feature_backend
+        candidates = []
+
+        for portrait in portraits:
+            try:
+                distances, train_indices = utils.match_features(portrait.features, cut_features, backend)
+                query_indices, train_indices = utils.apply_ratio_test(distances, train_indices, backend.ratio)
+
+                if len(query_indices) < backend.min_matches:
+                    logging.debug("Skipping %s as got %d matches", portrait.hero.name, len(query_indices))
+                    continue
+
+                src_pts = portrait.features.points[query_indices]
+                dst_pts = cut_features.points[train_indices]
+                scale_range = self.__get_scale_range(cut, portrait)
+                if scale_range and not self.__is_scale_plausible(src_pts, dst_pts, scale_range, backend.min_matches):
+                    logging.debug("Skipping %s as matches disagree with the expected scale", portrait.hero.name)
+                    continue
+
+                if self.__verification == VerificationStrategy.SIMILARITY:
+                    bounding_box = self.__get_similarity_bounding_box(
+                        portrait, src_pts, dst_pts, scale_range, backend.min_matches
+                    )
+                else:
+                    bounding_box = self.__get_homography_bounding_box(portrait, src_pts, dst_pts)
+                if not bounding_box:
+                    logging.debug("Failed to compute bounding box for %s, skipping", portrait.hero.name)
+                    continue
+
+                # Some false matches are sometimes produced with a bounding box that is stretched.
+                # We expect the matches have a sensible height to width ratio.
+                bounding_box_ratio = bounding_box.ratio
+                if bounding_box_ratio > 1.2:
+                    logging.debug("Skipping %s as got high bounding box ratio %.2f", portrait.hero.name,
+                                  bounding_box_ratio)
+                    continue
+
+                bounding_box_with_offset = utils.get_frame_rect(bounding_box, cut.offset, cut.scale)
+
+                # Whether the hero is locked in is only worked out for the hero that ends up in the slot.
+                hero = DraftHero(portrait.hero.name, portrait.hero.id, True, bounding_box_with_offset, cut.region)
+                candidates.append(MatchCandidate(hero, len(query_indices)))
+                logging.debug("%s matched with %d matches", portrait.hero.name, len(query_indices))
+            except Exception as e:
+                logging.exception("Exception while processing %s" % portrait.hero.name)
+
+        candidates.sort(key=lambda candidate: candidate.score, reverse=True)
+        return candidates
+
+    def __get_scale_range(self, cut: ImageCut, portrait: Portrait) -> Optional[Tuple[float, float]]:
+        if self.__portrait_height_range is None:
+            return None
+        cut_h = cut.image.shape[0]
+        lowest, highest = self.__portrait_height_range
+        return lowest * cut_h / portrait.size.y, highest * cut_h / portrait.size.y
+
+    def __is_scale_plausible(self, src_pts: np.ndarray, dst_pts: np.ndarray, scale_range: Tuple[float, float],
+                             min_matches: int) -> bool:
+        # Cheap test that enough matches could agree on a scale within range, before running RANSAC. Whatever the
+        # translation and rotation, n matches that fit a transform of such scale make n * (n - 1) / 2 pairs whose
+        # distance in the cut is their distance in the portrait times that scale, give or take twice the reprojection
+        # threshold. Fewer such pairs than min_matches would make means verification is bound to fail.
+        if len(src_pts) > self.__max_prior_matches:
+            return True
+        first, second = np.triu_indices(len(src_pts), 1)
+        src_distances = np.linalg.norm(src_pts[first] - src_pts[second], axis=1)
+        dst_distances = np.linalg.norm(dst_pts[first] - dst_pts[second], axis=1)
+        tolerance = 2 * self.__reprojection_threshold
+        consistent = (
+                (dst_distances >= scale_range[0] * src_distances - tolerance) &
+                (dst_distances <= scale_range[1] * src_distances + tolerance)
+        )
+        return np.count_nonzero(consistent) >= min_matches * (min_matches - 1) // 2
+
+    def __get_similarity_bounding_box(self, portrait: Portrait, src_pts: np.ndarray, dst_pts: np.ndarray,
+                                      scale_range: Optional[Tuple[float, float]], min_matches: int) -> Optional[Rect]:
+        matrix, inliers = cv2.estimateAffinePartial2D(
+            src_pts, dst_pts, method=cv2.RANSAC, ransacReprojThreshold=self.__reprojection_threshold
+        )
+        if matrix is None or np.count_nonzero(inliers) < min_matches:
+            return None
+
+        # Rows of the matrix are (s cos a, -s sin a, x) and (s sin a, s cos a, y)
+        scale = math.hypot(matrix[0, 0], matrix[1, 0])
+        rotation = math.degrees(math.atan2(matrix[1, 0], matrix[0, 0]))
+        if abs(rotation) > self.__max_rotation:
+            logging.debug("Skipping %s as it is rotated by %.1f degrees", portrait.hero.name, rotation)
+            return None
+        if scale_range and not scale_range[0] <= scale <= scale_range[1]:
+            logging.debug("Skipping %s as it is scaled by %.2f, expected %.2f to %.2f", portrait.hero.name, scale,
+                          scale_range[0], scale_range[1])
+            return None
+
+        return self.__get_transformed_bounding_box(cv2.transform(self.__get_corners(portrait), matrix))
+
+    def __get_homography_bounding_box(self, portrait: Portrait, src_pts: np.ndarray,
+                                      dst_pts: np.ndarray) -> Optional[Rect]:
+        matrix, _ = cv2.findHomography(src_pts, dst_pts, cv2.RANSAC, self.__reprojection_threshold)
+        if matrix is None:
+            return None
+
+        return self.__get_transformed_bounding_box(cv2.perspectiveTransform(self.__get_corners(portrait), matrix))
+
+    @staticmethod
+    def __get_corners(portrait: Portrait) -> np.ndarray:
+        w, h = portrait.size.tuple
+        return np.float32([[0, 0], [0, h - 1], [w - 1, h - 1], [w - 1, 0]]).reshape(-1, 1, 2)
+
+    @staticmethod
+    def __get_transformed_bounding_box(corners: np.ndarray) -> Rect:
+        corners = corners.reshape(-1, 2)
+        top_left = Point(max(int(corners[:, 0].min()), 0), max(int(corners[:, 1].min()), 0))
+        bottom_right = Point(max(int(corners[:, 0].max()), 0), max(int(corners[:, 1].max()), 0))
+        return Rect(top_left, bottom_right)
+
+
+# Process pool workers load their own copy of the portrait data once, when the pool starts.
+_worker_cut_matcher = None
+
+
+def create_cut_matcher(engine: DetectionEngine, data_provider: DataProvider, prefilter_top_k: int,
+                       prefilter_fallback: PrefilterFallback,
+                       verification: VerificationStrategy = VerificationStrategy.SIMILARITY):
+    if engine == DetectionEngine.TEMPLATES:
+        return TemplateMatcher(data_provider)
+    return CutMatcher(data_provider, prefilter_top_k, prefilter_fallback, verification)
+
+
+def init_worker(engine: DetectionEngine, feature_backend_name: str, feature_budget: Optional[FeatureBudget],
+                portrait_height: Optional[int], descriptor_precision: DescriptorPrecision, keep_images: bool,
+                feature_cache: FeatureCache, prefilter_top_k: int, prefilter_fallback: PrefilterFallback,
+                verification: VerificationStrategy):
+    global _worker_cut_matcher
+    # Portrait features are in the cache of the parent by now, so the worker only loads them, on its own.
+    data_provider = DataProvider(feature_cache=feature_cache, feature_workers=1,
+                                 feature_backend=get_feature_backend(feature_backend_name),
+                                 descriptor_precision=descriptor_precision, keep_images=keep_images,
+                                 feature_budget=feature_budget, portrait_height=portrait_height)
+    _worker_cut_matcher = create_cut_matcher(engine, data_provider, prefilter_top_k, prefilter_fallback,
+                                             verification)
+
+
+def match_candidates_in_worker(cut: ImageCut, excluded: AbstractSet[str]) -> List[MatchCandidate]:
+    return _worker_cut_matcher.match_candidates(cut, excluded)
@@ -1,7 +1,10 @@
+import pathlib
 from dataclasses import dataclass, astuple, field
 from enum import Enum
-from typing import List, Optional, Any, Tuple
+from typing import List, Optional, Any, Tuple, Dict
 
+import cv2
+import numpy as np
 from PyQt5.QtCore import QPoint, QRect
 
 
@@ -10,6 +13,13 @@ class Region(Enum):
     ENEMY_PICKS = 1
     ALLY_BANS = 2
     ENEMY_BANS = 3
+    MAP_BANNER = 4
+
+
+class SlotState(Enum):
+    EMPTY = 0
+    PLACEHOLDER = 1
+    OCCUPIED = 2
 
 
 @dataclass
@@ -49,12 +59,35 @@ class Rect:
     def tuple(self) -> Tuple[int, int, int, int]:
         return self.top_left.tuple + self.bottom_right.tuple
 
+    @property
+    def width(self) -> int:
+        return self.bottom_right.x - self.top_left.x
+
+    @property
+    def height(self) -> int:
+        return self.bottom_right.y - self.top_left.y
+
+    def contains(self, other: 'Rect') -> bool:
+        return (
+                self.top_left.x <= other.top_left.x and self.top_left.y <= other.top_left.y and
+                other.bottom_right.x <= self.bottom_right.x and other.bottom_right.y <= self.bottom_right.y
+        )
+
 
 @dataclass
 class DraftHero(Hero):
     locked: bool
     bounding_box: Rect
     region: Region
+    # How sure the lock state is, from 0 to 1.
+    locked_confidence: float = 1.0
+
+
+@dataclass
+class MatchCandidate:
+    hero: DraftHero
+    # Higher is better, only comparable between candidates from the same detection engine.
+    score: float
 
 
 @dataclass
@@ -81,15 +114,43 @@ class DraftState:
 
 @dataclass
 class Features:
-    key_points: Any
+    # Key point coordinates as a float32 array shaped (n, 2), and their descriptors, one row per key point, or None if
+    # there are none, along with how strong each key point is.
+    points: Any
     descriptors: Any
+    responses: Any
+
+
+@dataclass
+class FeatureBudget:
+    # Most key points to keep per portrait and per cut, 0 for all of them.
+    portrait_key_points: int = 200
+    cut_key_points: int = 300
+    # Columns and rows of a grid that kept key points are spread over, so that busy background art in one part of an
+    # image cannot use up the budget.
+    grid: Tuple[int, int] = (4, 4)
+    # Share of each side of portraits to leave out, as the draft covers the edges with frames. Cuts leave out what is
+    # outside the interior of their slot instead.
+    portrait_margin: float = 0.05
 
 
 @dataclass
 class Portrait:
     hero: Hero
-    image: Any
+    path: pathlib.Path
+    size: Point
     features: Features
+    global_descriptor: Any = None
+    # Luminosity and color variances, see slots.get_lock_statistics.
+    lock_statistics: Any = None
+    # Only kept when the DataProvider is asked to, as nothing needs the pixels once features are extracted.
+    cached_image: Any = None
+
+    @property
+    def image(self):
+        if self.cached_image is not None:
+            return self.cached_image
+        return cv2.imdecode(np.frombuffer(self.path.read_bytes(), dtype=np.uint8), cv2.IMREAD_COLOR)
 
 
 @dataclass
@@ -105,11 +166,128 @@ class Suggestion:
     traits: List[Trait]
 
 
+class ImagePlanes(object):
+    # A color image and the planes derived from it, each converted the first time it is needed and kept. Planes of a
+    # part of an image are views of the planes of the whole image if those were converted already, and are converted
+    # for the part alone otherwise, so that no pixel is converted twice however the image is cut up.
+    def __init__(self, image, parent: Optional['ImagePlanes'] = None, rect: Optional['Rect'] = None):
+        self.__image = image
+        self.__parent = parent
+        self.__rect = rect
+        self.__planes = {}  # type: Dict[int, Any]
+
+    @property
+    def image(self):
+        return self.__image
+
+    @property
+    def gray(self):
+        # Luma, which is the Y plane of YCrCb give or take rounding.
+        return self.__get_plane(cv2.COLOR_BGR2GRAY)
+
+    @property
+    def ycrcb(self):
+        return self.__get_plane(cv2.COLOR_BGR2YCrCb)
+
+    @property
+    def hsv(self):
+        return self.__get_plane(cv2.COLOR_BGR2HSV)
+
+    @property
+    def lab(self):
+        return self.__get_plane(cv2.COLOR_BGR2LAB)
+
+    def crop(self, rect: 'Rect') -> 'ImagePlanes':
+        return ImagePlanes(self.__crop(self.__image, rect), self, rect)
+
+    def __get_plane(self, code: int):
+        plane = self.__find_plane(code)
+        if plane is None:
+            plane = cv2.cvtColor(self.__image, code)
+        self.__planes[code] = plane
+        return plane
+
+    def __find_plane(self, code: int):
+        plane = self.__planes.get(code)
+        if plane is None and self.__parent is not None:
+            plane = self.__parent.__find_plane(code)
+            if plane is not None:
+                plane = self.__crop(plane, self.__rect)
+        return plane
+
+    @staticmethod
+    def __crop(image, rect: 'Rect'):
+        return image[rect.top_left.y:rect.bottom_right.y, rect.top_left.x:rect.bottom_right.x]
+
+    def __getstate__(self):
+        # Leaves out the image this was cut from, so that pickling a part does not pickle all of it.
+        return {"image": self.__image, "planes": self.__planes}
+
+    def __setstate__(self, state):
+        self.__image = state["image"]
+        self.__parent = None
+        self.__rect = None
+        self.__planes = state["planes"]
+
+
 @dataclass
 class ImageCut:
     image: Any
     region: Region
     offset: Point
+    state: Optional[SlotState] = None
+    # Part of the cut the portrait is expected to be in, relative to the cut.
+    interior: Optional[Rect] = None
+    # Size of the cut relative to the part of the frame it was cut from, when it was shrunk. Offset is in frame
+    # coordinates either way.
+    scale: float = 1.0
+    # Planes of the image, shared with the region it was cut from, made from the image if not given.
+    planes: Optional[ImagePlanes] = None
+
+    def __post_init__(self):
+        if self.planes is None:
+            self.planes = ImagePlanes(self.image)
+
+
+@dataclass
+class CapturedRegion:
+    rect: Rect
+    image: Any
+
+
+@dataclass
+class CapturedFrame:
+    # A frame of which only some regions were captured, positioned in frame coordinates.
+    size: Point
+    regions: List[CapturedRegion]
+
+    @staticmethod
+    def from_image(image) -> 'CapturedFrame':
+        h, w = image.shape[:2]
+        return CapturedFrame(Point(w, h), [CapturedRegion(Rect(Point(0, 0), Point(w, h)), image)])
+
+    def crop(self, rect: Rect):
+        for region in self.regions:
+            if region.rect.contains(rect):
+                return region.image[
+                       rect.top_left.y - region.rect.top_left.y:rect.bottom_right.y - region.rect.top_left.y,
+                       rect.top_left.x - region.rect.top_left.x:rect.bottom_right.x - region.rect.top_left.x
+                       ]
+        raise ValueError("%s was not captured" % (rect,))
+
+
+@dataclass
+class SlotSnapshot:
+    fingerprint: Any
+    state: SlotState
+    match: Optional[DraftHero]
+
+
+@dataclass
+class CacheStats:
+    hits: int
+    misses: int
+    entries: int
 
 
 @dataclass
@@ -0,0 +1,65 @@
+from enum import Enum
+from typing import List, Optional, Tuple, AbstractSet
+
+import cv2
+import numpy as np
+
+from hotsdraft_overlay.models import Portrait
+
+# Hue and saturation only, leaving out brightness, as portraits of heroes that are not locked in yet are dimmed.
+HISTOGRAM_BINS = (16, 8)
+
+
+class PrefilterFallback(Enum):
+    # What to do when none of the shortlisted portraits verify.
+    NEVER = "never"
+    FULL_SCAN = "full_scan"
+
+
+def get_global_descriptor(image, bins: Tuple[int, int] = HISTOGRAM_BINS) -> Optional[np.ndarray]:
+    # Square root of the normalized hue/saturation histogram, so that the dot product of two descriptors is their
+    # Bhattacharyya coefficient.
+    if min(image.shape[:2]) == 0:
+        return None
+    return get_hsv_descriptor(cv2.cvtColor(image, cv2.COLOR_BGR2HSV), bins)
+
+
+def get_hsv_descriptor(hsv, bins: Tuple[int, int] = HISTOGRAM_BINS) -> Optional[np.ndarray]:
+    # Global descriptor of an image already converted to HSV.
+    if min(hsv.shape[:2]) == 0:
+        return None
+    histogram = cv2.calcHist([hsv], [0, 1], None, list(bins), [0, 180, 0, 256]).ravel()
+    total = histogram.sum()
+    if total == 0:
+        return None
+    return np.sqrt(histogram / total).astype(np.float32)
+
+
+class PortraitPrefilter(object):
+    # Ranks all portraits against a cut with a single matrix-vector product of color histograms. Histograms ignore
+    # where things are, so the background around the portrait in a cut costs little, and the hero is almost always
+    # among the first few portraits, which are then the only ones that need matching key points.
+    def __init__(self, portraits: List[Portrait]):
+        self.__portraits = portraits
+        size = HISTOGRAM_BINS[0] * HISTOGRAM_BINS[1]
+        self.__descriptors = np.vstack([
+            portrait.global_descriptor if portrait.global_descriptor is not None else np.zeros(size, np.float32)
+            for portrait in portraits
+        ])
+
+    def get_shortlist(self, hsv, top_k: int, excluded: AbstractSet[str] = frozenset()) -> List[Portrait]:
+        # Returns the top_k portraits most similar to the image, given in HSV, best first, skipping the excluded hero
+        # names.
+        descriptor = get_hsv_descriptor(hsv)
+        if descriptor is None:
+            return []
+
+        similarities = self.__descriptors.dot(descriptor)
+        allowed = np.array([portrait.hero.name not in excluded for portrait in self.__portraits])
+        similarities[~allowed] = -np.inf
+        top_k = min(top_k, int(allowed.sum()))
+        if top_k <= 0:
+            return []
+        best = np.argpartition(-similarities, top_k - 1)[:top_k]
+        best = best[np.argsort(-similarities[best], kind="stable")]
+        return [self.__portraits[label] for label in best]
@@ -1,51 +1,96 @@
+import argparse
 import logging
+import multiprocessing
+import os
 import sys
-from concurrent.futures import ThreadPoolExecutor
-from queue import Queue
+import time
+from queue import Queue, Empty
+from typing import Optional
 
 import keyboard
 from PyQt5.QtCore import QThread
 from PyQt5.QtWidgets import QApplication
 
 from hotsdraft_overlay import layout, utils
-from hotsdraft_overlay.canvas import WindowCanvas, BaseCanvas
+from hotsdraft_overlay.calibration import SlotCalibration
+from hotsdraft_overlay.canvas import WindowCanvas, BaseCanvas, X11Canvas
 from hotsdraft_overlay.data import DataProvider
 from hotsdraft_overlay.detection import Detector
-from hotsdraft_overlay.models import Annotation, Point
+from hotsdraft_overlay.features import FeatureBackend, get_feature_backend, get_feature_backend_names, \
+    DEFAULT_FEATURE_BACKEND
+from hotsdraft_overlay.matching import DetectionEngine, ExecutorType
+from hotsdraft_overlay.models import Point, FeatureBudget
+from hotsdraft_overlay.scaling import ResolutionPolicy, DEFAULT_PORTRAIT_HEIGHT
 from hotsdraft_overlay.suggest import Suggester
+from hotsdraft_overlay.watch import FrameChangeDetector, CaptureScheduler
 
 logging.basicConfig(level=logging.INFO, format='[%(asctime)s] [%(levelname)s]: %(message)s')
 
 
 class Runner(QThread):
-    def __init__(self, parent, canvas: BaseCanvas):
+    def __init__(self, parent, canvas: BaseCanvas, watch: bool = False,
+                 capture_scheduler: Optional[CaptureScheduler] = None, suggestion_timeout: float = 10,
+                 feature_backend: Optional[FeatureBackend] = None, engine: DetectionEngine = DetectionEngine.KEYPOINTS,
+                 feature_budget: Optional[FeatureBudget] = None, calibrate: bool = True,
+                 resolution_policy: ResolutionPolicy = ResolutionPolicy.NATIVE, reset_maps: bool = False,
+                 workers: Optional[int] = None, executor_type: ExecutorType = ExecutorType.THREAD):
         super().__init__(parent)
         self.canvas = canvas
+        self.watch = watch
+        self.feature_backend = feature_backend
+        self.feature_budget = feature_budget
+        self.calibrate = calibrate
+        self.resolution_policy = resolution_policy
+        self.engine = engine
+        self.reset_maps = reset_maps
+        self.workers = workers or os.cpu_count() or 1
+        self.executor_type = executor_type
+        self.capture_scheduler = capture_scheduler or CaptureScheduler()
+        self.suggestion_timeout = suggestion_timeout
 
     def run(self):
         # run_in_layout_build_mode(canvas)
-        data_provider = DataProvider()
-        detector = Detector(data_provider)
+        # Portrait features are extracted at the height regions shrink portraits to.
+        portrait_height = DEFAULT_PORTRAIT_HEIGHT if self.resolution_policy == ResolutionPolicy.REGION else None
+        data_provider = DataProvider(feature_backend=self.feature_backend, feature_budget=self.feature_budget,
+                                     portrait_height=portrait_height)
+        detector = Detector(data_provider, workers=self.workers, executor_type=self.executor_type, engine=self.engine,
+                            calibration=SlotCalibration() if self.calibrate else None,
+                            resolution_policy=self.resolution_policy)
+        if self.reset_maps:
+            detector.reset_maps()
         suggester = Suggester(data_provider)
         layouts = [
             layout.LabelLayout(),
             layout.DraftSuggestionLayout()
         ]
-        thread_pool = ThreadPoolExecutor(4)
 
         keyboard_queue = Queue(100)
         keyboard.add_hotkey("F8", lambda *a, **k: keyboard_queue.put("F8"))
         keyboard.add_hotkey("F7", lambda *a, **k: keyboard_queue.put("F7"))
 
+        frame_change_detector = FrameChangeDetector()
+
         visible = False
 
-        logging.info("Press F8 to show/hide overlay, F7 to refresh while it's visible")
+        if self.watch:
+            logging.info("Press F8 to show/hide overlay, it refreshes automatically while it's visible")
+        else:
+            logging.info("Press F8 to show/hide overlay, F7 to refresh while it's visible")
 
         while True:
-            key_pressed = keyboard_queue.get()
+            # In watch mode, a timeout is a cue to capture a frame and check if anything changed.
+            timeout = self.capture_scheduler.get_interval() if self.watch and visible else None
+            try:
+                key_pressed = keyboard_queue.get(timeout=timeout)
+            except Empty:
+                key_pressed = None
+
             if key_pressed == "F8" and visible:
                 canvas.clear_paint_commands()
                 visible = False
+                frame_change_detector.reset()
+                self.capture_scheduler.reset()
                 logging.info("Hiding overlay")
                 continue
 
@@ -57,15 +102,25 @@ class Runner(QThread):
             # F8 will be queued up which will make it invisible.
             visible = True
 
-            # It's either a refresh with F7 or a show with F8
+            # It's either a refresh with F7, a show with F8 or a watch mode capture
+            started = time.perf_counter()
+            changed = True
             try:
-                canvas_image = canvas.capture()
-                if canvas_image is None:
+                frame = canvas.capture_regions(Detector.get_capture_regions)
+                if key_pressed is None:
+                    # If the game is not in the foreground, keep the overlay as it is.
+                    changed = frame is not None and frame_change_detector.has_changed(frame)
+                    if not changed:
+                        continue
+                    logging.info("Frame changed, processing")
+                elif frame is None:
                     logging.info("Could not capture image")
                     keyboard_queue.put("F8")
                     continue
-                logging.info("Captured image, processing")
-                draft_state = detector.get_draft_state(canvas_image)
+                else:
+                    frame_change_detector.update(frame)
+                    logging.info("Captured image, processing")
+                draft_state = detector.get_frame_draft_state(frame)
                 logging.info("Processed image")
 
                 if not draft_state:
@@ -73,95 +128,35 @@ class Runner(QThread):
                     keyboard_queue.put("F8")
                     continue
 
-                pick_suggestions_future = thread_pool.submit(lambda: suggester.get_draft_suggestions(
-                    draft_state.map,
-                    draft_state.locked_ally_picks,
-                    draft_state.enemy_picks,
-                    draft_state.bans
-                ))
-                unlocked_pick_suggestions_future = thread_pool.submit(lambda: suggester.get_draft_suggestions(
-                    draft_state.map,
-                    draft_state.ally_picks,
-                    draft_state.enemy_picks,
-                    draft_state.bans
-                ))
-                ban_suggestions_future = thread_pool.submit(lambda: suggester.get_ban_suggestions(
-                    draft_state.map,
-                    draft_state.locked_ally_picks,
-                    draft_state.enemy_picks,
-                    draft_state.bans
-                ))
-                unlocked_ban_suggestions_future = thread_pool.submit(lambda: suggester.get_ban_suggestions(
-                    draft_state.map,
-                    draft_state.ally_picks,
-                    draft_state.enemy_picks,
-                    draft_state.bans
-                ))
-                logging.info("Submitted suggestion requests")
-                pick_suggestions = pick_suggestions_future.result()
-                unlocked_pick_suggestions = unlocked_pick_suggestions_future.result()
-                ban_suggestions = ban_suggestions_future.result()
-                unlocked_ban_suggestions = unlocked_ban_suggestions_future.result()
+                logging.info("Requesting suggestions")
+                annotation = suggester.get_annotation(draft_state, timeout=self.suggestion_timeout)
                 logging.info("Suggestions retrieved")
 
-                annotation = Annotation(draft_state, pick_suggestions, ban_suggestions, unlocked_pick_suggestions,
-                                        unlocked_ban_suggestions)
-
-                size = Point(canvas_image.shape[1], canvas_image.shape[0])
                 paint_commands = []
                 for current_layout in layouts:
                     paint_commands.extend(
-                        current_layout.get_paint_commands(size, annotation)
+                        current_layout.get_paint_commands(frame.size, annotation)
                     )
                 logging.info("Generated overlay")
                 canvas.execute_paint_commands(paint_commands)
             except Exception as e:
                 logging.exception("Failed to run: %s", e)
+            finally:
+                if key_pressed is None:
+                    self.capture_scheduler.record(changed, time.perf_counter() - started)
 
 
 def run_in_layout_build_mode(canvas):
     data_provider = DataProvider()
     detector = Detector(data_provider)
     suggester = Suggester(data_provider)
-    thread_pool = ThreadPoolExecutor(4)
 
     canvas_image = canvas.capture()
     draft_state = detector.get_draft_state(canvas_image)
 
-    pick_suggestions_future = thread_pool.submit(lambda: suggester.get_draft_suggestions(
-        draft_state.map,
-        draft_state.locked_ally_picks,
-        draft_state.enemy_picks,
-        draft_state.bans
-    ))
-    unlocked_pick_suggestions_future = thread_pool.submit(lambda: suggester.get_draft_suggestions(
-        draft_state.map,
-        draft_state.ally_picks,
-        draft_state.enemy_picks,
-        draft_state.bans
-    ))
-    ban_suggestions_future = thread_pool.submit(lambda: suggester.get_ban_suggestions(
-        draft_state.map,
-        draft_state.locked_ally_picks,
-        draft_state.enemy_picks,
-        draft_state.bans
-    ))
-    unlocked_ban_suggestions_future = thread_pool.submit(lambda: suggester.get_ban_suggestions(
-        draft_state.map,
-        draft_state.ally_picks,
-        draft_state.enemy_picks,
-        draft_state.bans
-    ))
-    logging.info("Submitted suggestion requests")
-    pick_suggestions = pick_suggestions_future.result()
-    unlocked_pick_suggestions = unlocked_pick_suggestions_future.result()
-    ban_suggestions = ban_suggestions_future.result()
-    unlocked_ban_suggestions = unlocked_ban_suggestions_future.result()
+    annotation = suggester.get_annotation(draft_state)
     logging.info("Suggestions retrieved")
 
-    annotation = Annotation(draft_state, pick_suggestions, ban_suggestions, unlocked_pick_suggestions,
-                            unlocked_ban_suggestions)
-
     size = Point(canvas_image.shape[1], canvas_image.shape[0])
 
     import importlib
@@ -189,11 +184,55 @@ def run_in_layout_build_mode(canvas):
 
 
 if __name__ == "__main__":
+    # Portrait features are extracted in worker processes, which need this when frozen by PyInstaller.
+    multiprocessing.freeze_support()
     utils.monkey_patch_exception_hook()
-    app = QApplication(sys.argv)
-    canvas = WindowCanvas("Heroes of the Storm")
 
-    runner = Runner(app, canvas)
+    parser = argparse.ArgumentParser(description="Overlay with draft suggestions for Heroes of the Storm")
+    parser.add_argument("--watch", action="store_true", help="Refresh automatically while the overlay is visible")
+    parser.add_argument("--cpu-budget", type=float, default=0.25,
+                        help="Share of the time watch mode may spend capturing and detecting, in (0, 1]")
+    parser.add_argument("--min-interval", type=float, default=0.25,
+                        help="Seconds between captures in watch mode while the draft is changing")
+    parser.add_argument("--max-interval", type=float, default=2.0,
+                        help="Seconds between captures in watch mode that captures back off to while it is not")
+    parser.add_argument("--feature-backend", default=DEFAULT_FEATURE_BACKEND, choices=get_feature_backend_names(),
+                        help="Key point detector used to recognize portraits")
+    parser.add_argument("--feature-budget", action="store_true",
+                        help="Limit key points per portrait and per slot, to match faster")
+    parser.add_argument("--no-calibration", action="store_true",
+                        help="Always cut slots at fixed fractions of the screen rather than around found portraits")
+    parser.add_argument("--resolution-policy", default=ResolutionPolicy.NATIVE.value,
+                        choices=[policy.value for policy in ResolutionPolicy],
+                        help="Whether to shrink parts of the screen before recognizing portraits, and how")
+    parser.add_argument("--engine", default=DetectionEngine.KEYPOINTS.value,
+                        choices=[engine.value for engine in DetectionEngine],
+                        help="Whether to recognize portraits by key points or by templates")
+    parser.add_argument("--reset-maps", action="store_true",
+                        help="Forget the map banners learned so far, and learn them again")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Number of slots to match at the same time, 1 to match them one after another")
+    parser.add_argument("--executor", default=ExecutorType.THREAD.value, choices=[kind.value for kind in ExecutorType],
+                        help="Whether slots are matched on threads or in worker processes")
+    # Leave the rest for Qt
+    args, qt_args = parser.parse_known_args()
+    try:
+        capture_scheduler = CaptureScheduler(min_interval=args.min_interval, max_interval=args.max_interval,
+                                             cpu_budget=args.cpu_budget)
+    except ValueError as e:
+        parser.error(str(e))
+
+    app = QApplication(sys.argv[:1] + qt_args)
+    if sys.platform.startswith("linux"):
+        canvas = X11Canvas("Heroes of the Storm")
+    else:
+        canvas = WindowCanvas("Heroes of the Storm")
+
+    runner = Runner(app, canvas, watch=args.watch, capture_scheduler=capture_scheduler,
+                    feature_backend=get_feature_backend(args.feature_backend), engine=DetectionEngine(args.engine),
+                    feature_budget=FeatureBudget() if args.feature_budget else None,
+                    calibrate=not args.no_calibration, resolution_policy=ResolutionPolicy(args.resolution_policy),
+                    reset_maps=args.reset_maps, workers=args.workers, executor_type=ExecutorType(args.executor))
     runner.start()
 
     sys.exit(app.exec())
@@ -0,0 +1,48 @@
+from enum import Enum
+
+from hotsdraft_overlay import utils
+from hotsdraft_overlay.models import Point, Rect, Region
+
+
+class ResolutionPolicy(Enum):
+    # Resolution each region of the frame is worked on at. Native keeps what was captured, frame shrinks every region
+    # as if the frame was frame_height lines tall, and region shrinks each region just enough that its portraits, or
+    # the text of the map banner, come out as big as they need to be to be recognized.
+    NATIVE = "native"
+    FRAME = "frame"
+    REGION = "region"
+
+
+# Height of portraits, in pixels, regions are shrunk to by default. Portrait features are best extracted at the same
+# height, see DataProvider.
+DEFAULT_PORTRAIT_HEIGHT = 100
+
+
+class RegionScaler(object):
+    # Share of the height of a region a single portrait takes, which follows from how regions are sliced into slots.
+    __portrait_shares = {
+        Region.ALLY_PICKS: 0.8 / 5,
+        Region.ENEMY_PICKS: 0.8 / 5,
+        Region.ALLY_BANS: 0.8,
+        Region.ENEMY_BANS: 0.8,
+    }
+
+    def __init__(self, policy: ResolutionPolicy = ResolutionPolicy.NATIVE,
+                 portrait_height: int = DEFAULT_PORTRAIT_HEIGHT, banner_height: int = 40, frame_height: int = 1080):
+        self.__policy = policy
+        self.__portrait_height = portrait_height
+        self.__banner_height = banner_height
+        self.__frame_height = frame_height
+
+    @property
+    def policy(self) -> ResolutionPolicy:
+        return self.__policy
+
+    def get_scale(self, region: Region, rect: Rect, frame_size: Point) -> float:
+        if self.__policy == ResolutionPolicy.NATIVE:
+            return 1.0
+        if self.__policy == ResolutionPolicy.FRAME:
+            return utils.get_scale(frame_size.y, self.__frame_height)
+        if region == Region.MAP_BANNER:
+            return utils.get_scale(rect.height, self.__banner_height)
+        return utils.get_scale(rect.height * self.__portrait_shares[region], self.__portrait_height)
@@ -0,0 +1,101 @@
+import math
+from typing import Tuple
+
+import cv2
+import numpy as np
+
+from hotsdraft_overlay import utils
+from hotsdraft_overlay.models import SlotState, Rect, Point, Portrait
+
+# Scales of portraits, relative to their size in the portrait files, that lock statistics are computed at.
+LOCK_STATISTICS_SCALES = (0.18, 0.25, 0.35, 0.5, 0.7, 1.0)
+
+
+class SlotClassifier(object):
+    # Classifies a cut from a tiny thumbnail before any feature work is done. Portraits are busy images, so a slot with
+    # a near flat colour is empty, and one with some contrast but hardly any edges only shows the slot frame.
+    def __init__(self, thumbnail_size: int = 32, empty_deviation: float = 12, empty_edges: float = 10,
+                 placeholder_edges: float = 15):
+        self.__thumbnail_size = thumbnail_size
+        self.__empty_deviation = empty_deviation
+        self.__empty_edges = empty_edges
+        self.__placeholder_edges = placeholder_edges
+
+    def classify(self, image) -> SlotState:
+        # Takes a color or an already gray image.
+        if min(image.shape[:2]) == 0:
+            return SlotState.EMPTY
+
+        # Plain sampling is an order of magnitude faster than area interpolation and good enough for statistics.
+        gray = cv2.resize(image, (self.__thumbnail_size, self.__thumbnail_size), interpolation=cv2.INTER_LINEAR)
+        if gray.ndim == 3:
+            gray = cv2.cvtColor(gray, cv2.COLOR_BGR2GRAY)
+        _, deviation = cv2.meanStdDev(gray)
+        edges = cv2.mean(cv2.convertScaleAbs(cv2.Laplacian(gray, cv2.CV_16S)))[0]
+
+        if deviation[0][0] < self.__empty_deviation and edges < self.__empty_edges:
+            return SlotState.EMPTY
+        if edges < self.__placeholder_edges:
+            return SlotState.PLACEHOLDER
+        return SlotState.OCCUPIED
+
+
+class LockDetector(object):
+    # Portraits of heroes that are not locked in yet are dimmed, which shows in the variance of luminosity of their
+    # interior. The variance of every portrait is computed once when it is loaded, at a few scales, as shrinking an
+    # image smooths it, so only the slot needs looking at, once the hero in it is known.
+    def __init__(self, threshold: float = 2.5):
+        self.__threshold = threshold
+
+    def get_locked_status(self, portrait: Portrait, draft_luminosity) -> Tuple[bool, float]:
+        # Returns whether the hero is locked in, and how confidently, from 0 for a portrait exactly as dimmed as the
+        # threshold, to 1 for one that is as bright as the original or dimmed twice as much as the threshold. Takes
+        # the luminosity of the portrait in the draft, the gray plane, which is the Y plane of YCrCb.
+        portrait_h = portrait.size.y
+        if draft_luminosity.shape[0] > portrait_h:
+            # Compared at the size of the portrait file, as upscaled portraits carry no more detail than it does.
+            draft_luminosity = utils.resize(draft_luminosity, height=portrait_h)
+        interior = get_interior(draft_luminosity)
+        if min(interior.shape[:2]) == 0:
+            return False, 0.0
+
+        _, deviations = cv2.meanStdDev(interior)
+        draft_variance = max(deviations[0][0] ** 2, 1e-6)
+        portrait_variance = max(self.__get_portrait_variance(portrait, draft_luminosity.shape[0] / float(portrait_h)),
+                                1e-6)
+        luminosity_ratio = float(portrait_variance / draft_variance)
+
+        locked = luminosity_ratio < self.__threshold
+        confidence = min(abs(math.log(luminosity_ratio / self.__threshold)) / math.log(self.__threshold), 1.0)
+        return locked, confidence
+
+    @staticmethod
+    def __get_portrait_variance(portrait: Portrait, scale: float) -> float:
+        # Variance of the portrait shrunk to the scale it is shown at, interpolated between the scales statistics were
+        # computed at, as variance falls off smoothly as the portrait shrinks.
+        scales = np.log(LOCK_STATISTICS_SCALES)
+        variances = np.log(np.maximum(portrait.lock_statistics[:, 0].astype(np.float64), 1e-6))
+        return float(np.exp(np.interp(math.log(scale), scales, variances)))
+
+
+def get_interior(image):
+    # Remove the frames and what not, by cutting a smaller square out of the image, stripping 25% of each side.
+    h, w = image.shape[:2]
+    ratio = 4
+    return utils.crop_to_rect(image, Rect(
+        Point(int(w / ratio), int(h / ratio)),
+        Point(int((ratio - 1) * w / ratio), int((ratio - 1) * h / ratio))
+    ))
+
+
+def get_lock_statistics(portrait_image) -> np.ndarray:
+    # Variances of the Y, Cr and Cb channels of the interior of the portrait, one row per scale in
+    # LOCK_STATISTICS_SCALES. Only luminosity is used for now.
+    h, w = portrait_image.shape[:2]
+    statistics = []
+    for scale in LOCK_STATISTICS_SCALES:
+        size = (max(int(round(w * scale)), 1), max(int(round(h * scale)), 1))
+        scaled = cv2.resize(portrait_image, size, interpolation=cv2.INTER_AREA) if scale != 1.0 else portrait_image
+        _, deviations = cv2.meanStdDev(cv2.cvtColor(get_interior(scaled), cv2.COLOR_BGR2YCrCb))
+        statistics.append(deviations.ravel() ** 2)
+    return np.array(statistics, dtype=np.float32)
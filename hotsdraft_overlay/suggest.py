@@ -1,21 +1,251 @@
-from typing import List
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait, as_completed, TimeoutError
+from typing import List, Optional, Any, Dict
 
 import requests
+from requests.adapters import HTTPAdapter
 
+from hotsdraft_overlay import utils
+from hotsdraft_overlay.cache import ResponseCache
 from hotsdraft_overlay.data import DataProvider
-from hotsdraft_overlay.models import Suggestion, Hero, Trait
+from hotsdraft_overlay.models import Suggestion, Hero, Trait, CacheStats, DraftState, Annotation
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+class CircuitBreaker(object):
+    # Stops sending requests to a backend after failure_threshold consecutive failures. After reset_timeout seconds a
+    # single trial request is let through, and its outcome decides whether the circuit closes or stays open.
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 30):
+        self.__failure_threshold = failure_threshold
+        self.__reset_timeout = reset_timeout
+        self.__lock = threading.Lock()
+        self.__failures = 0
+        self.__opened_at = None
+        self.__trial_in_progress = False
+
+    def allow_request(self) -> bool:
+        with self.__lock:
+            if self.__opened_at is None:
+                return True
+            if self.__trial_in_progress or time.monotonic() - self.__opened_at < self.__reset_timeout:
+                return False
+            self.__trial_in_progress = True
+            return True
+
+    def record_success(self):
+        with self.__lock:
+            if self.__opened_at is not None:
+                logging.info("Suggestion backend recovered, closing circuit")
+            self.__failures = 0
+            self.__opened_at = None
+            self.__trial_in_progress = False
+
+    def record_failure(self):
+        with self.__lock:
+            self.__failures += 1
+            self.__trial_in_progress = False
+            if self.__opened_at is not None or self.__failures >= self.__failure_threshold:
+                if self.__opened_at is None:
+                    logging.warning("Suggestion backend failed %d times, opening circuit", self.__failures)
+                self.__opened_at = time.monotonic()
+
+    @property
+    def is_open(self) -> bool:
+        with self.__lock:
+            return self.__opened_at is not None
+
+
+class SuggestionClient(object):
+    __default_url = "https://hotsdraft.com/draft/list/"
+
+    def __init__(self, url: Optional[str] = None, pool_size: int = 4, request_timeout: float = 5,
+                 hedge_percentile: Optional[float] = 95, hedge_min_samples: int = 10,
+                 circuit_breaker: Optional[CircuitBreaker] = None):
+        self.__url = url or self.__default_url
+        self.__request_timeout = request_timeout
+        self.__hedge_percentile = hedge_percentile
+        self.__hedge_min_samples = hedge_min_samples
+        self.__circuit_breaker = circuit_breaker or CircuitBreaker()
+
+        # A single session keeps connections alive between refreshes, saving the TCP and TLS handshakes.
+        # Leave room in the pool for hedged requests.
+        self.__session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size * 2)
+        self.__session.mount("http://", adapter)
+        self.__session.mount("https://", adapter)
+        self.__executor = ThreadPoolExecutor(pool_size * 2)
+
+        self.__lock = threading.Lock()
+        self.__in_flight = {}
+        self.__latencies = deque(maxlen=100)
+
+    @property
+    def circuit_breaker(self) -> CircuitBreaker:
+        return self.__circuit_breaker
+
+    def fetch(self, key: str, payload: Dict[str, Any], timeout: Optional[float] = None) -> List[Any]:
+        if timeout is None:
+            timeout = self.__request_timeout
+
+        # Identical payloads requested while one is already in flight wait for that response instead.
+        with self.__lock:
+            future = self.__in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self.__in_flight[key] = Future()
+
+        if not owner:
+            return future.result(timeout)
+
+        try:
+            if not self.__circuit_breaker.allow_request():
+                raise CircuitOpenError("Suggestion backend is unhealthy")
+            try:
+                results = self.__post_hedged(payload, timeout)
+            except Exception:
+                self.__circuit_breaker.record_failure()
+                raise
+            self.__circuit_breaker.record_success()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(results)
+            return results
+        finally:
+            with self.__lock:
+                del self.__in_flight[key]
+
+    def close(self):
+        self.__executor.shutdown(wait=False)
+        self.__session.close()
+
+    def __post_hedged(self, payload: Dict[str, Any], timeout: float) -> List[Any]:
+        # If the response is slower than most recent ones, send a duplicate request and take whichever finishes first.
+        deadline = time.monotonic() + timeout
+        attempts = [self.__executor.submit(self.__post, payload, timeout)]
+
+        hedge_delay = self.__get_hedge_delay()
+        if hedge_delay is not None and hedge_delay < timeout:
+            done, _ = wait(attempts, timeout=hedge_delay)
+            if not done:
+                logging.debug("No response after %.3fs, hedging request", hedge_delay)
+                attempts.append(self.__executor.submit(self.__post, payload, max(deadline - time.monotonic(), 0.001)))
+
+        error = None
+        try:
+            for attempt in as_completed(attempts, timeout=max(deadline - time.monotonic(), 0)):
+                try:
+                    return attempt.result()
+                except Exception as e:
+                    error = e
+        except TimeoutError:
+            raise requests.Timeout("No suggestions within %.2fs" % timeout)
+        raise error
+
+    def __post(self, payload: Dict[str, Any], timeout: float) -> List[Any]:
+        started = time.monotonic()
+        response = self.__session.post(self.__url, data=payload, timeout=timeout)
+        response.raise_for_status()
+        results = response.json()['scores']
+        with self.__lock:
+            self.__latencies.append(time.monotonic() - started)
+        return results
+
+    def __get_hedge_delay(self) -> Optional[float]:
+        if self.__hedge_percentile is None:
+            return None
+        with self.__lock:
+            if len(self.__latencies) < self.__hedge_min_samples:
+                return None
+            latencies = list(self.__latencies)
+        return utils.get_percentile(latencies, self.__hedge_percentile)
 
 
 class Suggester(object):
-    def __init__(self, data_provider: DataProvider):
+    def __init__(self, data_provider: DataProvider, cache: Optional[ResponseCache] = None,
+                 client: Optional[SuggestionClient] = None):
         self.__data_provider = data_provider
+        self.__cache = cache or ResponseCache(path=utils.get_cache_root() / "suggestions.json")
+        self.__client = client or SuggestionClient()
+        # Requests are blocking, one thread per suggestion variant lets them all wait at the same time.
+        self.__executor = ThreadPoolExecutor(4)
+
+    def get_cache_stats(self) -> CacheStats:
+        return self.__cache.get_stats()
+
+    def get_annotation(self, draft_state: DraftState, timeout: Optional[float] = None) -> Annotation:
+        return asyncio.run(self.get_annotation_async(draft_state, timeout))
+
+    async def get_annotation_async(self, draft_state: DraftState, timeout: Optional[float] = None) -> Annotation:
+        # Fetches all suggestion variants concurrently, sharing a single timeout. Variants that did not make it in time
+        # fall back to the last known answer, or no suggestions at all. This is not asynchronous I/O: each variant is a
+        # blocking requests call, run on the thread pool of the suggester through run_in_executor, and awaited here.
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        payloads = [
+            self.__get_draft_payload(draft_state.map, draft_state.locked_ally_picks, draft_state.enemy_picks,
+                                     draft_state.bans),
+            self.__get_draft_payload(draft_state.map, draft_state.ally_picks, draft_state.enemy_picks,
+                                     draft_state.bans),
+            self.__get_ban_payload(draft_state.map, draft_state.locked_ally_picks, draft_state.enemy_picks,
+                                   draft_state.bans),
+            self.__get_ban_payload(draft_state.map, draft_state.ally_picks, draft_state.enemy_picks,
+                                   draft_state.bans),
+        ]
+        # Locked and unlocked variants are the same once all ally picks are locked in, and are then fetched, and looked
+        # up in the cache, only once.
+        futures = {}
+        for payload in payloads:
+            key = self.__get_cache_key(payload)
+            if key not in futures:
+                futures[key] = loop.run_in_executor(self.__executor, self.__get_suggestions_for_payload, payload,
+                                                    deadline)
+        await asyncio.wait(list(futures.values()), timeout=timeout)
+
+        results = []
+        for payload in payloads:
+            future = futures[self.__get_cache_key(payload)]
+            if future.done():
+                results.append(future.result())
+            else:
+                future.cancel()
+                logging.warning("Suggestions did not arrive within %.2fs", timeout)
+                results.append(self.__get_fallback_suggestions(payload))
+        pick_suggestions, unlocked_pick_suggestions, ban_suggestions, unlocked_ban_suggestions = results
 
-    def get_draft_suggestions(self, map_name: str, allies: List[Hero], enemies: List[Hero], bans: List[Hero]) -> \
-            List[Suggestion]:
+        return Annotation(draft_state, pick_suggestions, ban_suggestions, unlocked_pick_suggestions,
+                          unlocked_ban_suggestions)
+
+    def close(self):
+        self.__executor.shutdown(wait=False)
+        self.__client.close()
+        self.__cache.close()
+
+    def get_draft_suggestions(self, map_name: str, allies: List[Hero], enemies: List[Hero], bans: List[Hero],
+                              deadline: Optional[float] = None) -> List[Suggestion]:
+        payload = self.__get_draft_payload(map_name, allies, enemies, bans)
+        return self.__get_suggestions_for_payload(payload, deadline)
+
+    def get_ban_suggestions(self, map_name: str, allies: List[Hero], enemies: List[Hero], bans: List[Hero],
+                            deadline: Optional[float] = None) -> List[Suggestion]:
+        payload = self.__get_ban_payload(map_name, allies, enemies, bans)
+        return self.__get_suggestions_for_payload(payload, deadline)
+
+    def __get_draft_payload(self, map_name: str, allies: List[Hero], enemies: List[Hero], bans: List[Hero]) -> \
+            Dict[str, Any]:
 
         map_id = self.__data_provider.get_map_id(map_name) or 0
 
-        payload = {
+        return {
             "map": map_id,
             "banned[]": [hero.id for hero in bans],
             "allies[]": [hero.id for hero in allies],
@@ -23,14 +253,12 @@ class Suggester(object):
             "league": 0
         }
 
-        return self.__get_suggestions_for_payload(payload)
-
-    def get_ban_suggestions(self, map_name: str, allies: List[Hero], enemies: List[Hero], bans: List[Hero]) -> \
-            List[Suggestion]:
+    def __get_ban_payload(self, map_name: str, allies: List[Hero], enemies: List[Hero], bans: List[Hero]) -> \
+            Dict[str, Any]:
 
         map_id = self.__data_provider.get_map_id(map_name)
 
-        payload = {
+        return {
             "map": map_id,
             "banned[]": [hero.id for hero in bans],
             # Inverse for bans
@@ -40,16 +268,52 @@ class Suggester(object):
             "banlist": 1
         }
 
-        return self.__get_suggestions_for_payload(payload)
+    def __get_suggestions_for_payload(self, payload, deadline: Optional[float] = None) -> List[Suggestion]:
+        key = self.__get_cache_key(payload)
+        results = self.__cache.get(key)
+        if results is None:
+            timeout = None
+            if deadline is not None:
+                timeout = max(deadline - time.monotonic(), 0.001)
+            try:
+                results = self.__client.fetch(key, payload, timeout)
+            except (requests.RequestException, CircuitOpenError, TimeoutError, ValueError, KeyError) as e:
+                logging.warning("Failed to get suggestions: %s", str(e) or type(e).__name__)
+                return self.__get_fallback_suggestions(payload)
+            self.__cache.put(key, results)
 
-    def __get_suggestions_for_payload(self, payload) -> List[Suggestion]:
-        response = requests.post("https://hotsdraft.com/draft/list/", data=payload)
+        return self.__process_results(results)
+
+    def __get_fallback_suggestions(self, payload) -> List[Suggestion]:
+        # An expired answer for the same draft beats no answer, otherwise the overlay only shows detection results.
+        results = self.__cache.get(self.__get_cache_key(payload), allow_expired=True)
+        if results is None:
+            return []
+        logging.info("Serving stale suggestions")
+        return self.__process_results(results)
+
+    def __process_results(self, results) -> List[Suggestion]:
         suggestions = []
-        for result in response.json()['scores']:
+        for result in results:
             suggestions.append(self.__process_result(result))
         suggestions.sort(key=lambda x: x.score, reverse=True)
         return suggestions
 
+    @staticmethod
+    def __get_cache_key(payload) -> str:
+        # Hero order does not change the suggestions, so normalize it away.
+        def sorted_ids(ids):
+            return sorted(ids, key=lambda hero_id: (hero_id is None, hero_id or 0))
+
+        return json.dumps([
+            payload["map"],
+            sorted_ids(payload["allies[]"]),
+            sorted_ids(payload["enemies[]"]),
+            sorted_ids(payload["banned[]"]),
+            payload.get("banlist", 0),
+            payload["league"],
+        ])
+
     def __process_result(self, result) -> Suggestion:
         hero_id = result['id']
         hero = self.__data_provider.get_hero_by_id(hero_id)
@@ -0,0 +1,145 @@
+import logging
+import threading
+from typing import Optional, Tuple, Dict, List, AbstractSet
+
+import cv2
+import numpy as np
+
+from hotsdraft_overlay import utils
+from hotsdraft_overlay.data import DataProvider
+from hotsdraft_overlay.models import ImageCut, DraftHero, Rect, Point, Portrait, MatchCandidate
+
+
+class TemplateMatcher(object):
+    # Alternative to CutMatcher, which relies on slots being at known positions with portraits of a roughly known
+    # size, rather than on scale invariant key points. The cut is scaled so that the portrait would be template_height
+    # pixels tall, for each of a few guesses of how much of the cut's height the portrait takes, and every portrait is
+    # scored against it with normalized cross correlation at once, with FFTs. Portraits with hardly any key points
+    # score as well as any other, and heroes that are not locked in yet are dimmed, which correlation ignores.
+    def __init__(self, data_provider: DataProvider, template_height: int = 40,
+                 portrait_scales: Tuple[float, ...] = (0.7, 0.8, 0.9), min_correlation: float = 0.5,
+                 max_candidates: int = 3):
+        self.__portraits = data_provider.get_portraits()
+        self.__portrait_scales = portrait_scales
+        self.__min_correlation = min_correlation
+        self.__max_candidates = max_candidates
+
+        # Portraits are all the same size, so all of them become templates of the same size too.
+        w, h = self.__portraits[0].size.tuple
+        self.__template_size = (int(round(w * template_height / float(h))), template_height)
+
+        templates = []
+        for portrait in self.__portraits:
+            template = cv2.resize(portrait.image, self.__template_size, interpolation=cv2.INTER_AREA)
+            template = cv2.cvtColor(template, cv2.COLOR_BGR2GRAY).astype(np.float32)
+            # Zero mean, unit length, so that correlating with it only needs normalizing by the window of the cut.
+            template -= template.mean()
+            template /= max(np.linalg.norm(template), 1e-6)
+            templates.append(template)
+        # Flipped, as the FFT computes a convolution.
+        self.__templates = np.ascontiguousarray(np.stack(templates)[:, ::-1, ::-1])
+
+        # Spectra of the templates for every FFT size that came up, as the size of cuts only changes with resolution.
+        self.__spectra = {}  # type: Dict[Tuple[int, int], np.ndarray]
+        self.__lock = threading.Lock()
+
+    def match(self, cut: ImageCut) -> Optional[DraftHero]:
+        candidates = self.match_candidates(cut)
+        return candidates[0].hero if candidates else None
+
+    def match_candidates(self, cut: ImageCut, excluded: AbstractSet[str] = frozenset()) -> List[MatchCandidate]:
+        # Returns the best correlating heroes, best first, skipping the excluded hero names, which are not even
+        # correlated.
+        cut_h, cut_w = cut.image.shape[:2]
+        if min(cut_h, cut_w) == 0:
+            return []
+        labels = np.array([
+            label for label, portrait in enumerate(self.__portraits) if portrait.hero.name not in excluded
+        ], dtype=np.int64)
+        if not len(labels):
+            return []
+        gray = cut.planes.gray
+
+        # Best correlation of every template over all scales, and where it was.
+        best_correlations = np.full(len(labels), -np.inf, dtype=np.float32)
+        best_positions = np.zeros((len(labels), 2), dtype=np.int64)
+        best_scales = np.zeros(len(labels), dtype=np.float64)
+        for portrait_scale in self.__portrait_scales:
+            # Scale at which the portrait in the cut would be as big as the templates.
+            scale = self.__template_size[1] / (portrait_scale * cut_h)
+            size = (int(round(cut_w * scale)), int(round(cut_h * scale)))
+            if size[0] < self.__template_size[0] or size[1] < self.__template_size[1]:
+                continue
+            scaled = cv2.resize(gray, size, interpolation=cv2.INTER_AREA).astype(np.float32)
+
+            correlations = self.__correlate(scaled, labels)
+            positions = correlations.reshape(len(labels), -1)
+            scale_positions = positions.argmax(axis=1)
+            scale_correlations = positions[np.arange(len(labels)), scale_positions]
+
+            better = scale_correlations > best_correlations
+            best_correlations[better] = scale_correlations[better]
+            best_positions[better] = np.column_stack(np.unravel_index(scale_positions[better], correlations.shape[1:]))
+            best_scales[better] = scale
+
+        candidates = []
+        for idx in np.argsort(-best_correlations, kind="stable")[:self.__max_candidates]:
+            correlation = float(best_correlations[idx])
+            portrait = self.__portraits[labels[idx]]
+            if correlation < self.__min_correlation:
+                logging.debug("Cut %s correlates with %s by %.3f, too low", cut.region.name, portrait.hero.name,
+                              correlation)
+                break
+            logging.debug("Cut %s correlates with %s by %.3f", cut.region.name, portrait.hero.name, correlation)
+            y, x = best_positions[idx]
+            hero = self.__get_draft_hero(cut, portrait, int(x), int(y), float(best_scales[idx]))
+            candidates.append(MatchCandidate(hero, correlation))
+        return candidates
+
+    def __get_draft_hero(self, cut: ImageCut, portrait: Portrait, x: int, y: int, scale: float) -> DraftHero:
+        cut_h, cut_w = cut.image.shape[:2]
+        bounding_box = Rect(
+            Point(int(x / scale), int(y / scale)),
+            Point(min(int((x + self.__template_size[0]) / scale), cut_w),
+                  min(int((y + self.__template_size[1]) / scale), cut_h)),
+        )
+
+        bounding_box_with_offset = utils.get_frame_rect(bounding_box, cut.offset, cut.scale)
+        # Whether the hero is locked in is only worked out for the hero that ends up in the slot.
+        return DraftHero(portrait.hero.name, portrait.hero.id, True, bounding_box_with_offset, cut.region)
+
+    def __correlate(self, image: np.ndarray, labels: np.ndarray) -> np.ndarray:
+        # Normalized cross correlation of the templates with the given labels at every position where they fit within
+        # the image, shaped (templates, positions y, positions x).
+        h, w = image.shape
+        template_w, template_h = self.__template_size
+        fft_size = (cv2.getOptimalDFTSize(h), cv2.getOptimalDFTSize(w))
+
+        # Wrapping around only affects positions where the template would not fit, which are dropped.
+        spectra = self.__get_spectra(fft_size)
+        if len(labels) < len(spectra):
+            spectra = spectra[labels]
+        products = np.fft.rfft2(image, s=fft_size) * spectra
+        numerators = np.fft.irfft2(products, s=fft_size)[:, template_h - 1:h, template_w - 1:w]
+
+        # Templates are zero mean, so the mean of the window drops out of the numerator, leaving the denominator to
+        # be the deviation of the window.
+        sums, square_sums = cv2.integral2(image, sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+        window_sums = self.__get_window_sums(sums, template_w, template_h)
+        window_square_sums = self.__get_window_sums(square_sums, template_w, template_h)
+        variances = window_square_sums - window_sums ** 2 / (template_w * template_h)
+        deviations = np.sqrt(np.maximum(variances, 0)).astype(np.float32)
+
+        # Flat windows correlate with nothing.
+        return numerators / np.maximum(deviations, 1e-3)
+
+    def __get_spectra(self, fft_size: Tuple[int, int]) -> np.ndarray:
+        with self.__lock:
+            spectra = self.__spectra.get(fft_size)
+            if spectra is None:
+                spectra = self.__spectra[fft_size] = np.fft.rfft2(self.__templates, s=fft_size).astype(np.complex64)
+            return spectra
+
+    @staticmethod
+    def __get_window_sums(integral: np.ndarray, w: int, h: int) -> np.ndarray:
+        return integral[h:, w:] - integral[:-h, w:] - integral[h:, :-w] + integral[:-h, :-w]
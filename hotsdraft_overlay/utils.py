@@ -1,25 +1,156 @@
 import logging
+import os
 import pathlib
 import sys
-from typing import Optional
+import threading
+from typing import Optional, Tuple, List
 
 import cv2
+import numpy as np
 
+from hotsdraft_overlay.features import FeatureBackend, get_feature_backend
 from hotsdraft_overlay.models import Point, Features, Rect
 
-FEATURE_EXTRACTOR = cv2.xfeatures2d.SIFT_create()
-MATCHER = cv2.BFMatcher()
+# OpenCV feature extractors are not safe to share between threads, so each thread gets its own, per feature backend.
+_thread_local = threading.local()
+
+
+def extract_features(image, backend: FeatureBackend, mask=None) -> Features:
+    # Takes a color or an already gray image.
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    key_points, descriptors = get_feature_extractor(backend).detectAndCompute(image, mask)
+    responses = np.array([key_point.response for key_point in key_points], dtype=np.float32)
+    return Features(get_key_point_coordinates(key_points), descriptors, responses)
+
+
+def get_key_point_coordinates(key_points) -> np.ndarray:
+    if not key_points:
+        return np.empty((0, 2), dtype=np.float32)
+    return cv2.KeyPoint_convert(key_points).reshape(-1, 2)
+
+
+def select_features(features: Features, max_key_points: int, size: Point, grid: Tuple[int, int],
+                    interior: Optional[Rect] = None) -> Features:
+    # Keeps the key points within interior, and of those at most max_key_points, spread over the cells of a grid
+    # covering an image of the given size: the strongest key point of every cell, then the second strongest of every
+    # cell, and so on. Selecting after extraction keeps the same key points a mask would, and it leaves the descriptors
+    # as they were.
+    points = features.points
+    selected = np.arange(len(points))
+    if interior is not None:
+        x, y = points[:, 0], points[:, 1]
+        selected = np.flatnonzero(
+            (x >= interior.top_left.x) & (x < interior.bottom_right.x) &
+            (y >= interior.top_left.y) & (y < interior.bottom_right.y)
+        )
+
+    if 0 < max_key_points < len(selected):
+        columns, rows = grid
+        cell_columns = np.clip((points[selected, 0] * columns / size.x).astype(np.int64), 0, columns - 1)
+        cell_rows = np.clip((points[selected, 1] * rows / size.y).astype(np.int64), 0, rows - 1)
+        cells = cell_rows * columns + cell_columns
+        responses = features.responses[selected]
+
+        # Strongest first within each cell, then the rank of every key point within its cell.
+        order = np.lexsort((-responses, cells))
+        ordered_cells = cells[order]
+        ranks = np.arange(len(order)) - np.searchsorted(ordered_cells, ordered_cells, side="left")
+        turns = order[np.lexsort((-responses[order], ranks))]
+        selected = np.sort(selected[turns[:max_key_points]])
+
+    if len(selected) == len(points):
+        return features
+    descriptors = features.descriptors[selected] if features.descriptors is not None and len(selected) else None
+    return Features(points[selected], descriptors, features.responses[selected])
+
+
+def get_rect_mask(image, rect: Rect) -> np.ndarray:
+    mask = np.zeros(image.shape[:2], dtype=np.uint8)
+    mask[rect.top_left.y:rect.bottom_right.y, rect.top_left.x:rect.bottom_right.x] = 255
+    return mask
+
+
+def get_feature_extractor(backend: FeatureBackend):
+    extractors = getattr(_thread_local, "feature_extractors", None)
+    if extractors is None:
+        extractors = _thread_local.feature_extractors = {}
+    extractor = extractors.get(backend.name)
+    if extractor is None:
+        extractor = extractors[backend.name] = backend.create_extractor()
+    return extractor
+
+
+def extract_features_from_file(path: str, backend_name: str, height: Optional[int] = None) -> Features:
+    # Runs in worker processes, so only deal with picklable types, which key point coordinates are unlike key points.
+    # With a height, features are extracted from the image shrunk to that height, but positioned in the coordinates of
+    # the image as it is.
+    image = cv2.imread(path)
+    scale = get_scale(image.shape[0], height) if height else 1.0
+    if scale == 1.0:
+        return extract_features(image, get_feature_backend(backend_name))
+    features = extract_features(scale_image(image, scale), get_feature_backend(backend_name))
+    return Features(features.points / np.float32(scale), features.descriptors, features.responses)
+
+
+def get_scale(size: float, target_size: float) -> float:
+    # Scale at which something of the given size becomes target_size, images are only ever shrunk.
+    return min(target_size / float(size), 1.0) if size > 0 else 1.0
+
+
+def scale_image(image, scale: float):
+    if scale == 1.0:
+        return image
+    h, w = image.shape[:2]
+    return cv2.resize(image, (max(int(round(w * scale)), 1), max(int(round(h * scale)), 1)),
+                      interpolation=cv2.INTER_AREA)
+
+
+def get_frame_rect(rect: Rect, offset: Point, scale: float) -> Rect:
+    # Rectangle within a cut at the given offset and scale, in frame coordinates.
+    return Rect(
+        Point(offset.x + int(round(rect.top_left.x / scale)), offset.y + int(round(rect.top_left.y / scale))),
+        Point(offset.x + int(round(rect.bottom_right.x / scale)), offset.y + int(round(rect.bottom_right.y / scale))),
+    )
+
+
+def get_cut_rect(rect: Rect, offset: Point, scale: float) -> Rect:
+    # Rectangle in frame coordinates, within a cut at the given offset and scale.
+    return Rect(
+        Point(int(round((rect.top_left.x - offset.x) * scale)), int(round((rect.top_left.y - offset.y) * scale))),
+        Point(int(round((rect.bottom_right.x - offset.x) * scale)),
+              int(round((rect.bottom_right.y - offset.y) * scale))),
+    )
 
 
-def extract_features(image) -> Features:
-    key_points, descriptors = FEATURE_EXTRACTOR.detectAndCompute(
-        cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), None
+def match_features(query: Features, train: Features, backend: FeatureBackend) -> Tuple[np.ndarray, np.ndarray]:
+    # Distances to and indices of the two nearest train descriptors of every query descriptor, see find_neighbours.
+    if query.descriptors is None or train.descriptors is None:
+        return np.empty((0, 2), dtype=np.float32), np.empty((0, 2), dtype=np.int32)
+    return find_neighbours(
+        backend.get_matchable_descriptors(query.descriptors), backend.get_matchable_descriptors(train.descriptors),
+        backend, 2
     )
-    return Features(key_points, descriptors)
 
 
-def match_features(query: Features, train: Features):
-    return MATCHER.knnMatch(query.descriptors, train.descriptors, k=2)
+def apply_ratio_test(distances: np.ndarray, train_indices: np.ndarray, ratio: float) -> Tuple[np.ndarray, np.ndarray]:
+    # Returns the query and train indices of the matches whose nearest neighbour is clearly nearer than the second
+    # nearest. Train sets with a single descriptor only produce one neighbour, so none of their matches pass.
+    if distances.shape[1] < 2:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int32)
+    # In double precision, like comparing the distances of DMatch objects does.
+    distances = distances.astype(np.float64)
+    query_indices = np.flatnonzero(distances[:, 0] < ratio * distances[:, 1])
+    return query_indices, train_indices[query_indices, 0]
+
+
+def find_neighbours(query, train, backend: FeatureBackend, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    # Distances to and indices of the k nearest train descriptors of every query descriptor, nearest first, as arrays
+    # shaped (queries, k), with fewer columns when there are fewer than k train descriptors. Same as what knnMatch
+    # computes, as it is what knnMatch uses, but without a DMatch object per neighbour.
+    # Hamming distances are counts of bits, which batchDistance wants as integers.
+    distance_type = cv2.CV_32S if backend.binary else cv2.CV_32F
+    return cv2.batchDistance(query, train, distance_type, normType=backend.norm_type, K=k)
 
 
 def crop_to_rect(image, rect: Rect):
@@ -61,20 +192,31 @@ def resize(image, width: Optional[int] = None, height: Optional[int] = None, int
     return resized
 
 
-def add_offset_to_point(point: Point, offset: Point) -> Point:
-    return Point(point.x + offset.x, point.y + offset.y)
+def get_fingerprint(image, size: Tuple[int, int] = (16, 16), interpolation=cv2.INTER_AREA):
+    if min(image.shape[:2]) == 0:
+        return None
+    thumbnail = cv2.resize(image, size, interpolation=interpolation)
+    # Gray images are taken as they are.
+    if thumbnail.ndim == 3:
+        thumbnail = cv2.cvtColor(thumbnail, cv2.COLOR_BGR2GRAY)
+    return thumbnail
+
+
+def fingerprints_match(first, second, tolerance: float) -> bool:
+    if first is None or second is None:
+        return first is None and second is None
+    # Mean absolute difference in gray levels
+    return cv2.norm(first, second, cv2.NORM_L1) / first.size <= tolerance
 
 
-def get_channel_variance(image, color_scheme=None):
-    if color_scheme:
-        image = cv2.cvtColor(image, color_scheme)
-    image_channels = cv2.split(image)
-    channel_variance = []
-    for channel in image_channels:
-        mean = channel.mean()
-        difference = channel - mean
-        channel_variance.append((difference ** 2).mean())
-    return channel_variance
+def get_percentile(values: List[float], percentile: float) -> float:
+    ordered = sorted(values)
+    index = min(int(round(percentile / 100.0 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def add_offset_to_point(point: Point, offset: Point) -> Point:
+    return Point(point.x + offset.x, point.y + offset.y)
 
 
 def monkey_patch_exception_hook():
@@ -89,6 +231,13 @@ def monkey_patch_exception_hook():
     sys.excepthook = monkey_patched_exception_hook
 
 
+def get_cache_root() -> pathlib.Path:
+    base = os.environ.get("LOCALAPPDATA") or os.environ.get("XDG_CACHE_HOME")
+    if base:
+        return pathlib.Path(base) / "hotsdraft-overlay"
+    return pathlib.Path.home() / ".cache" / "hotsdraft-overlay"
+
+
 def get_root():
     try:
         # PyInstaller creates a temp folder and stores path in _MEIPASS
@@ -0,0 +1,74 @@
+import logging
+
+import cv2
+
+from hotsdraft_overlay import utils
+from hotsdraft_overlay.models import CapturedFrame
+
+
+class FrameChangeDetector(object):
+    # Compares heavily downsampled copies of the captured regions with those of the last frame that was processed,
+    # which is orders of magnitude cheaper than running detection to find out nothing happened.
+    def __init__(self, tolerance: float = 2.0, size=(48, 48)):
+        self.__tolerance = tolerance
+        self.__size = size
+        self.__last_fingerprints = None
+
+    def has_changed(self, frame: CapturedFrame) -> bool:
+        fingerprints = self.__get_fingerprints(frame)
+        if self.__last_fingerprints is not None and len(self.__last_fingerprints) == len(fingerprints) and all(
+                utils.fingerprints_match(last_fingerprint, fingerprint, self.__tolerance)
+                for last_fingerprint, fingerprint in zip(self.__last_fingerprints, fingerprints)
+        ):
+            return False
+        self.__last_fingerprints = fingerprints
+        return True
+
+    def update(self, frame: CapturedFrame):
+        self.__last_fingerprints = self.__get_fingerprints(frame)
+
+    def reset(self):
+        self.__last_fingerprints = None
+
+    def __get_fingerprints(self, frame: CapturedFrame):
+        # Sampling rather than area interpolation, as this runs on every capture.
+        return [
+            utils.get_fingerprint(region.image, self.__size, cv2.INTER_LINEAR)
+            for region in frame.regions
+        ]
+
+
+class CaptureScheduler(object):
+    # Decides how long to wait before capturing the next frame. Captures speed up to the minimum interval whenever the
+    # frame changes and back off towards the maximum interval while it's idle. The interval is never allowed to drop
+    # to a point where the time spent capturing and processing exceeds cpu_budget share of the wall time.
+    def __init__(self, min_interval: float = 0.25, max_interval: float = 2.0, backoff: float = 1.5,
+                 cpu_budget: float = 0.25):
+        if not 0 < cpu_budget <= 1:
+            raise ValueError("CPU budget should be in (0, 1]")
+        if not 0 < min_interval <= max_interval:
+            raise ValueError("Minimum interval should be positive and no more than the maximum interval")
+        self.__min_interval = min_interval
+        self.__max_interval = max_interval
+        self.__backoff = backoff
+        self.__cpu_budget = cpu_budget
+        self.__interval = min_interval
+
+    def get_interval(self) -> float:
+        return self.__interval
+
+    def record(self, changed: bool, busy_time: float):
+        if changed:
+            interval = self.__min_interval
+        else:
+            interval = min(self.__interval * self.__backoff, self.__max_interval)
+
+        budget_interval = busy_time / self.__cpu_budget - busy_time
+        if budget_interval > interval:
+            logging.debug("Capture interval limited to %.2fs by CPU budget", budget_interval)
+            interval = budget_interval
+
+        self.__interval = interval
+
+    def reset(self):
+        self.__interval = self.__min_interval
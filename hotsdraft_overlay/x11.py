@@ -0,0 +1,421 @@
+import ctypes
+import ctypes.util
+import logging
+import threading
+from typing import Optional, Dict, Tuple
+
+import numpy as np
+
+from hotsdraft_overlay.models import Rect, Point
+
+# Screen capture on X11 through the MIT-SHM extension, using Xlib via ctypes so that no extra dependencies are needed.
+# The X server writes the pixels straight into a shared memory segment that is mapped into our address space, and that
+# segment is exposed as a numpy array, so a capture neither copies nor allocates anything.
+
+_ZPixmap = 2
+_AllPlanes = 0xFFFFFFFF
+_IsViewable = 2
+_IPC_PRIVATE = 0
+_IPC_CREAT = 0o1000
+_IPC_RMID = 0
+
+
+class _XImage(ctypes.Structure):
+    pass
+
+
+_DestroyImageFunc = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.POINTER(_XImage))
+
+_XImage._fields_ = [
+    ("width", ctypes.c_int),
+    ("height", ctypes.c_int),
+    ("xoffset", ctypes.c_int),
+    ("format", ctypes.c_int),
+    ("data", ctypes.c_void_p),
+    ("byte_order", ctypes.c_int),
+    ("bitmap_unit", ctypes.c_int),
+    ("bitmap_bit_order", ctypes.c_int),
+    ("bitmap_pad", ctypes.c_int),
+    ("depth", ctypes.c_int),
+    ("bytes_per_line", ctypes.c_int),
+    ("bits_per_pixel", ctypes.c_int),
+    ("red_mask", ctypes.c_ulong),
+    ("green_mask", ctypes.c_ulong),
+    ("blue_mask", ctypes.c_ulong),
+    ("obdata", ctypes.c_void_p),
+    ("create_image", ctypes.c_void_p),
+    ("destroy_image", _DestroyImageFunc),
+    ("get_pixel", ctypes.c_void_p),
+    ("put_pixel", ctypes.c_void_p),
+    ("sub_image", ctypes.c_void_p),
+    ("add_pixel", ctypes.c_void_p),
+]
+
+
+class _XShmSegmentInfo(ctypes.Structure):
+    _fields_ = [
+        ("shmseg", ctypes.c_ulong),
+        ("shmid", ctypes.c_int),
+        ("shmaddr", ctypes.c_void_p),
+        ("readOnly", ctypes.c_int),
+    ]
+
+
+class _XWindowAttributes(ctypes.Structure):
+    _fields_ = [
+        ("x", ctypes.c_int),
+        ("y", ctypes.c_int),
+        ("width", ctypes.c_int),
+        ("height", ctypes.c_int),
+        ("border_width", ctypes.c_int),
+        ("depth", ctypes.c_int),
+        ("visual", ctypes.c_void_p),
+        ("root", ctypes.c_ulong),
+        ("class", ctypes.c_int),
+        ("bit_gravity", ctypes.c_int),
+        ("win_gravity", ctypes.c_int),
+        ("backing_store", ctypes.c_int),
+        ("backing_planes", ctypes.c_ulong),
+        ("backing_pixel", ctypes.c_ulong),
+        ("save_under", ctypes.c_int),
+        ("colormap", ctypes.c_ulong),
+        ("map_installed", ctypes.c_int),
+        ("map_state", ctypes.c_int),
+        ("all_event_masks", ctypes.c_long),
+        ("your_event_mask", ctypes.c_long),
+        ("do_not_propagate_mask", ctypes.c_long),
+        ("override_redirect", ctypes.c_int),
+        ("screen", ctypes.c_void_p),
+    ]
+
+
+class _XErrorEvent(ctypes.Structure):
+    _fields_ = [
+        ("type", ctypes.c_int),
+        ("display", ctypes.c_void_p),
+        ("resourceid", ctypes.c_ulong),
+        ("serial", ctypes.c_ulong),
+        ("error_code", ctypes.c_ubyte),
+        ("request_code", ctypes.c_ubyte),
+        ("minor_code", ctypes.c_ubyte),
+    ]
+
+
+_ErrorHandlerFunc = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.POINTER(_XErrorEvent))
+
+
+class X11Error(Exception):
+    pass
+
+
+def _load_library(name: str, soname: str):
+    path = ctypes.util.find_library(name) or soname
+    try:
+        return ctypes.CDLL(path)
+    except OSError as e:
+        raise X11Error("Could not load %s: %s" % (path, e))
+
+
+def _declare(function, restype, *argtypes):
+    function.restype = restype
+    function.argtypes = argtypes
+
+
+_xlib = None
+_xext = None
+_libc = None
+_library_lock = threading.Lock()
+
+# Xlib terminates the process on errors by default, instead, errors are recorded and checked after each request. The
+# handler is process wide, while captures on different threads each have their own display, so errors are recorded per
+# display, and one capture never sees or clears errors of another.
+_last_errors = {}  # type: Dict[int, int]
+_errors_lock = threading.Lock()
+_error_handler = None
+
+
+def _on_error(display, event) -> int:
+    with _errors_lock:
+        _last_errors[display] = event.contents.error_code
+    return 0
+
+
+def _clear_error(display):
+    with _errors_lock:
+        _last_errors.pop(display, None)
+
+
+def _get_error(display) -> Optional[int]:
+    with _errors_lock:
+        return _last_errors.get(display)
+
+
+def _load_libraries():
+    global _xlib, _xext, _libc, _error_handler
+    with _library_lock:
+        if _xlib is not None:
+            return
+
+        xlib = _load_library("X11", "libX11.so.6")
+        xext = _load_library("Xext", "libXext.so.6")
+        libc = ctypes.CDLL(None, use_errno=True)
+
+        display, window = ctypes.c_void_p, ctypes.c_ulong
+        uint_p, int_p, window_p = ctypes.POINTER(ctypes.c_uint), ctypes.POINTER(ctypes.c_int), ctypes.POINTER(window)
+        ximage_p, shminfo_p = ctypes.POINTER(_XImage), ctypes.POINTER(_XShmSegmentInfo)
+
+        _declare(xlib.XOpenDisplay, display, ctypes.c_char_p)
+        _declare(xlib.XCloseDisplay, ctypes.c_int, display)
+        _declare(xlib.XDefaultScreen, ctypes.c_int, display)
+        _declare(xlib.XRootWindow, window, display, ctypes.c_int)
+        _declare(xlib.XSync, ctypes.c_int, display, ctypes.c_int)
+        _declare(xlib.XFree, ctypes.c_int, ctypes.c_void_p)
+        _declare(xlib.XSetErrorHandler, ctypes.c_void_p, _ErrorHandlerFunc)
+        _declare(xlib.XGetWindowAttributes, ctypes.c_int, display, window, ctypes.POINTER(_XWindowAttributes))
+        _declare(xlib.XQueryTree, ctypes.c_int, display, window, window_p, window_p,
+                 ctypes.POINTER(window_p), uint_p)
+        _declare(xlib.XFetchName, ctypes.c_int, display, window, ctypes.POINTER(ctypes.c_char_p))
+        _declare(xlib.XTranslateCoordinates, ctypes.c_int, display, window, window, ctypes.c_int, ctypes.c_int,
+                 int_p, int_p, window_p)
+        _declare(xlib.XGetInputFocus, ctypes.c_int, display, window_p, int_p)
+        _declare(xlib.XGetImage, ximage_p, display, window, ctypes.c_int, ctypes.c_int, ctypes.c_uint,
+                 ctypes.c_uint, ctypes.c_ulong, ctypes.c_int)
+
+        _declare(xext.XShmQueryExtension, ctypes.c_int, display)
+        _declare(xext.XShmCreateImage, ximage_p, display, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int,
+                 ctypes.c_void_p, shminfo_p, ctypes.c_uint, ctypes.c_uint)
+        _declare(xext.XShmAttach, ctypes.c_int, display, shminfo_p)
+        _declare(xext.XShmDetach, ctypes.c_int, display, shminfo_p)
+        _declare(xext.XShmGetImage, ctypes.c_int, display, window, ximage_p, ctypes.c_int, ctypes.c_int,
+                 ctypes.c_ulong)
+
+        _declare(libc.shmget, ctypes.c_int, ctypes.c_int, ctypes.c_size_t, ctypes.c_int)
+        _declare(libc.shmat, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p, ctypes.c_int)
+        _declare(libc.shmdt, ctypes.c_int, ctypes.c_void_p)
+        _declare(libc.shmctl, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_void_p)
+
+        # Keep a reference, otherwise the callback gets garbage collected while Xlib still points to it.
+        _error_handler = _ErrorHandlerFunc(_on_error)
+        xlib.XSetErrorHandler(_error_handler)
+
+        _xlib, _xext, _libc = xlib, xext, libc
+
+
+def _to_bgra_array(ximage: _XImage) -> np.ndarray:
+    # Rows might be padded, so view them whole and slice off the padding.
+    buffer = (ctypes.c_ubyte * (ximage.bytes_per_line * ximage.height)).from_address(ximage.data)
+    rows = np.ctypeslib.as_array(buffer).reshape(ximage.height, ximage.bytes_per_line)
+    return rows[:, :ximage.width * 4].reshape(ximage.height, ximage.width, 4)
+
+
+class _SharedImage(object):
+    # An XImage backed by a shared memory segment, into which the X server copies pixels.
+    def __init__(self, display, attributes: _XWindowAttributes, width: int, height: int):
+        self.__display = display
+        self.__shminfo = _XShmSegmentInfo()
+        self.__ximage = _xext.XShmCreateImage(
+            display, attributes.visual, attributes.depth, _ZPixmap, None, ctypes.byref(self.__shminfo), width, height
+        )
+        if not self.__ximage:
+            raise X11Error("Failed to create shared memory image")
+
+        ximage = self.__ximage.contents
+        if ximage.bits_per_pixel != 32:
+            _xlib.XFree(self.__ximage)
+            raise X11Error("Unsupported pixel format, %d bits per pixel" % ximage.bits_per_pixel)
+
+        self.__shminfo.shmid = _libc.shmget(_IPC_PRIVATE, ximage.bytes_per_line * height, _IPC_CREAT | 0o600)
+        if self.__shminfo.shmid < 0:
+            _xlib.XFree(self.__ximage)
+            raise X11Error("Failed to allocate shared memory: errno %d" % ctypes.get_errno())
+
+        address = _libc.shmat(self.__shminfo.shmid, None, 0)
+        if address in (None, ctypes.c_void_p(-1).value):
+            _libc.shmctl(self.__shminfo.shmid, _IPC_RMID, None)
+            _xlib.XFree(self.__ximage)
+            raise X11Error("Failed to attach shared memory: errno %d" % ctypes.get_errno())
+
+        self.__shminfo.shmaddr = address
+        self.__shminfo.readOnly = 0
+        ximage.data = address
+
+        _clear_error(display)
+        attached = _xext.XShmAttach(display, ctypes.byref(self.__shminfo))
+        _xlib.XSync(display, 0)
+        # The segment goes away once both sides have detached, so that nothing leaks even if we crash.
+        _libc.shmctl(self.__shminfo.shmid, _IPC_RMID, None)
+        error = _get_error(display)
+        if not attached or error is not None:
+            _libc.shmdt(address)
+            ximage.data = None
+            _xlib.XFree(self.__ximage)
+            raise X11Error("The X server failed to attach shared memory, error %s" % error)
+
+        self.array = _to_bgra_array(ximage)
+
+    def get(self, drawable: int, x: int, y: int) -> bool:
+        _clear_error(self.__display)
+        ok = _xext.XShmGetImage(self.__display, drawable, self.__ximage, x, y, _AllPlanes)
+        # XShmGetImage is a round trip, so any error has been reported by the time it returns.
+        return bool(ok) and _get_error(self.__display) is None
+
+    def close(self):
+        if self.__ximage is None:
+            return
+        _xext.XShmDetach(self.__display, ctypes.byref(self.__shminfo))
+        _xlib.XSync(self.__display, 0)
+        _libc.shmdt(self.__shminfo.shmaddr)
+        # Do not let Xlib free the data, it's not malloc'ed.
+        self.__ximage.contents.data = None
+        _xlib.XFree(self.__ximage)
+        self.__ximage = None
+        self.array = None
+
+
+class X11ShmCapture(object):
+    # Captures a window, or parts of it, into shared memory buffers that are reused between captures. Arrays returned
+    # are BGRA views into those buffers, so they are only valid until the next capture of the same size, copy them if
+    # they need to outlive it. Not thread safe, use one instance per thread.
+    def __init__(self, display_name: Optional[str] = None):
+        _load_libraries()
+        self.__display = _xlib.XOpenDisplay(display_name.encode() if display_name else None)
+        if not self.__display:
+            raise X11Error("Could not open display %s" % (display_name or "from $DISPLAY"))
+        if not _xext.XShmQueryExtension(self.__display):
+            _xlib.XCloseDisplay(self.__display)
+            self.__display = None
+            raise X11Error("The X server does not support the MIT-SHM extension")
+        self.__root = _xlib.XRootWindow(self.__display, _xlib.XDefaultScreen(self.__display))
+        self.__images = {}  # type: Dict[Tuple[int, int], _SharedImage]
+
+    @property
+    def root_window(self) -> int:
+        return self.__root
+
+    def find_window(self, name: str) -> Optional[int]:
+        # Depth first search through the window tree for a window with the given title.
+        pending = [self.__root]
+        while pending:
+            window = pending.pop()
+            if self.get_window_name(window) == name:
+                return window
+            pending.extend(self.__get_children(window))
+        return None
+
+    def get_window_name(self, window: int) -> Optional[str]:
+        name = ctypes.c_char_p()
+        if not _xlib.XFetchName(self.__display, window, ctypes.byref(name)) or not name.value:
+            return None
+        try:
+            return name.value.decode("utf-8", "replace")
+        finally:
+            _xlib.XFree(name)
+
+    def get_window_rect(self, window: int) -> Optional[Rect]:
+        # The rectangle of the window, in screen coordinates, or None if it's gone or not visible.
+        attributes = self.__get_attributes(window)
+        if attributes is None or attributes.map_state != _IsViewable:
+            return None
+        x, y, child = ctypes.c_int(), ctypes.c_int(), ctypes.c_ulong()
+        if not _xlib.XTranslateCoordinates(self.__display, window, self.__root, 0, 0, ctypes.byref(x),
+                                           ctypes.byref(y), ctypes.byref(child)):
+            return None
+        return Rect(Point(x.value, y.value), Point(x.value + attributes.width, y.value + attributes.height))
+
+    def is_focused(self, window: int) -> bool:
+        # Window managers usually focus the client window, but the application might focus one of its children.
+        focus, revert_to = ctypes.c_ulong(), ctypes.c_int()
+        _xlib.XGetInputFocus(self.__display, ctypes.byref(focus), ctypes.byref(revert_to))
+        current = focus.value
+        while current and current != self.__root:
+            if current == window:
+                return True
+            current = self.__get_parent(current)
+        return False
+
+    def grab(self, window: int, rect: Optional[Rect] = None) -> Optional[np.ndarray]:
+        # Captures the given rectangle of the window, in window coordinates, or all of it.
+        attributes = self.__get_attributes(window)
+        if attributes is None:
+            return None
+        if rect is None:
+            rect = Rect(Point(0, 0), Point(attributes.width, attributes.height))
+        if rect.width <= 0 or rect.height <= 0:
+            return None
+
+        image = self.__get_shared_image(attributes, rect.width, rect.height)
+        if not image.get(window, rect.top_left.x, rect.top_left.y):
+            # Usually because the window is partially off screen, or was resized or unmapped meanwhile.
+            logging.debug("Failed to capture %s of window %x", rect, window)
+            return None
+        return image.array
+
+    def grab_naive(self, window: int) -> Optional[np.ndarray]:
+        # Baseline for benchmarking, a plain XGetImage of the whole window, which has the pixels sent over the socket
+        # into a newly allocated image every frame, copied into a numpy array so that the image can be freed.
+        attributes = self.__get_attributes(window)
+        if attributes is None:
+            return None
+        ximage = _xlib.XGetImage(self.__display, window, 0, 0, attributes.width, attributes.height, _AllPlanes,
+                                 _ZPixmap)
+        if not ximage:
+            return None
+        try:
+            if ximage.contents.bits_per_pixel != 32:
+                raise X11Error("Unsupported pixel format, %d bits per pixel" % ximage.contents.bits_per_pixel)
+            return _to_bgra_array(ximage.contents).copy()
+        finally:
+            ximage.contents.destroy_image(ximage)
+
+    def close(self):
+        for image in self.__images.values():
+            image.close()
+        self.__images = {}
+        if self.__display:
+            _xlib.XCloseDisplay(self.__display)
+            # Another display might be opened at the same address.
+            _clear_error(self.__display)
+            self.__display = None
+
+    def __get_shared_image(self, attributes: _XWindowAttributes, width: int, height: int) -> _SharedImage:
+        key = (width, height, attributes.depth, attributes.visual)
+        image = self.__images.get(key)
+        if image is None:
+            logging.debug("Allocating %dx%d shared memory image", width, height)
+            image = _SharedImage(self.__display, attributes, width, height)
+            self.__images[key] = image
+        return image
+
+    def __get_attributes(self, window: int) -> Optional[_XWindowAttributes]:
+        _clear_error(self.__display)
+        attributes = _XWindowAttributes()
+        if not _xlib.XGetWindowAttributes(self.__display, window, ctypes.byref(attributes)):
+            return None
+        if _get_error(self.__display) is not None:
+            return None
+        return attributes
+
+    def __query_tree(self, window: int) -> Tuple[int, list]:
+        root, parent = ctypes.c_ulong(), ctypes.c_ulong()
+        children, count = ctypes.POINTER(ctypes.c_ulong)(), ctypes.c_uint()
+        if not _xlib.XQueryTree(self.__display, window, ctypes.byref(root), ctypes.byref(parent),
+                                ctypes.byref(children), ctypes.byref(count)):
+            return 0, []
+        try:
+            return parent.value, [children[idx] for idx in range(count.value)]
+        finally:
+            if children:
+                _xlib.XFree(children)
+
+    def __get_children(self, window: int) -> list:
+        return self.__query_tree(window)[1]
+
+    def __get_parent(self, window: int) -> int:
+        return self.__query_tree(window)[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
@@ -0,0 +1,75 @@
+import cv2
+import numpy as np
+import pytest
+
+from hotsdraft_overlay.capture import FileCapture, capture_regions_from_image, clip_rect, load_image
+from hotsdraft_overlay.models import Rect, Point
+
+
+def make_image(h: int = 90, w: int = 160) -> np.ndarray:
+    return np.random.RandomState(0).randint(0, 256, (h, w, 3)).astype(np.uint8)
+
+
+def test_regions_are_views_of_the_frame():
+    image = make_image()
+    rects = [Rect(Point(0, 0), Point(40, 30)), Rect(Point(100, 50), Point(160, 90))]
+    frame = capture_regions_from_image(image, lambda size: rects)
+
+    assert frame.size == Point(160, 90)
+    for rect, region in zip(rects, frame.regions):
+        assert region.rect == rect
+        assert np.shares_memory(region.image, image)
+        assert np.array_equal(region.image, image[rect.top_left.y:rect.bottom_right.y,
+                                                  rect.top_left.x:rect.bottom_right.x])
+    assert np.array_equal(frame.crop(Rect(Point(110, 60), Point(120, 70))), image[60:70, 110:120])
+
+
+def test_regions_outside_the_frame_are_clipped():
+    image = make_image()
+    frame = capture_regions_from_image(image, lambda size: [
+        Rect(Point(-10, -5), Point(20, 10)),
+        Rect(Point(150, 80), Point(200, 120)),
+        Rect(Point(300, 300), Point(400, 400)),
+    ])
+
+    assert [region.rect for region in frame.regions] == [
+        Rect(Point(0, 0), Point(20, 10)),
+        Rect(Point(150, 80), Point(160, 90)),
+        Rect(Point(160, 90), Point(160, 90)),
+    ]
+    assert [region.image.shape[:2] for region in frame.regions] == [(10, 20), (10, 10), (0, 0)]
+
+
+def test_clip_rect_keeps_rects_inside():
+    rect = Rect(Point(10, 20), Point(30, 40))
+    assert clip_rect(rect, Point(100, 100)) == rect
+
+
+@pytest.mark.parametrize("suffix", [".npy", ".NPY", ".Npy"])
+def test_raw_frames_are_memory_mapped(tmp_path, suffix):
+    image = make_image()
+    path = tmp_path / ("frame" + suffix)
+    with path.open("wb") as fd:
+        np.save(fd, image)
+
+    loaded = load_image(path.as_posix())
+    assert isinstance(loaded, np.memmap)
+    assert np.array_equal(loaded, image)
+
+    frame = capture_regions_from_image(loaded, lambda size: [Rect(Point(0, 0), Point(10, 10))])
+    assert np.shares_memory(frame.regions[0].image, loaded)
+
+
+def test_file_capture_provides_frames_in_order_and_skips_unreadable(tmp_path):
+    first = make_image()
+    second = make_image()[::-1].copy()
+    cv2.imwrite((tmp_path / "1.png").as_posix(), first)
+    (tmp_path / "2.png").write_bytes(b"not an image")
+    with (tmp_path / "3.npy").open("wb") as fd:
+        np.save(fd, second)
+
+    capture = FileCapture.from_directory(tmp_path.as_posix())
+    assert np.array_equal(capture.capture(), first)
+    frame = capture.capture_regions(lambda size: [Rect(Point(0, 0), Point(size.x, size.y))])
+    assert np.array_equal(frame.regions[0].image, second)
+    assert capture.capture() is None
@@ -0,0 +1,36 @@
+import types
+
+import cv2
+import numpy as np
+import pytest
+
+from hotsdraft_overlay import features
+
+
+def test_sift_prefers_main_module(monkeypatch):
+    if not hasattr(cv2, "SIFT_create"):
+        pytest.skip("OpenCV without SIFT in the main module")
+    created = []
+    monkeypatch.setattr(cv2, "SIFT_create", lambda **params: created.append(params) or "main")
+
+    assert features.get_feature_backend("sift").create_extractor() == "main"
+    assert created == [features.get_feature_backend("sift").params]
+
+
+def test_sift_falls_back_to_xfeatures2d(monkeypatch):
+    created = []
+    monkeypatch.delattr(cv2, "SIFT_create", raising=False)
+    monkeypatch.setattr(cv2, "xfeatures2d", types.SimpleNamespace(
+        SIFT_create=lambda **params: created.append(params) or "contrib"
+    ), raising=False)
+
+    assert features.get_feature_backend("sift").create_extractor() == "contrib"
+    assert created == [features.get_feature_backend("sift").params]
+
+
+def test_sift_extracts_features():
+    image = np.random.RandomState(0).randint(0, 255, (128, 128), dtype=np.uint8)
+    image = cv2.GaussianBlur(image, (5, 5), 0)
+    key_points, descriptors = features.get_feature_backend("sift").create_extractor().detectAndCompute(image, None)
+    assert key_points
+    assert descriptors.shape == (len(key_points), 128)
@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from hotsdraft_overlay.maps import MapRecognizer
+
+MAP_NAMES = ["Battlefield of Eternity", "Cursed Hollow", "Dragon Shire"]
+
+
+def make_banner(seed: int) -> np.ndarray:
+    return np.random.RandomState(seed).randint(0, 255, (40, 640), dtype=np.uint8)
+
+
+def test_learned_banners_persist(tmp_path):
+    recognizer = MapRecognizer(MAP_NAMES, tmp_path)
+    recognizer.learn(make_banner(1), "Cursed Hollow")
+    assert recognizer.recognize(make_banner(1))[0] == "Cursed Hollow"
+
+    assert MapRecognizer(MAP_NAMES, tmp_path).recognize(make_banner(1))[0] == "Cursed Hollow"
+
+
+def test_read_only_recognizes_but_never_learns(tmp_path):
+    MapRecognizer(MAP_NAMES, tmp_path).learn(make_banner(1), "Cursed Hollow")
+    stored = {path.name: path.read_bytes() for path in tmp_path.rglob("*.npy")}
+
+    recognizer = MapRecognizer(MAP_NAMES, tmp_path, read_only=True)
+    assert recognizer.read_only
+    assert recognizer.recognize(make_banner(1))[0] == "Cursed Hollow"
+
+    recognizer.learn(make_banner(2), "Dragon Shire")
+    recognizer.learn(make_banner(3), "Cursed Hollow")
+    assert recognizer.recognize(make_banner(2))[0] is None
+    with pytest.raises(ValueError):
+        recognizer.reset()
+
+    assert {path.name: path.read_bytes() for path in tmp_path.rglob("*.npy")} == stored
+    assert not list(tmp_path.rglob("*.tmp"))
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from hotsdraft_overlay import utils
+from hotsdraft_overlay.benchmark import make_portrait_cuts
+from hotsdraft_overlay.cache import FeatureCache
+from hotsdraft_overlay.data import DataProvider
+from hotsdraft_overlay.matching import CutMatcher
+
+
+@pytest.fixture(scope="module")
+def data_provider(tmp_path_factory):
+    return DataProvider(feature_cache=FeatureCache(tmp_path_factory.mktemp("features")))
+
+
+def get_baseline_score(data_provider: DataProvider, portrait, cut_features) -> float:
+    # How candidates used to be scored, the sum of the squared distances of the matches that passed the ratio test
+    # and of their second nearest neighbours, highest first.
+    backend = data_provider.get_feature_backend()
+    distances, train_indices = utils.match_features(portrait.features, cut_features, backend)
+    query_indices, _ = utils.apply_ratio_test(distances, train_indices, backend.ratio)
+    distances = distances[query_indices].astype(np.float64)
+    return float(np.sum(distances[:, 0] ** 2 + distances[:, 1] ** 2))
+
+
+@pytest.mark.parametrize("prefilter_top_k", [0, 5])
+def test_winner_unchanged_from_distance_score(data_provider, prefilter_top_k):
+    portraits = {portrait.hero.name: portrait for portrait in data_provider.get_portraits()}
+    cut_matcher = CutMatcher(data_provider, prefilter_top_k=prefilter_top_k)
+    backend = data_provider.get_feature_backend()
+
+    matched = 0
+    for hero_name, cut in make_portrait_cuts(list(portraits.values()), [64, 100]):
+        candidates = cut_matcher.match_candidates(cut)
+        if not candidates:
+            continue
+        cut_features = utils.extract_features(cut.planes.gray, backend)
+        baseline = max(candidates, key=lambda candidate: get_baseline_score(
+            data_provider, portraits[candidate.hero.name], cut_features
+        ))
+        assert candidates[0].hero.name == baseline.hero.name == hero_name
+        matched += 1
+
+    assert matched >= 0.95 * 2 * len(portraits)
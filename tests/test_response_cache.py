@@ -0,0 +1,96 @@
+import json
+import time
+
+import pytest
+
+from hotsdraft_overlay import cache
+from hotsdraft_overlay.cache import ResponseCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "time", lambda: now[0])
+    return now
+
+
+def test_entries_expire_after_ttl(clock):
+    response_cache = ResponseCache(ttl=10)
+    response_cache.put("key", [1])
+    clock[0] += 10
+    assert response_cache.get("key") == [1]
+    clock[0] += 1
+    assert response_cache.get("key") is None
+    stats = response_cache.get_stats()
+    assert (stats.hits, stats.misses) == (1, 1)
+
+
+def test_expired_entries_are_served_when_allowed(clock):
+    response_cache = ResponseCache(ttl=10)
+    response_cache.put("key", [1])
+    clock[0] += 60
+    assert response_cache.get("key", allow_expired=True) == [1]
+    assert response_cache.get("missing", allow_expired=True) is None
+    # Fallback lookups are not counted.
+    stats = response_cache.get_stats()
+    assert (stats.hits, stats.misses) == (0, 0)
+
+
+def test_least_recently_used_entry_is_evicted():
+    response_cache = ResponseCache(max_entries=2)
+    response_cache.put("a", 1)
+    response_cache.put("b", 2)
+    assert response_cache.get("a") == 1
+    response_cache.put("c", 3)
+    assert response_cache.get("b") is None
+    assert response_cache.get("a") == 1
+    assert response_cache.get("c") == 3
+    assert response_cache.get_stats().entries == 2
+
+
+def test_entries_survive_restart(tmp_path):
+    path = tmp_path / "responses.json"
+    response_cache = ResponseCache(path=path, flush_delay=60)
+    response_cache.put("key", {"value": 1})
+    # Writes are deferred.
+    assert not path.exists()
+    response_cache.close()
+
+    assert ResponseCache(path=path).get("key") == {"value": 1}
+
+
+def test_changes_are_flushed_after_delay(tmp_path):
+    path = tmp_path / "responses.json"
+    response_cache = ResponseCache(path=path, flush_delay=0.01)
+    response_cache.put("key", 1)
+    for _ in range(100):
+        if path.exists():
+            break
+        time.sleep(0.01)
+    assert ResponseCache(path=path).get("key") == 1
+    response_cache.close()
+
+
+def test_file_of_another_version_is_ignored(tmp_path):
+    path = tmp_path / "responses.json"
+    response_cache = ResponseCache(path=path)
+    response_cache.put("key", 1)
+    response_cache.close()
+
+    with path.open() as fd:
+        data = json.load(fd)
+    data["version"] += 1
+    with path.open("w") as fd:
+        json.dump(data, fd)
+
+    assert ResponseCache(path=path).get("key") is None
+
+
+def test_failed_write_leaves_no_temporary_files(tmp_path):
+    path = tmp_path / "responses.json"
+    response_cache = ResponseCache(path=path)
+    # Not JSON serializable.
+    response_cache.put("key", object())
+    response_cache.close()
+
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,63 @@
+import pathlib
+
+import cv2
+import numpy as np
+import pytest
+
+from hotsdraft_overlay import utils
+from hotsdraft_overlay.models import Portrait, Hero, Point
+from hotsdraft_overlay.slots import LockDetector, get_interior, get_lock_statistics
+
+PORTRAITS = sorted((pathlib.Path(__file__).parent.parent / "hotsdraft_overlay" / "portraits").glob("*.png"))
+
+
+def make_portrait(path: pathlib.Path, image: np.ndarray) -> Portrait:
+    h, w = image.shape[:2]
+    return Portrait(Hero(path.stem, None), path, Point(w, h), None, None, get_lock_statistics(image), image)
+
+
+def get_luminosity(image: np.ndarray) -> np.ndarray:
+    return cv2.cvtColor(image, cv2.COLOR_BGR2YCrCb)[:, :, 0]
+
+
+def get_baseline_locked_status(portrait_image: np.ndarray, draft_image: np.ndarray) -> bool:
+    # How lock status used to be worked out, by shrinking whichever of the two is taller to the height of the other,
+    # and comparing the variances of luminosity of their interiors.
+    if draft_image.shape[0] > portrait_image.shape[0]:
+        draft_image = utils.resize(draft_image, height=portrait_image.shape[0])
+    else:
+        portrait_image = utils.resize(portrait_image, height=draft_image.shape[0])
+    _, portrait_deviations = cv2.meanStdDev(get_luminosity(get_interior(portrait_image)))
+    _, draft_deviations = cv2.meanStdDev(get_luminosity(get_interior(draft_image)))
+    return portrait_deviations[0][0] ** 2 / draft_deviations[0][0] ** 2 < 2.5
+
+
+def make_draft_image(image: np.ndarray, height: int, brightness: float) -> np.ndarray:
+    # The portrait as shown in a slot of the given height, dimmed when the hero is not locked in yet.
+    h, w = image.shape[:2]
+    interpolation = cv2.INTER_AREA if height < h else cv2.INTER_LINEAR
+    scaled = cv2.resize(image, (int(round(w * height / float(h))), height), interpolation=interpolation)
+    return np.clip(scaled.astype(np.float32) * brightness, 0, 255).astype(np.uint8)
+
+
+@pytest.mark.parametrize("height", [40, 56, 72, 90, 120, 160, 212, 320])
+def test_lock_decisions_unchanged(height):
+    lock_detector = LockDetector()
+    for path in PORTRAITS:
+        image = cv2.imread(path.as_posix())
+        portrait = make_portrait(path, image)
+        # Dimming to 0.6 to 0.7 of the brightness is near the threshold, where only agreeing with the baseline counts.
+        for brightness in (1.0, 0.8, 0.7, 0.6, 0.55, 0.4):
+            draft_image = make_draft_image(image, height, brightness)
+            locked, _ = lock_detector.get_locked_status(portrait, get_luminosity(draft_image))
+            assert locked == get_baseline_locked_status(image, draft_image), (path.stem, brightness)
+            if not 0.6 <= brightness <= 0.7:
+                assert locked == (brightness >= 0.8), (path.stem, brightness)
+
+
+def test_flat_portrait():
+    image = np.full((212, 180, 3), 128, dtype=np.uint8)
+    portrait = make_portrait(pathlib.Path("flat.png"), image)
+    locked, confidence = LockDetector().get_locked_status(portrait, get_luminosity(make_draft_image(image, 90, 0.5)))
+    assert locked is True
+    assert 0 <= confidence <= 1
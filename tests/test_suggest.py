@@ -0,0 +1,189 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs
+
+import pytest
+
+from hotsdraft_overlay.cache import ResponseCache
+from hotsdraft_overlay.models import Hero, DraftHero, DraftState, Rect, Point, Region
+from hotsdraft_overlay.suggest import SuggestionClient, Suggester, CircuitBreaker, CircuitOpenError
+
+
+class StandInServer(object):
+    # Local stand-in for the suggestion backend, answering every request after delay seconds with status.
+    def __init__(self):
+        self.delay = 0
+        self.status = 200
+        self.requests = []
+        self.clients = set()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode()
+                server.requests.append(parse_qs(body))
+                server.clients.add(self.client_address)
+                time.sleep(server.delay)
+
+                body = json.dumps({"scores": [{"id": 1, "score": 10}, {"id": 2, "score": 20}]}).encode()
+                self.send_response(server.status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.__server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.__server.daemon_threads = True
+        self.__thread = threading.Thread(target=self.__server.serve_forever, daemon=True)
+        self.__thread.start()
+
+    @property
+    def url(self) -> str:
+        return "http://127.0.0.1:%d/draft/list/" % self.__server.server_address[1]
+
+    def close(self):
+        self.__server.shutdown()
+        self.__server.server_close()
+
+
+class StandInDataProvider(object):
+    def get_map_id(self, map_name):
+        return {"cursed hollow": 3}.get(map_name)
+
+    def get_hero_by_id(self, hero_id):
+        return Hero("hero %d" % hero_id, hero_id)
+
+
+@pytest.fixture
+def server():
+    server = StandInServer()
+    yield server
+    server.close()
+
+
+def make_client(server, **kwargs):
+    kwargs.setdefault("hedge_percentile", None)
+    return SuggestionClient(server.url, **kwargs)
+
+
+def make_draft_state(locked: bool) -> DraftState:
+    box = Rect(Point(0, 0), Point(10, 10))
+    return DraftState(
+        "cursed hollow",
+        ally_picks=[DraftHero("ally", 1, locked, box, Region.ALLY_PICKS)],
+        enemy_picks=[DraftHero("enemy", 2, True, box, Region.ENEMY_PICKS)],
+    )
+
+
+def test_connections_are_reused(server):
+    client = make_client(server)
+    for idx in range(5):
+        assert client.fetch(str(idx), {"map": idx}) == [{"id": 1, "score": 10}, {"id": 2, "score": 20}]
+    client.close()
+
+    assert len(server.requests) == 5
+    assert len(server.clients) == 1
+
+
+def test_identical_requests_in_flight_are_coalesced(server):
+    server.delay = 0.2
+    client = make_client(server)
+    with ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(lambda _: client.fetch("key", {"map": 1}), range(4)))
+    client.close()
+
+    assert len(server.requests) == 1
+    assert all(result == results[0] for result in results)
+
+
+def test_locked_and_unlocked_variants_are_fetched_once(server):
+    cache = ResponseCache()
+    suggester = Suggester(StandInDataProvider(), cache=cache, client=make_client(server))
+    annotation = suggester.get_annotation(make_draft_state(locked=True), timeout=5)
+    suggester.close()
+
+    # One draft and one ban request, each looked up in the cache once.
+    assert len(server.requests) == 2
+    assert cache.get_stats().misses == 2
+    assert annotation.pick_suggestions == annotation.unlocked_pick_suggestions
+    assert [suggestion.hero.id for suggestion in annotation.pick_suggestions] == [2, 1]
+
+
+def test_slow_backend_falls_back_to_stale_answers_within_timeout(server):
+    # Entries expire right away, but are kept as a fallback.
+    cache = ResponseCache(ttl=0)
+    suggester = Suggester(StandInDataProvider(), cache=cache, client=make_client(server))
+    draft_state = make_draft_state(locked=False)
+    fresh = suggester.get_annotation(draft_state, timeout=5)
+    assert len(server.requests) == 4
+
+    server.delay = 1
+    started = time.monotonic()
+    stale = suggester.get_annotation(draft_state, timeout=0.2)
+    elapsed = time.monotonic() - started
+    suggester.close()
+
+    # All four variants share the timeout, rather than each getting its own.
+    assert elapsed < 0.6
+    assert stale.pick_suggestions == fresh.pick_suggestions
+    assert stale.unlocked_ban_suggestions == fresh.unlocked_ban_suggestions
+
+
+def test_slow_backend_without_stale_answers_gives_no_suggestions(server):
+    server.delay = 1
+    suggester = Suggester(StandInDataProvider(), cache=ResponseCache(), client=make_client(server))
+    annotation = suggester.get_annotation(make_draft_state(locked=False), timeout=0.2)
+    suggester.close()
+
+    assert annotation.pick_suggestions == []
+    assert annotation.ban_suggestions == []
+
+
+def test_circuit_breaker_opens_and_half_opens():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.1)
+    breaker.record_failure()
+    assert breaker.allow_request()
+    assert not breaker.is_open
+
+    breaker.record_failure()
+    assert breaker.is_open
+    assert not breaker.allow_request()
+
+    # Half open: a single trial request is let through once the reset timeout passed.
+    time.sleep(0.15)
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+
+    # A failed trial opens the circuit for another reset timeout.
+    breaker.record_failure()
+    assert not breaker.allow_request()
+    time.sleep(0.15)
+    assert breaker.allow_request()
+
+    # A successful trial closes it.
+    breaker.record_success()
+    assert not breaker.is_open
+    assert breaker.allow_request()
+    assert breaker.allow_request()
+
+
+def test_open_circuit_stops_requests(server):
+    server.status = 503
+    client = make_client(server, circuit_breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60))
+    for idx in range(2):
+        with pytest.raises(Exception):
+            client.fetch(str(idx), {"map": idx})
+    assert client.circuit_breaker.is_open
+
+    with pytest.raises(CircuitOpenError):
+        client.fetch("2", {"map": 2})
+    client.close()
+    assert len(server.requests) == 2
@@ -0,0 +1,86 @@
+import ctypes
+import os
+
+import numpy as np
+import pytest
+
+from hotsdraft_overlay import x11
+from hotsdraft_overlay.models import Rect, Point
+
+
+# Needs an X server with MIT-SHM, such as Xvfb :99 -screen 0 1920x1080x24 with DISPLAY=:99.
+@pytest.fixture
+def capture():
+    if not os.environ.get("DISPLAY"):
+        pytest.skip("No X display")
+    try:
+        capture = x11.X11ShmCapture()
+    except x11.X11Error as e:
+        pytest.skip(str(e))
+    yield capture
+    capture.close()
+
+
+@pytest.fixture
+def allocations(monkeypatch):
+    created = []
+
+    class CountingSharedImage(x11._SharedImage):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            created.append(self)
+
+    monkeypatch.setattr(x11, "_SharedImage", CountingSharedImage)
+    return created
+
+
+def test_buffer_reused_across_frames(capture, allocations):
+    first = capture.grab(capture.root_window)
+    assert first is not None
+    address = first.ctypes.data
+
+    for _ in range(5):
+        frame = capture.grab(capture.root_window)
+        assert frame is first
+        assert frame.ctypes.data == address
+    assert len(allocations) == 1
+
+
+def test_buffer_per_region_size(capture, allocations):
+    small = Rect(Point(0, 0), Point(64, 32))
+    large = Rect(Point(0, 0), Point(128, 64))
+
+    first_small = capture.grab(capture.root_window, small)
+    first_large = capture.grab(capture.root_window, large)
+    assert first_small.shape == (32, 64, 4)
+    assert first_large.shape == (64, 128, 4)
+    assert not np.shares_memory(first_small, first_large)
+
+    assert capture.grab(capture.root_window, small).ctypes.data == first_small.ctypes.data
+    assert capture.grab(capture.root_window, large).ctypes.data == first_large.ctypes.data
+    assert len(allocations) == 2
+
+
+def test_errors_are_per_display(capture):
+    other = x11.X11ShmCapture()
+    try:
+        # A window that does not exist fails on one display, without failing the other.
+        assert capture.get_window_rect(0x7fffffff) is None
+        assert other.grab(other.root_window) is not None
+        assert capture.grab(capture.root_window) is not None
+    finally:
+        other.close()
+
+
+def test_errors_recorded_per_display():
+    # Runs without an X server, by calling the handler as Xlib would.
+    event = x11._XErrorEvent(error_code=3)
+    x11._on_error(1, ctypes.pointer(event))
+    try:
+        assert x11._get_error(1) == 3
+        assert x11._get_error(2) is None
+        x11._clear_error(2)
+        assert x11._get_error(1) == 3
+    finally:
+        x11._clear_error(1)
+    assert x11._get_error(1) is None